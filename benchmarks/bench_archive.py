@@ -0,0 +1,88 @@
+"""Compare l'ancien format d'archive (historique complet réécrit en JSON indenté à chaque
+débordement) et l'archive append-only compressée : octets sur disque et latence d'écriture.
+
+Usage: python -m benchmarks.bench_archive --messages 5000 --max-history 10
+"""
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from src.utils.conversation_archive import ConversationArchive
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def disk_usage(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def synthetic_messages(count, seed):
+    rng = random.Random(seed)
+    words = "le la les un une des bot discord réponse question modèle latence coût serveur code python".split()
+    start = datetime(2024, 11, 1)
+    return [
+        {
+            'role': 'user' if i % 2 == 0 else 'assistant',
+            'content': ' '.join(rng.choices(words, k=rng.randint(10, 120))),
+            'timestamp': (start + timedelta(seconds=30 * i)).isoformat(timespec='seconds')
+        }
+        for i in range(count)
+    ]
+
+def bench_legacy(messages, max_history, directory):
+    """Ancien comportement : à chaque débordement, réécriture de tout l'historique en JSON indenté"""
+    history, latencies = [], []
+    for index, message in enumerate(messages):
+        history.append(message)
+        if len(history) > max_history * 2:
+            start = time.perf_counter()
+            with open(f"{directory}/42_{index:08d}.json", 'w', encoding='utf-8') as f:
+                json.dump({'channel_id': 42, 'timestamp': str(index), 'messages': history}, f, ensure_ascii=False, indent=2)
+            latencies.append(time.perf_counter() - start)
+            history = history[-max_history * 2:]
+    return latencies
+
+def bench_append(messages, directory):
+    """Nouveau comportement : un enregistrement compact ajouté par message, segments compressés"""
+    archive = ConversationArchive(directory)
+    latencies = []
+    for message in messages:
+        start = time.perf_counter()
+        archive.append(42, [message])
+        latencies.append(time.perf_counter() - start)
+    archive.rotate(42)
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark du format d'archive des conversations")
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--max-history', type=int, default=10)
+    parser.add_argument('--segment-bytes', type=int, default=256 * 1024)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    os.environ['ARCHIVE_SEGMENT_MAX_BYTES'] = str(args.segment_bytes)
+    messages = synthetic_messages(args.messages, args.seed)
+    root = tempfile.mkdtemp()
+    try:
+        legacy_dir, append_dir = f"{root}/legacy", f"{root}/append"
+        os.makedirs(legacy_dir)
+        legacy = bench_legacy(messages, args.max_history, legacy_dir)
+        appended = bench_append(messages, append_dir)
+
+        print(f"{args.messages} messages, MAX_HISTORY={args.max_history}")
+        print(f"{'format':<12} {'octets':>12} {'fichiers':>9} {'écritures':>10} {'p50':>9} {'p99':>9} {'total':>9}")
+        for name, directory, latencies in (('legacy', legacy_dir, legacy), ('append', append_dir, appended)):
+            files = sum(len(names) for _, _, names in os.walk(directory))
+            print(f"{name:<12} {disk_usage(directory):>12,} {files:>9,} {len(latencies):>10,} "
+                  f"{percentile(latencies, 50) * 1e3:>7.3f}ms {percentile(latencies, 99) * 1e3:>7.3f}ms "
+                  f"{sum(latencies):>8.2f}s")
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""Mémoire et temps de démarrage des profils de passerelle Discord (GATEWAY_PROFILE=full|lean).
+
+Sans connexion à Discord : les événements envoyés par la passerelle au démarrage (GUILD_CREATE, puis
+GUILD_MEMBERS_CHUNK quand le profil met les membres en cache) et un flux de MESSAGE_CREATE sont
+synthétisés et donnés à l'état de connexion de discord.py, avec les options de chaque profil, dans un
+processus neuf par profil. Le temps mesuré est celui du traitement local ; en production, les membres
+arrivent en plus par paquets de 1000 soumis à la limite de débit de la passerelle.
+
+Le profil lean-slash correspond à COMMAND_MODE=slash : les MESSAGE_CREATE ne sont plus transmis.
+
+Usage: python -m benchmarks.bench_gateway [--guilds 3] [--members 100000] [--messages 5000]
+"""
+import gc
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import subprocess
+from datetime import datetime, timezone
+
+PROFILES = ('full', 'lean', 'lean-slash')  # lean-slash : GATEWAY_PROFILE=lean et COMMAND_MODE=slash
+BOT_ID = 1000
+CHANNELS_PER_GUILD = 50
+ROLES_PER_GUILD = 20
+CHUNK_SIZE = 1000  # membres par GUILD_MEMBERS_CHUNK, comme la passerelle
+JOINED_AT = datetime(2024, 1, 1, tzinfo=timezone.utc).isoformat()
+
+
+def rss_bytes():
+    """Mémoire résidente actuelle du processus"""
+    with open('/proc/self/status', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def user(user_id):
+    return {'id': str(user_id), 'username': f"membre{user_id}", 'discriminator': '0', 'avatar': None, 'global_name': None}
+
+def member(user_id, guild_id):
+    return {
+        'user': user(user_id), 'roles': [str(guild_id * 100 + 1 + user_id % ROLES_PER_GUILD)],
+        'joined_at': JOINED_AT, 'deaf': False, 'mute': False, 'nick': None, 'flags': 0
+    }
+
+def guild_payload(guild_id, members):
+    roles = [{
+        'id': str(guild_id if index == 0 else guild_id * 100 + index), 'name': '@everyone' if index == 0 else f"rôle{index}",
+        'permissions': '0', 'position': index, 'color': 0, 'hoist': False, 'managed': False, 'mentionable': False
+    } for index in range(ROLES_PER_GUILD + 1)]
+    channels = [{
+        'id': str(guild_id * 1000 + index), 'type': 0, 'name': f"salon{index}", 'position': index,
+        'permission_overwrites': [], 'nsfw': False, 'parent_id': None
+    } for index in range(CHANNELS_PER_GUILD)]
+    return {
+        'id': str(guild_id), 'name': f"serveur{guild_id}", 'owner_id': '1', 'member_count': members, 'large': True,
+        'roles': roles, 'channels': channels, 'members': [member(BOT_ID, guild_id)], 'threads': [], 'emojis': [],
+        'stickers': [], 'features': [], 'presences': [], 'voice_states': [], 'unavailable': False
+    }
+
+def message_payload(message_id, guild_id, author_id):
+    return {
+        'id': str(message_id), 'channel_id': str(guild_id * 1000 + message_id % CHANNELS_PER_GUILD), 'guild_id': str(guild_id),
+        'author': user(author_id), 'member': {'roles': [], 'joined_at': JOINED_AT, 'deaf': False, 'mute': False, 'flags': 0},
+        'content': "message ordinaire d'un membre du serveur " * 4, 'timestamp': JOINED_AT, 'edited_timestamp': None,
+        'tts': False, 'mention_everyone': False, 'mentions': [], 'mention_roles': [], 'attachments': [], 'embeds': [],
+        'pinned': False, 'type': 0
+    }
+
+
+async def measure(profile, args):
+    """Traite les événements synthétiques avec les options du profil et retourne les mesures"""
+    import discord
+    from discord.ext import commands
+    from discord.state import ChunkRequest
+    from src.bot.client import gateway_options
+
+    gateway_profile, _, command_mode = profile.partition('-')
+    options = gateway_options(gateway_profile, message_events=command_mode != 'slash')
+    bot = commands.Bot(command_prefix='!', help_command=None, **options)
+    state = bot._connection
+    state.loop = asyncio.get_running_loop()
+    state.dispatch = lambda *args, **kwargs: None  # pas d'écouteurs : seul le cache est mesuré
+    state.user = discord.ClientUser(state=state, data=user(BOT_ID))
+
+    gc.collect()
+    baseline = rss_bytes()
+    start = time.perf_counter()
+    chunked = 0
+    for guild_index in range(args.guilds):
+        guild_id = 10_000 + guild_index
+        guild = state._get_create_guild(guild_payload(guild_id, args.members))
+        if state._guild_needs_chunking(guild):
+            # Réponses à la demande de membres faite par discord.py au démarrage (chunk_guilds_at_startup)
+            request = ChunkRequest(guild.id, 0, state.loop, state._get_guild, cache=state.member_cache_flags.joined)
+            state._chunk_requests[request.nonce] = request
+            count = -(-args.members // CHUNK_SIZE)
+            for index in range(count):
+                ids = range(2_000_000 + index * CHUNK_SIZE, 2_000_000 + min(args.members, (index + 1) * CHUNK_SIZE))
+                state.parse_guild_members_chunk({
+                    'guild_id': str(guild_id), 'members': [member(user_id, guild_id) for user_id in ids],
+                    'chunk_index': index, 'chunk_count': count, 'nonce': request.nonce
+                })
+            chunked += 1
+    startup = time.perf_counter() - start
+    gc.collect()
+    after_startup = rss_bytes()
+
+    # La passerelle ne transmet MESSAGE_CREATE qu'avec l'intent des messages de serveur
+    delivered = args.messages if options['intents'].guild_messages else 0
+    start = time.perf_counter()
+    for index in range(delivered):
+        guild_id = 10_000 + index % args.guilds
+        state.parse_message_create(message_payload(5_000_000 + index, guild_id, 2_000_000 + index % args.members))
+    messages_seconds = time.perf_counter() - start
+    gc.collect()
+    after_messages = rss_bytes()
+
+    return {
+        'profile': profile,
+        'intents': options['intents'].value,
+        'chunked_guilds': chunked,
+        'cached_members': sum(len(guild.members) for guild in state.guilds),
+        'message_events': delivered,
+        'cached_messages': len(state._messages or ()),
+        'startup_seconds': startup,
+        'startup_rss': after_startup - baseline,
+        'messages_seconds': messages_seconds,
+        'total_rss': after_messages - baseline
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Mémoire et démarrage des profils de passerelle")
+    parser.add_argument('--guilds', type=int, default=3)
+    parser.add_argument('--members', type=int, default=100_000, help="membres par serveur")
+    parser.add_argument('--messages', type=int, default=5000, help="messages reçus après le démarrage")
+    parser.add_argument('--profile', choices=PROFILES, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.profile:
+        print(json.dumps(asyncio.run(measure(args.profile, args))))
+        return
+
+    print(f"{args.guilds} serveurs × {args.members:,} membres, {args.messages:,} messages reçus ensuite\n")
+    print(f"{'profil':<11} {'membres en cache':>17} {'MESSAGE_CREATE reçus':>21} {'messages en cache':>18} {'démarrage':>10} "
+          f"{'RSS démarrage':>14} {'messages':>9} {'RSS total':>10}")
+    for profile in PROFILES:
+        # Processus neuf par profil : la RSS de l'un n'influence pas l'autre
+        result = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_gateway', '--profile', profile, '--guilds', str(args.guilds),
+             '--members', str(args.members), '--messages', str(args.messages)],
+            capture_output=True, text=True, check=True
+        )
+        stats = json.loads(result.stdout.strip().splitlines()[-1])
+        print(f"{profile:<11} {stats['cached_members']:>17,} {stats['message_events']:>21,} {stats['cached_messages']:>18,} "
+              f"{stats['startup_seconds']:>9.2f}s {stats['startup_rss'] / 1024 / 1024:>11.1f} Mo "
+              f"{stats['messages_seconds']:>8.2f}s {stats['total_rss'] / 1024 / 1024:>7.1f} Mo")
+
+if __name__ == '__main__':
+    main()
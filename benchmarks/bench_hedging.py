@@ -0,0 +1,94 @@
+"""Benchmark du hedging contre le faux serveur local avec une queue de latence injectée.
+
+Compare la distribution de latence (TTFT et totale) sans et avec hedging,
+ainsi que le nombre de relances et de tokens gaspillés.
+
+Usage: python -m benchmarks.bench_hedging --requests 200 --concurrency 10 --tail-prob 0.05
+"""
+import os
+import time
+import asyncio
+import argparse
+import anthropic
+from benchmarks.fake_anthropic_server import start_server
+from src.claude.hedging import RequestHedger
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+async def run_scenario(base_url, hedging, args):
+    os.environ['HEDGING_ENABLED'] = 'true' if hedging else 'false'
+    os.environ['HEDGE_PERCENTILE'] = str(args.percentile)
+    os.environ['HEDGE_MIN_SAMPLES'] = '10'
+    client = anthropic.AsyncAnthropic(api_key='fake', base_url=base_url, max_retries=0, timeout=60.0)
+    hedger = RequestHedger(client)
+
+    # Préchauffage de la fenêtre des TTFT
+    for _ in range(20):
+        await hedger.stream({'model': 'claude-3-5-haiku-20241022', 'max_tokens': 50,
+                             'messages': [{'role': 'user', 'content': 'warmup'}]})
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, hedges, wasted_tokens = [], 0, 0
+
+    async def one(i):
+        nonlocal hedges, wasted_tokens
+        async with semaphore:
+            start = time.monotonic()
+            result = await hedger.stream({
+                'model': 'claude-3-5-haiku-20241022',
+                'max_tokens': 300,
+                'messages': [{'role': 'user', 'content': f"Question {i}"}]
+            })
+            latencies.append(time.monotonic() - start)
+            if result['hedged']:
+                hedges += 1
+                wasted_tokens += sum(l['input_tokens'] + l['output_tokens'] for l in result['losers'])
+
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    await client.close()
+    return {
+        'p50': percentile(latencies, 50),
+        'p90': percentile(latencies, 90),
+        'p99': percentile(latencies, 99),
+        'max': max(latencies),
+        'hedges': hedges,
+        'wasted_tokens': wasted_tokens
+    }
+
+async def main_async(args):
+    config = {
+        'tail_prob': args.tail_prob,
+        'tail_latency': args.tail_latency,
+        'ttft_median': args.ttft_median,
+        'seed': args.seed
+    }
+    results = {}
+    for hedging in (False, True):
+        runner, base_url, _ = await start_server(config)
+        try:
+            results['avec hedging' if hedging else 'sans hedging'] = await run_scenario(base_url, hedging, args)
+        finally:
+            await runner.cleanup()
+
+    print(f"{args.requests} requêtes, concurrence {args.concurrency}, "
+          f"queue {args.tail_prob:.0%} à {args.tail_latency:.0f}s, relance au p{args.percentile:.0f}")
+    print(f"{'scénario':<14} {'p50':>7} {'p90':>7} {'p99':>7} {'max':>7} {'relances':>9} {'tokens perdus':>14}")
+    for name, r in results.items():
+        print(f"{name:<14} {r['p50']:>6.2f}s {r['p90']:>6.2f}s {r['p99']:>6.2f}s {r['max']:>6.2f}s "
+              f"{r['hedges']:>9} {r['wasted_tokens']:>14}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark du hedging")
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--tail-prob', type=float, default=0.05)
+    parser.add_argument('--tail-latency', type=float, default=10.0)
+    parser.add_argument('--ttft-median', type=float, default=0.4)
+    parser.add_argument('--percentile', type=float, default=95)
+    parser.add_argument('--seed', type=int, default=42)
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
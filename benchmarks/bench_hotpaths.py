@@ -0,0 +1,316 @@
+"""Microbenchmarks des chemins chauds du bot qui ne dépendent ni de Discord ni de l'API.
+
+Données synthétiques : chaînes de réponses, réponse de 50 Ko, 5 ans de statistiques journalières,
+100 000 canaux d'historique, archive de 100 000 messages indexés. Les résultats sont enregistrés en JSON pour comparer deux commits.
+
+Usage: python -m benchmarks.bench_hotpaths [--filter cost_tracker] [--compare benchmarks/results/hotpaths_<commit>.json]
+"""
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from collections import defaultdict
+from benchmarks.harness import BenchmarkSuite, commit_info, compare
+
+BOT_ID = 1000
+WORDS = "le la les un une des bot discord réponse question modèle latence coût serveur code python".split()
+MODELS = ['claude-3-5-haiku-20241022', 'claude-3-haiku-20240307', 'claude-3-sonnet-20240229', 'claude-3-opus-20240229']
+
+
+class FakeUser:
+    def __init__(self, user_id, name='utilisateur'):
+        self.id = user_id
+        self.name = name
+
+class FakeMessage:
+    def __init__(self, message_id, author, content):
+        self.id = message_id
+        self.author = author
+        self.content = content
+        self.reference = None
+
+class FakeChannel:
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, content=None, **kwargs):
+        self.sent += 1
+
+class FakeBot:
+    user = FakeUser(BOT_ID, 'bot')
+
+
+def text(rng, chars):
+    words = []
+    length = 0
+    while length < chars:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)[:chars]
+
+def reply_chain(rng, length, chars):
+    """Chaîne de réponses alternant utilisateur (commande !kask, mention) et bot"""
+    user, bot = FakeUser(7), FakeUser(BOT_ID, 'bot')
+    chain = []
+    for index in range(length):
+        if index % 2 == 0:
+            content = f"!kask <@{BOT_ID}> {text(rng, chars)}"
+            chain.append(FakeMessage(index, user, content))
+        else:
+            chain.append(FakeMessage(index, bot, text(rng, chars)))
+    return chain
+
+def synthetic_stats(years, seed):
+    """Statistiques journalières au format de data/stats/all_stats.json"""
+    rng = random.Random(seed)
+    stats = {}
+    day = date.today() - timedelta(days=365 * years)
+    while day <= date.today():
+        models = rng.sample(MODELS, rng.randint(1, 3))
+        daily = {'total_cost': 0.0, 'total_tokens': 0, 'requests': 0, 'model_usage': {}, 'token_usage': {}}
+        for model in models:
+            requests = rng.randint(1, 40)
+            tokens_in, tokens_out = requests * rng.randint(200, 2000), requests * rng.randint(50, 800)
+            daily['model_usage'][model] = requests
+            daily['token_usage'][model] = {'input': tokens_in, 'output': tokens_out}
+            daily['requests'] += requests
+            daily['total_tokens'] += tokens_in + tokens_out
+            daily['total_cost'] += (tokens_in + tokens_out) / 1000 * 0.003
+        daily['hours'] = {str(hour): rng.randint(1, 10) for hour in rng.sample(range(24), 8)}
+        daily['categories'] = {
+            'chat': {'requests': daily['requests'], 'cost': daily['total_cost'], 'tokens': daily['total_tokens']},
+            'summary': {'requests': 2, 'cost': 0.001, 'tokens': 1500}
+        }
+        if rng.random() < 0.2:
+            daily['hedges'] = {'count': 1, 'backup_wins': 1, 'extra_cost': 0.002, 'extra_tokens': 600}
+        if rng.random() < 0.1:
+            daily['images'] = {'count': 2, 'original_tokens': 3000, 'tokens': 1400, 'bytes_in': 900000, 'bytes_out': 200000}
+        stats[day.isoformat()] = daily
+        day += timedelta(days=1)
+    return stats
+
+
+def bench_reply_chain(suite, cog, rng):
+    short_chain = reply_chain(rng, 10, 500)
+    long_chain = reply_chain(rng, 10, 4096)
+    suite.run('reply_chain', 'format_message_chain[10×500]', lambda: cog.format_message_chain(short_chain))
+    suite.run('reply_chain', 'format_message_chain[10×4Ko]', lambda: cog.format_message_chain(long_chain))
+    command = short_chain[0].content
+    suite.run('reply_chain', 'clean_user_content', lambda: cog.clean_user_content(command))
+
+def bench_send_response(suite, cog, rng):
+    channel = FakeChannel()
+    answer = text(rng, 50 * 1024)
+    suite.run('send_response', 'chunking[50Ko]', lambda: cog.send_response(channel, answer, None), is_async=True)
+
+def bench_cost_tracker(suite, args):
+    from src.utils.cost_tracker import CostTracker
+    from src.utils.persistence import persistence
+
+    os.makedirs('data/stats', exist_ok=True)
+    with open('data/stats/all_stats.json', 'w', encoding='utf-8') as f:
+        json.dump(synthetic_stats(args.years, args.seed), f)
+    tracker = CostTracker()
+    first, last = min(tracker.stats), max(tracker.stats)
+    # Période non alignée : débuts et fins de mois et de semaine partiels
+    middle_start = (date.fromisoformat(first) + timedelta(days=17)).isoformat()
+    middle_end = (date.fromisoformat(last) - timedelta(days=11)).isoformat()
+    label = f"{args.years}ans"
+
+    suite.run('cost_tracker', f'build_rollups[{label}]', tracker._build_rollups)
+    suite.run('cost_tracker', f'aggregate_stats[{label}]', lambda: tracker._aggregate_stats(first, last))
+    suite.run('cost_tracker', f'aggregate_stats[{label}, non aligné]', lambda: tracker._aggregate_stats(middle_start, middle_end))
+
+    # Dans la boucle d'événements, comme dans le bot : l'écriture du rapport est confiée au pool de persistance
+    def uncached(period):
+        async def report():
+            tracker.version += 1
+            tracker.generate_report(period)
+        return report
+
+    async def cached():
+        tracker.generate_report('all')
+
+    suite.run('cost_tracker', f'generate_report[all, {label}]', uncached('all'), is_async=True)
+    suite.run('cost_tracker', f'generate_report[période, {label}]', uncached(f"{middle_start}..{middle_end}"), is_async=True)
+    suite.run('cost_tracker', 'generate_report[week]', uncached('week'), is_async=True)
+    suite.run('cost_tracker', 'generate_report[cache]', cached, is_async=True)
+    suite.loop.run_until_complete(persistence.flush())
+
+def bench_conversations(suite, args, rng):
+    from src.utils.conversation_manager import ConversationManager, HistoryMessage
+
+    manager = ConversationManager()
+    # Persistance mesurée séparément (benchmarks.bench_archive) : seul le coût en mémoire est mesuré ici
+    manager._save_conversation = lambda channel_id, messages: None
+    manager.max_bytes = float('inf')
+    now = time.time()
+    for channel_id in range(args.channels):
+        for turn in range(args.history):
+            manager._push(channel_id, HistoryMessage('user' if turn % 2 == 0 else 'assistant', text(rng, 200), now))
+        manager._touch(channel_id)
+
+    channels = [rng.randrange(args.channels) for _ in range(1024)]
+    state = {'index': 0}
+
+    def next_channel():
+        state['index'] = (state['index'] + 1) % len(channels)
+        return channels[state['index']]
+
+    message = text(rng, 200)
+    label = f"{args.channels // 1000}k canaux"
+    suite.run('conversation', f'add_message[{label}]',
+              lambda: manager.add_message(next_channel(), {'role': 'user', 'content': message}))
+    suite.run('conversation', f'get_conversation[{label}]', lambda: manager.get_conversation(next_channel()))
+    suite.run('conversation', f'get_prompt_messages[{label}]', lambda: manager.get_prompt_messages(next_channel()))
+
+def bench_retrieval(suite, args, rng):
+    """Extraits pertinents (BM25) : la durée doit rester stable quand l'archive grandit"""
+    from src.utils.search_index import ConversationSearchIndex
+
+    index = ConversationSearchIndex('data/retrieval')
+    vocabulary = [f"sujet{number}" for number in range(50_000)]
+
+    def message(number):
+        # Mots courants, plus quelques mots d'un grand vocabulaire à distribution de Zipf
+        rare = [vocabulary[min(len(vocabulary) - 1, int(rng.paretovariate(1.0)) - 1)] for _ in range(3)]
+        return {'role': 'user' if number % 2 == 0 else 'assistant', 'content': f"{text(rng, 200)} {' '.join(rare)}",
+                'timestamp': f"2025-01-01T00:00:{number % 60:02d}"}
+
+    queries = [f"{text(rng, 60)} {' '.join(rng.sample(vocabulary[:2000], 3))} ?" for _ in range(64)]
+    state = {'index': 0}
+
+    def related(channel_id):
+        state['index'] = (state['index'] + 1) % len(queries)
+        return index.related(queries[state['index']], channel_id=channel_id, limit=5)
+
+    indexed = 0
+    for size in (args.archive_messages // 10, args.archive_messages):
+        with index.db:
+            while indexed < size:
+                batch = [message(indexed + offset) for offset in range(1000)]
+                index._insert(indexed // 1000 % 20, batch, '')
+                indexed += len(batch)
+        label = f"{size // 1000}k messages"
+        suite.run('retrieval', f'related[{label}]', lambda: related(None))
+        suite.run('retrieval', f'related[{label}, canal]', lambda: related(3))
+
+def history_memory(args, rng):
+    """Octets des historiques mesurés par tracemalloc : ancienne représentation (listes de dicts) et actuelle"""
+    import tracemalloc
+    from src.utils.conversation_manager import ConversationManager
+
+    def measure(build):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        del kept
+        return used
+
+    contents = [[text(rng, 200) for _ in range(args.history)] for _ in range(args.memory_channels)]
+
+    def legacy():
+        # Représentation précédente : defaultdict(list) de dicts, horodatage ISO et datetime par canal
+        conversations, last_activity = defaultdict(list), defaultdict(datetime.now)
+        for channel_id, messages in enumerate(contents):
+            for turn, content in enumerate(messages):
+                role = 'user' if turn % 2 == 0 else 'assistant'
+                conversations[channel_id].append({
+                    'role': role.encode().decode(),  # rôle relu depuis l'archive : une chaîne par message
+                    'content': content.encode().decode(),
+                    'timestamp': datetime.now().isoformat(timespec='seconds')
+                })
+            last_activity[channel_id] = datetime.now()
+        return conversations, last_activity
+
+    def current():
+        manager = ConversationManager()
+        manager._save_conversation = lambda channel_id, messages: None
+        manager.max_bytes = float('inf')
+        for channel_id, messages in enumerate(contents):
+            for turn, content in enumerate(messages):
+                role = 'user' if turn % 2 == 0 else 'assistant'
+                manager.add_message(channel_id, {'role': role.encode().decode(), 'content': content.encode().decode()})
+        current.report = manager.memory_report()
+        return manager
+
+    channels = args.memory_channels
+    print(f"\nMémoire des historiques ({channels:,} canaux × {args.history} messages de 200 caractères, textes compris, tracemalloc)")
+    for label, build in (('listes de dicts (avant)', legacy), ('deques de HistoryMessage', current)):
+        used = measure(build)
+        print(f"  {label:<28} {used / 1024 / 1024:>8.1f} Mo  {used / channels:>8.0f} octets/canal")
+    report = current.report
+    print(f"  estimation du gestionnaire   {report['total_bytes'] / 1024 / 1024:>8.1f} Mo  {report['bytes_per_channel']:>8.0f} octets/canal")
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks des chemins chauds du bot")
+    parser.add_argument('--filter', default=None, help="ne lance que les benchmarks dont le nom (groupe::nom) contient ce texte")
+    parser.add_argument('--rounds', type=int, default=7)
+    parser.add_argument('--min-time', type=float, default=0.05, help="durée minimale d'un tour (secondes)")
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--channels', type=int, default=100_000)
+    parser.add_argument('--history', type=int, default=4, help="messages par canal")
+    parser.add_argument('--archive-messages', type=int, default=100_000, help="messages archivés pour la recherche de contexte")
+    parser.add_argument('--memory-channels', type=int, default=20_000, help="canaux pour la mesure mémoire des historiques")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=None, help="fichier JSON (défaut : benchmarks/results/hotpaths_<commit>.json)")
+    parser.add_argument('--compare', default=None, help="fichier JSON d'un run précédent")
+    parser.add_argument('--threshold', type=float, default=0.10, help="écart de médiane signalé comme régression")
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    output = args.output
+    if output is None:
+        commit = (commit_info()['id'] or 'local')[:10]
+        output = os.path.abspath(f"benchmarks/results/hotpaths_{commit}.json")
+    else:
+        output = os.path.abspath(output)
+    previous = os.path.abspath(args.compare) if args.compare else None
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+
+    # Les modules écrivent dans data/ relatif au dossier courant : tout se passe dans un dossier temporaire
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'benchmark')
+    root = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(root)
+    suite = BenchmarkSuite(rounds=args.rounds, min_time=args.min_time, name_filter=args.filter)
+    try:
+        from src.cogs.claude_commands import ClaudeCommands
+
+        rng = random.Random(args.seed)
+        cog = ClaudeCommands(FakeBot())
+        # Les données d'un groupe (historiques, archive indexée...) ne sont préparées que s'il est retenu par --filter
+        if suite.wants('reply_chain', 'format_message_chain', 'clean_user_content'):
+            bench_reply_chain(suite, cog, rng)
+        if suite.wants('send_response', 'chunking'):
+            bench_send_response(suite, cog, rng)
+        if suite.wants('cost_tracker', 'build_rollups', 'aggregate_stats', 'generate_report'):
+            bench_cost_tracker(suite, args)
+        if suite.wants('conversation', 'add_message', 'get_conversation', 'get_prompt_messages'):
+            bench_conversations(suite, args, rng)
+        if suite.wants('retrieval', 'related'):
+            bench_retrieval(suite, args, rng)
+        if suite.wants('conversation', 'memory'):
+            history_memory(args, rng)
+    finally:
+        suite.close()
+        os.chdir(cwd)
+        shutil.rmtree(root, ignore_errors=True)
+
+    suite.save(output)
+    print(f"\nRésultats enregistrés dans {os.path.relpath(output)}")
+    if previous:
+        regressions = compare(previous, suite.results, args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
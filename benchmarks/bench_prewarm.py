@@ -0,0 +1,205 @@
+"""Latence des relances avec et sans préchauffage sur frappe (PREWARM_ON_TYPING).
+
+Une conversation se poursuit par réponse au dernier message du bot : le bot récupère le message référencé
+puis la chaîne des réponses (ici le message du bot seul, qui ne répond à aucun autre), compile le prompt
+système et appelle l'API. Discord est simulé (latence REST fixe par appel) et l'API est le faux serveur
+local, derrière un relais TCP qui retarde chaque nouvelle connexion (établissement TCP + TLS vers l'API,
+absent en local). Avant chaque relance, le pool de
+connexions est vide, comme après les 5 s d'inactivité que garde httpx par défaut ; avec préchauffage,
+l'utilisateur commence à écrire `--typing` secondes avant d'envoyer sa relance.
+
+Usage: python -m benchmarks.bench_prewarm [--rounds 20] [--discord-latency 0.1] [--connect-latency 0.15]
+"""
+import os
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+from types import SimpleNamespace
+from benchmarks.fake_anthropic_server import start_server
+
+BOT_ID = 1000
+OWNER_ID = 1
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class FakeMessage:
+    def __init__(self, channel, message_id, author_id, content, reference_id=None):
+        self.channel = channel
+        self.id = message_id
+        self.author = SimpleNamespace(id=author_id, name=f"utilisateur{author_id}", display_name=f"utilisateur{author_id}")
+        self.content = content
+        self.attachments = []
+        self.reference = SimpleNamespace(message_id=reference_id) if reference_id else None
+
+    async def edit(self, content=None, **kwargs):
+        await self.channel.rest()
+        self.content = content
+        return self
+
+    async def reply(self, content=None, **kwargs):
+        return await self.channel.send(content)
+
+
+class FakeChannel:
+    """Salon Discord simulé : chaque appel REST attend `latency` secondes"""
+
+    id = 42
+    guild = None
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.messages = {}
+        self.next_id = 10_000
+        self.rest_calls = 0
+        self.last_bot_message = None
+
+    async def rest(self):
+        self.rest_calls += 1
+        await asyncio.sleep(self.latency)
+
+    def add(self, author_id, content, reference_id=None):
+        self.next_id += 1
+        message = FakeMessage(self, self.next_id, author_id, content, reference_id)
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, message_id):
+        await self.rest()
+        return self.messages[message_id]
+
+    async def send(self, content=None, **kwargs):
+        await self.rest()
+        self.last_bot_message = self.add(BOT_ID, content)
+        return self.last_bot_message
+
+    async def typing(self):
+        await self.rest()
+
+
+async def start_relay(host, port, connect_latency, stats):
+    """Relais TCP vers le faux serveur ; chaque nouvelle connexion attend `connect_latency` secondes"""
+
+    async def pipe(reader, writer):
+        try:
+            while data := await reader.read(65536):
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle(reader, writer):
+        stats['connections'] += 1
+        await asyncio.sleep(connect_latency)
+        upstream_reader, upstream_writer = await asyncio.open_connection(host, port)
+        await asyncio.gather(pipe(reader, upstream_writer), pipe(upstream_reader, writer))
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    return server, f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+
+
+async def run_mode(prewarm, args, base_url, stats):
+    """Mesure `args.rounds` relances ; retourne les durées, les appels REST et les connexions par relance"""
+    import anthropic
+    import httpx
+    from src.cogs.claude_commands import ClaudeCommands
+
+    os.environ['PREWARM_ON_TYPING'] = 'true' if prewarm else 'false'
+    bot = SimpleNamespace(user=SimpleNamespace(id=BOT_ID))
+    cog = ClaudeCommands(bot)
+    cog.reply_indicator = 'message'
+    channel = FakeChannel(args.discord_latency)
+
+    def new_client():
+        limits = httpx.Limits(max_connections=1000, max_keepalive_connections=100, keepalive_expiry=cog.prewarm_keepalive)
+        return anthropic.AsyncAnthropic(
+            api_key='benchmark', base_url=base_url, max_retries=0,
+            http_client=anthropic.DefaultAsyncHttpxClient(limits=limits)
+        )
+
+    # Conversation en cours : une première réponse du bot dans le salon
+    cog.client = new_client()
+    await cog.handle_contextual_command(channel.add(OWNER_ID, "!kask première question"), channel.add(OWNER_ID, "contexte"))
+    await cog.client.close()
+
+    durations, rest_calls, connections = [], [], []
+    for round_index in range(args.rounds):
+        # Pool vide : connexions expirées pendant la lecture de la réponse précédente
+        cog.client = new_client()
+        cog.system_prompt_manager.compiled.clear()
+        cog.message_cache.clear()
+        cog.prewarmed_at.clear()
+
+        if prewarm:
+            cog.schedule_prewarm(channel)
+            await asyncio.sleep(args.typing)
+
+        command = channel.add(OWNER_ID, f"!kask relance {round_index}", channel.last_bot_message.id)
+        rest_before, connections_before = channel.rest_calls, stats['connections']
+        start = time.perf_counter()
+        # Même chemin que on_message : message référencé, puis traitement de la commande contextuelle
+        referenced = await cog.fetch_message(channel, command.reference.message_id)
+        await cog.handle_contextual_command(command, referenced)
+        durations.append(time.perf_counter() - start)
+        rest_calls.append(channel.rest_calls - rest_before)
+        connections.append(stats['connections'] - connections_before)
+        await cog.client.close()
+
+    return durations, rest_calls, connections
+
+
+async def main_async(args):
+    runner, server_url, _ = await start_server({
+        'ttft_median': args.ttft, 'ttft_jitter': 0.0, 'tail_prob': 0.0,
+        'output_tokens': 100, 'tokens_per_second': 2000.0, 'seed': 1
+    })
+    host, port = server_url.rsplit('//', 1)[1].split(':')
+    stats = {'connections': 0}
+    relay, base_url = await start_relay(host, int(port), args.connect_latency, stats)
+
+    print(f"{args.rounds} relances, REST Discord {args.discord_latency * 1000:.0f} ms, "
+          f"nouvelle connexion API {args.connect_latency * 1000:.0f} ms, premier token {args.ttft * 1000:.0f} ms\n")
+    print(f"{'mode':<14} {'p50':>8} {'p90':>8} {'moyenne':>8} {'REST/relance':>13} {'connexions':>11}")
+    results = {}
+    for label, prewarm in (('sans', False), ('préchauffage', True)):
+        durations, rest_calls, connections = await run_mode(prewarm, args, base_url, stats)
+        results[label] = sum(durations) / len(durations)
+        print(f"{label:<14} {percentile(durations, 50) * 1000:>6.0f}ms {percentile(durations, 90) * 1000:>6.0f}ms "
+              f"{results[label] * 1000:>6.0f}ms {sum(rest_calls) / len(rest_calls):>13.1f} "
+              f"{sum(connections) / len(connections):>11.1f}")
+    gain = results['sans'] - results['préchauffage']
+    print(f"\nGain moyen par relance : {gain * 1000:.0f} ms ({gain / results['sans']:.0%})")
+
+    relay.close()
+    await relay.wait_closed()
+    await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latence des relances avec et sans préchauffage sur frappe")
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--discord-latency', type=float, default=0.1, help="secondes par appel REST Discord")
+    parser.add_argument('--connect-latency', type=float, default=0.15, help="secondes pour ouvrir une connexion à l'API")
+    parser.add_argument('--ttft', type=float, default=0.4, help="secondes avant le premier token")
+    parser.add_argument('--typing', type=float, default=1.0, help="secondes entre le début de la frappe et l'envoi")
+    args = parser.parse_args()
+
+    # Les modules écrivent dans data/ relatif au dossier courant : tout se passe dans un dossier temporaire
+    root = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        asyncio.run(main_async(args))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""Faux serveur de l'API Messages d'Anthropic, pour les benchmarks locaux.
+
+Répond en streaming (SSE) ou en JSON avec une latence configurable, dont une
+queue de distribution lente injectée avec une probabilité donnée.
+
+Une requête rejouée (benchmarks.replay_traffic) porte un marqueur `[replay:N]` dans son dernier message
+utilisateur : le script du rejeu (config['script'][N]) fixe alors son premier token, son débit et sa taille.
+
+Usage: python -m benchmarks.fake_anthropic_server --port 8765 --tail-prob 0.05 --tail-latency 20
+"""
+import re
+import json
+import uuid
+import random
+import asyncio
+import argparse
+from aiohttp import web
+
+DEFAULT_CONFIG = {
+    'ttft_median': 0.4,  # secondes avant le premier token
+    'ttft_jitter': 0.2,
+    'tail_prob': 0.05,  # probabilité d'une requête anormalement lente
+    'tail_latency': 20.0,  # secondes avant le premier token pour une requête lente
+    'tokens_per_second': 200.0,
+    'output_tokens': 120,
+    'status_code': 200,  # code HTTP forcé (529 pour simuler une surcharge)
+    'error_prob': 0.0,  # probabilité de répondre avec status_code
+    'seed': None
+}
+
+def create_app(config: dict = None) -> web.Application:
+    """Construit l'application aiohttp du faux serveur"""
+    app = web.Application()
+    app['config'] = dict(DEFAULT_CONFIG, **(config or {}))
+    app['random'] = random.Random(app['config']['seed'])
+    app['stats'] = {'requests': 0, 'cancelled': 0, 'tail': 0}
+    app.router.add_post('/v1/messages', handle_messages)
+    app.router.add_get('/v1/models', handle_models)
+    return app
+
+REPLAY_MARKER = re.compile(r"\[replay:(\d+)\]")
+
+def _scripted(config: dict, body: dict) -> dict:
+    """Comportement enregistré d'une requête rejouée (vide hors rejeu)"""
+    script = config.get('script')
+    if not script:
+        return {}
+    for message in reversed(body.get('messages', [])):
+        if message.get('role') != 'user':
+            continue
+        content = message.get('content')
+        if not isinstance(content, str):
+            content = ' '.join(block.get('text', '') for block in content if block.get('type') == 'text')
+        match = REPLAY_MARKER.search(content)
+        return script.get(int(match.group(1)), {}) if match else {}
+    return {}
+
+def _sse(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+def _input_tokens(body: dict) -> int:
+    chars = len(json.dumps(body.get('system', '')))
+    for message in body.get('messages', []):
+        chars += len(json.dumps(message.get('content', '')))
+    return max(1, chars // 4)
+
+async def handle_models(request):
+    return web.json_response({'data': [], 'has_more': False, 'first_id': None, 'last_id': None})
+
+async def handle_messages(request):
+    app = request.app
+    config = app['config']
+    rng = app['random']
+    body = await request.json()
+    app['stats']['requests'] += 1
+
+    if config['error_prob'] and rng.random() < config['error_prob']:
+        return web.json_response(
+            {'type': 'error', 'error': {'type': 'overloaded_error', 'message': 'Overloaded'}},
+            status=config['status_code'],
+            headers={'retry-after': '1'}
+        )
+
+    ttft = max(0.0, rng.gauss(config['ttft_median'], config['ttft_jitter']))
+    if rng.random() < config['tail_prob']:
+        ttft = config['tail_latency']
+        app['stats']['tail'] += 1
+
+    scripted = _scripted(config, body)
+    ttft = scripted.get('ttft', ttft)
+    output_tokens = min(int(body.get('max_tokens', 1000)), scripted.get('output_tokens', config['output_tokens']))
+    tokens_per_second = scripted.get('tokens_per_second', config['tokens_per_second'])
+    input_tokens = _input_tokens(body)
+    message_id = f"msg_{uuid.uuid4().hex[:24]}"
+    words = [f"mot{i} " for i in range(output_tokens)]
+    message = {
+        'id': message_id,
+        'type': 'message',
+        'role': 'assistant',
+        'model': body['model'],
+        'content': [],
+        'stop_reason': None,
+        'stop_sequence': None,
+        'usage': {'input_tokens': input_tokens, 'output_tokens': 1}
+    }
+
+    if not body.get('stream'):
+        await asyncio.sleep(ttft + output_tokens / tokens_per_second)
+        message['content'] = [{'type': 'text', 'text': ''.join(words)}]
+        message['stop_reason'] = 'end_turn'
+        message['usage']['output_tokens'] = output_tokens
+        return web.json_response(message)
+
+    response = web.StreamResponse(headers={'content-type': 'text/event-stream'})
+    await response.prepare(request)
+    try:
+        await response.write(_sse('message_start', {'type': 'message_start', 'message': message}))
+        await asyncio.sleep(ttft)
+        await response.write(_sse('content_block_start', {
+            'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}
+        }))
+        delay = 1 / tokens_per_second
+        for word in words:
+            await response.write(_sse('content_block_delta', {
+                'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': word}
+            }))
+            await asyncio.sleep(delay)
+        await response.write(_sse('content_block_stop', {'type': 'content_block_stop', 'index': 0}))
+        await response.write(_sse('message_delta', {
+            'type': 'message_delta',
+            'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+            'usage': {'output_tokens': output_tokens}
+        }))
+        await response.write(_sse('message_stop', {'type': 'message_stop'}))
+    except ConnectionResetError:
+        # Le client a abandonné le flux (requête perdante d'un hedging, !kstop...)
+        app['stats']['cancelled'] += 1
+    except asyncio.CancelledError:
+        app['stats']['cancelled'] += 1
+        raise
+    return response
+
+async def start_server(config: dict = None, host: str = '127.0.0.1', port: int = 0):
+    """Démarre le serveur dans la boucle courante ; retourne (runner, base_url, app)"""
+    app = create_app(config)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{bound_port}", app
+
+def main():
+    parser = argparse.ArgumentParser(description="Faux serveur de l'API Anthropic")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    for key, value in DEFAULT_CONFIG.items():
+        if key == 'seed':
+            parser.add_argument('--seed', type=int, default=None)
+        else:
+            parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args()
+    config = {key: getattr(args, key) for key in DEFAULT_CONFIG}
+    web.run_app(create_app(config), host=args.host, port=args.port)
+
+if __name__ == '__main__':
+    main()
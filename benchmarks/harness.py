@@ -0,0 +1,172 @@
+"""Mini harnais de microbenchmarks (dans l'esprit de pytest-benchmark, sans dépendance).
+
+Chaque benchmark est répété en plusieurs tours ; le nombre d'itérations par tour est calibré pour
+que chaque tour dure au moins `min_time`. Les résultats sont enregistrés en JSON (même structure
+que `pytest-benchmark --benchmark-json`) pour pouvoir comparer deux commits.
+"""
+import gc
+import sys
+import json
+import time
+import asyncio
+import platform
+import statistics
+import subprocess
+from datetime import datetime
+
+def _git(*args):
+    try:
+        return subprocess.run(['git', *args], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def commit_info():
+    return {
+        'id': _git('rev-parse', 'HEAD'),
+        'branch': _git('rev-parse', '--abbrev-ref', 'HEAD'),
+        'dirty': bool(_git('status', '--porcelain', '--untracked-files=no'))
+    }
+
+def machine_info():
+    return {
+        'node': platform.node(),
+        'processor': platform.processor() or platform.machine(),
+        'python_implementation': platform.python_implementation(),
+        'python_version': platform.python_version(),
+        'system': platform.system(),
+        'release': platform.release()
+    }
+
+
+class BenchmarkSuite:
+    """Exécute des benchmarks synchrones ou asynchrones et collecte leurs statistiques"""
+
+    def __init__(self, rounds=7, min_time=0.05, max_time=5.0, name_filter=None):
+        self.rounds = rounds
+        self.min_time = min_time
+        self.max_time = max_time  # borne la durée d'un benchmark lent
+        self.name_filter = name_filter
+        self.results = []
+        self.loop = asyncio.new_event_loop()
+
+    def selected(self, name):
+        return not self.name_filter or self.name_filter in name
+
+    def wants(self, group, *names):
+        """Indique si le filtre peut retenir un benchmark du groupe (noms sans leurs paramètres), avant de
+        préparer ses données"""
+        if not self.name_filter:
+            return True
+        candidates = [f"{group}::{name}" for name in names] or [f"{group}::"]
+        return any(self.name_filter in candidate or candidate in self.name_filter for candidate in candidates)
+
+    def _timer(self, fn, is_async):
+        """Fonction (itérations) -> durée en secondes, exécutée hors ou dans la boucle d'événements"""
+        if is_async:
+            async def timed(iterations):
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    await fn()
+                return time.perf_counter() - start
+            return lambda iterations: self.loop.run_until_complete(timed(iterations))
+
+        def timed(iterations):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                fn()
+            return time.perf_counter() - start
+        return timed
+
+    def run(self, group, name, fn, is_async=False, **params):
+        """Mesure `fn` (fonction ou coroutine sans argument) et enregistre ses statistiques"""
+        full_name = f"{group}::{name}"
+        if not self.selected(full_name):
+            return None
+        timed = self._timer(fn, is_async)
+
+        # Calibration : itérations nécessaires pour qu'un tour dure au moins min_time
+        iterations = 1
+        while True:
+            duration = timed(iterations)
+            if duration >= self.min_time or iterations >= 1_000_000:
+                break
+            iterations *= 10 if duration < self.min_time / 10 else 2
+
+        samples = []
+        gc_enabled = gc.isenabled()
+        gc.collect()
+        gc.disable()
+        try:
+            budget_start = time.perf_counter()
+            for _ in range(self.rounds):
+                samples.append(timed(iterations) / iterations)
+                if time.perf_counter() - budget_start > self.max_time and len(samples) >= 3:
+                    break
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+        stats = {
+            'min': min(samples),
+            'max': max(samples),
+            'mean': statistics.fmean(samples),
+            'stddev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+            'median': statistics.median(samples),
+            'rounds': len(samples),
+            'iterations': iterations
+        }
+        stats['ops'] = 1 / stats['mean'] if stats['mean'] else 0.0
+        result = {'group': group, 'name': name, 'fullname': full_name, 'params': params or None, 'stats': stats}
+        self.results.append(result)
+        print(f"{full_name:<58} {format_duration(stats['median']):>10} ± {format_duration(stats['stddev']):>9}"
+              f"  ({stats['rounds']}×{stats['iterations']})", flush=True)
+        return result
+
+    def close(self):
+        self.loop.close()
+
+    def save(self, path):
+        data = {
+            'machine_info': machine_info(),
+            'commit_info': commit_info(),
+            'benchmarks': self.results,
+            'datetime': datetime.now().isoformat(timespec='seconds'),
+            'version': 'benchmarks.harness'
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+
+
+def format_duration(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('µs', 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f}{unit}"
+    return f"{seconds / 1e-9:.0f}ns"
+
+def compare(previous_path, results, threshold=0.10):
+    """Affiche l'écart des médianes avec un fichier de résultats précédent ; retourne le nombre de régressions"""
+    with open(previous_path, 'r', encoding='utf-8') as f:
+        previous = json.load(f)
+    before = {bench['fullname']: bench['stats']['median'] for bench in previous['benchmarks']}
+    commit = (previous.get('commit_info') or {}).get('id') or '?'
+
+    print(f"\nComparaison avec {previous_path} (commit {commit[:10]}, seuil {threshold:.0%})")
+    regressions = 0
+    for bench in results:
+        old = before.get(bench['fullname'])
+        new = bench['stats']['median']
+        if old is None:
+            print(f"{bench['fullname']:<58} {'nouveau':>10}")
+            continue
+        ratio = new / old if old else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  ⚠️ régression'
+            regressions += 1
+        elif ratio < 1 - threshold:
+            flag = '  ✅ amélioration'
+        print(f"{bench['fullname']:<58} {format_duration(old):>10} → {format_duration(new):>10} ({ratio - 1:+.1%}){flag}")
+    return regressions
+
+if __name__ == '__main__':
+    sys.exit("Module utilitaire : lancer `python -m benchmarks.bench_hotpaths`")
@@ -0,0 +1,366 @@
+"""Rejeu du trafic enregistré (TRAFFIC_RECORD=true) contre le faux serveur d'API, pour comparer deux versions.
+
+Chaque enveloppe enregistrée redevient une requête adressée à ClaudeCommands, au même instant relatif
+(divisé par `--speed`) : question de même longueur, historique du salon complété jusqu'à la taille
+enregistrée, chaîne de réponses de même profondeur pour les commandes contextuelles. Les salons Discord
+sont simulés (latence REST fixe, appels comptés par requête) ; le faux serveur reproduit le premier token,
+le débit et la taille de réponse enregistrés (`--api-timing fixed` : durées du faux serveur, tailles seules).
+Les commandes slash et les fils sont rejoués comme des !kask ; les pièces jointes ne le sont pas.
+
+Les résultats (latence par type de commande, appels REST) sont enregistrés en JSON ; `--compare` les
+confronte à ceux d'une autre version rejouant la même capture.
+
+Usage: python -m benchmarks.replay_traffic data/traffic/traffic_2025-06-*.jsonl [--speed 2] [--compare <fichier>]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+from types import SimpleNamespace
+from datetime import datetime
+from contextvars import ContextVar
+from benchmarks.fake_anthropic_server import start_server
+from benchmarks.harness import commit_info, machine_info
+
+BOT_ID = 1000
+WORDS = "le la les un une des bot discord réponse question modèle latence coût serveur code python".split()
+ERROR_PREFIXES = ('❌', '⌛')
+
+# Compteurs de la requête rejouée en cours (appels REST Discord, erreur affichée)
+_request_stats = ContextVar('request_stats', default=None)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+def filler(chars, marker=''):
+    """Texte neutre d'environ `chars` caractères, précédé du marqueur de rejeu"""
+    words = [marker] if marker else []
+    length = len(marker)
+    index = 0
+    while length < chars:
+        word = WORDS[index % len(WORDS)]
+        words.append(word)
+        length += len(word) + 1
+        index += 1
+    return ' '.join(words)
+
+
+class FakeMessage:
+    def __init__(self, channel, message_id, author_id, content, reference_id=None):
+        self.channel = channel
+        self.id = message_id
+        self.author = SimpleNamespace(id=author_id, name=f"utilisateur{author_id}", display_name=f"utilisateur{author_id}")
+        self.content = content
+        self.attachments = []
+        self.reference = SimpleNamespace(message_id=reference_id) if reference_id else None
+
+    async def edit(self, content=None, **kwargs):
+        await self.channel.rest(content)
+        self.content = content
+        return self
+
+    async def reply(self, content=None, **kwargs):
+        return await self.channel.send(content)
+
+
+class FakeChannel:
+    """Salon Discord simulé : chaque appel REST attend `latency` secondes et compte pour la requête en cours"""
+
+    guild = None
+
+    def __init__(self, channel_id, latency):
+        self.id = channel_id
+        self.latency = latency
+        self.messages = {}
+        self.next_id = channel_id * 1_000_000
+
+    async def rest(self, content=None):
+        stats = _request_stats.get()
+        if stats is not None:
+            stats['rest_calls'] += 1
+            if content and content.startswith(ERROR_PREFIXES):
+                stats['status'] = 'error'
+        await asyncio.sleep(self.latency)
+
+    def add(self, author_id, content, reference_id=None):
+        self.next_id += 1
+        message = FakeMessage(self, self.next_id, author_id, content, reference_id)
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, message_id):
+        await self.rest()
+        return self.messages[message_id]
+
+    async def send(self, content=None, **kwargs):
+        await self.rest(content)
+        return self.add(BOT_ID, content)
+
+    async def typing(self):
+        await self.rest()
+
+
+class FakeContext:
+    def __init__(self, channel, user_id):
+        self.channel = channel
+        self.guild = None
+        self.author = SimpleNamespace(id=user_id, name=f"utilisateur{user_id}", display_name=f"utilisateur{user_id}")
+        self.message = FakeMessage(channel, 0, user_id, '')
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content)
+
+
+def load(paths):
+    """Enveloppes des captures, dans l'ordre chronologique"""
+    envelopes = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            envelopes.extend(json.loads(line) for line in f if line.strip())
+    return sorted(envelopes, key=lambda envelope: envelope['ts'])
+
+def build_script(envelopes, api_timing):
+    """Comportement du faux serveur pour chaque requête rejouée (marqueur [replay:N])"""
+    script = {}
+    for index, envelope in enumerate(envelopes):
+        entry = {}
+        if envelope.get('output_tokens'):
+            entry['output_tokens'] = envelope['output_tokens']
+        if api_timing == 'recorded' and envelope.get('ttft') is not None and envelope.get('api_seconds'):
+            entry['ttft'] = envelope['ttft']
+            streaming = envelope['api_seconds'] - envelope['ttft']
+            if envelope.get('output_tokens') and streaming > 0:
+                entry['tokens_per_second'] = envelope['output_tokens'] / streaming
+        script[index] = entry
+    return script
+
+
+class Replayer:
+    def __init__(self, cog, args):
+        self.cog = cog
+        self.args = args
+        self.channels = {}
+        self.users = {}
+
+    def channel(self, pseudonym):
+        if pseudonym not in self.channels:
+            self.channels[pseudonym] = FakeChannel(len(self.channels) + 1, self.args.discord_latency)
+        return self.channels[pseudonym]
+
+    def user(self, pseudonym):
+        return self.users.setdefault(pseudonym, len(self.users) + 1)
+
+    def seed_history(self, channel, envelope):
+        """Complète l'historique du salon jusqu'au nombre de messages enregistré (capture commencée en cours)"""
+        manager = self.cog.conversation_manager
+        wanted = max(0, envelope.get('prompt_messages', 1) - 1)
+        missing = wanted - len(manager.conversations.get(channel.id, ()))
+        if missing <= 0:
+            return
+        chars = max(1, (envelope.get('prompt_chars', 0) - envelope.get('question_chars', 0)) // max(1, wanted))
+        for turn in range(missing + missing % 2):
+            manager.add_message(channel.id, {'role': 'user' if turn % 2 == 0 else 'assistant', 'content': filler(chars)})
+
+    def build_chain(self, channel, envelope, user_id):
+        """Chaîne de réponses de la profondeur enregistrée ; retourne son dernier message (réponse du bot)"""
+        depth = max(1, envelope.get('chain_depth', 1))
+        chars = max(1, (envelope.get('prompt_chars', 0) - envelope.get('question_chars', 0)) // depth)
+        previous = None
+        for position in range(depth):
+            author = BOT_ID if (depth - position) % 2 == 1 else user_id
+            previous = channel.add(author, filler(chars), previous.id if previous else None)
+        return previous
+
+    async def replay_after(self, previous, index, envelope):
+        """Rejoue la requête une fois la précédente de la même conversation terminée (l'utilisateur attendait
+        sa réponse ; sans cela, un rejeu plus lent que l'original la ferait remplacer par la suivante)"""
+        if previous is not None:
+            await asyncio.wait([previous])
+        return await self.replay_one(index, envelope)
+
+    async def replay_one(self, index, envelope):
+        stats = {'rest_calls': 0, 'status': 'ok'}
+        _request_stats.set(stats)
+        channel = self.channel(envelope['channel'])
+        user_id = self.user(envelope['user'])
+        model_key = envelope.get('model') if envelope.get('model') in self.cog.models else 'kask'
+        question = filler(envelope.get('question_chars', 0), f"[replay:{index}]")
+
+        start = time.perf_counter()
+        try:
+            if envelope['kind'] == 'contextual':
+                last = self.build_chain(channel, envelope, user_id)
+                command = channel.add(user_id, f"!{model_key} {question}", last.id)
+                # Même chemin que on_message : message référencé, puis commande contextuelle
+                referenced = await self.cog.fetch_message(channel, last.id)
+                await self.cog.handle_contextual_command(command, referenced, model_key)
+            else:
+                self.seed_history(channel, envelope)
+                await self.cog.handle_claude_request(FakeContext(channel, user_id), question, model_key)
+        except asyncio.CancelledError:
+            # Requête remplacée par la suivante du même utilisateur dans le salon (QUEUE_POLICY=supersede)
+            stats['status'] = 'cancelled'
+        except Exception:
+            stats['status'] = 'error'
+        return {
+            'index': index,
+            'kind': envelope['kind'],
+            'latency': time.perf_counter() - start,
+            'recorded_latency': envelope.get('total_seconds'),
+            'rest_calls': stats['rest_calls'],
+            'status': stats['status']
+        }
+
+    async def run(self, envelopes):
+        """Rejoue les requêtes à leur instant relatif (`--speed 0` : l'une après l'autre, sans pause)"""
+        if self.args.speed <= 0:
+            return [await self.replay_one(index, envelope) for index, envelope in enumerate(envelopes)]
+        loop = asyncio.get_running_loop()
+        origin = envelopes[0]['ts']
+        started = loop.time()
+        tasks = []
+        conversations = {}  # (salon, utilisateur) -> dernière requête lancée
+        for index, envelope in enumerate(envelopes):
+            delay = started + (envelope['ts'] - origin) / self.args.speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            key = (envelope['channel'], envelope['user'])
+            task = asyncio.create_task(self.replay_after(conversations.get(key), index, envelope))
+            conversations[key] = task
+            tasks.append(task)
+        return await asyncio.gather(*tasks)
+
+
+def summarize(results):
+    """Latences et appels REST par type de commande (et pour l'ensemble)"""
+    groups = {'all': results}
+    for result in results:
+        groups.setdefault(result['kind'], []).append(result)
+    summary = {}
+    for kind, group in groups.items():
+        latencies = [result['latency'] for result in group if result['status'] == 'ok']
+        summary[kind] = {
+            'requests': len(group),
+            'errors': sum(1 for result in group if result['status'] == 'error'),
+            'cancelled': sum(1 for result in group if result['status'] == 'cancelled'),
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'mean': sum(latencies) / len(latencies) if latencies else 0.0,
+            'rest_calls': sum(result['rest_calls'] for result in group) / len(group)
+        }
+    return summary
+
+def print_summary(summary):
+    print(f"{'commande':<12} {'requêtes':>9} {'erreurs':>8} {'annulées':>9} {'p50':>8} {'p90':>8} {'p99':>8} {'REST/req.':>10}")
+    for kind, stats in summary.items():
+        print(f"{kind:<12} {stats['requests']:>9} {stats['errors']:>8} {stats['cancelled']:>9} {stats['p50'] * 1000:>6.0f}ms "
+              f"{stats['p90'] * 1000:>6.0f}ms {stats['p99'] * 1000:>6.0f}ms {stats['rest_calls']:>10.2f}")
+
+def compare(previous_path, summary, threshold):
+    """Écarts avec le rejeu d'une autre version ; retourne le nombre de régressions"""
+    with open(previous_path, 'r', encoding='utf-8') as f:
+        previous = json.load(f)
+    commit = (previous.get('commit_info') or {}).get('id') or '?'
+    print(f"\nComparaison avec {previous_path} (commit {commit[:10]}, seuil {threshold:.0%})")
+    regressions = 0
+    for kind, stats in summary.items():
+        old = previous['summary'].get(kind)
+        if old is None:
+            print(f"{kind:<12} nouveau")
+            continue
+        for key in ('p50', 'p90', 'rest_calls'):
+            before, after = old[key], stats[key]
+            ratio = after / before if before else (1.0 if not after else float('inf'))
+            flag = ''
+            if ratio > 1 + threshold:
+                flag = '  ⚠️ régression'
+                regressions += 1
+            elif ratio < 1 - threshold:
+                flag = '  ✅ amélioration'
+            unit = (lambda value: f"{value:.2f}") if key == 'rest_calls' else (lambda value: f"{value * 1000:.0f}ms")
+            print(f"{kind:<12} {key:<10} {unit(before):>9} → {unit(after):>9} ({ratio - 1:+.1%}){flag}")
+    return regressions
+
+
+async def main_async(args, envelopes):
+    import anthropic
+    from src.cogs.claude_commands import ClaudeCommands
+    from src.utils.persistence import persistence
+
+    runner, base_url, _ = await start_server({
+        'ttft_median': args.ttft, 'ttft_jitter': 0.0, 'tail_prob': 0.0, 'seed': 1,
+        'script': build_script(envelopes, args.api_timing)
+    })
+    cog = ClaudeCommands(SimpleNamespace(user=SimpleNamespace(id=BOT_ID)))
+    cog.client = anthropic.AsyncAnthropic(api_key='replay', base_url=base_url, max_retries=0)
+    try:
+        results = await Replayer(cog, args).run(envelopes)
+    finally:
+        await cog.client.close()
+        await persistence.flush()
+        await runner.cleanup()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Rejeu du trafic enregistré contre le faux serveur d'API")
+    parser.add_argument('captures', nargs='+', help="fichiers data/traffic/traffic_*.jsonl")
+    parser.add_argument('--speed', type=float, default=1.0, help="facteur d'accélération (0 : requêtes l'une après l'autre)")
+    parser.add_argument('--discord-latency', type=float, default=0.05, help="secondes par appel REST Discord")
+    parser.add_argument('--api-timing', choices=('recorded', 'fixed'), default='recorded')
+    parser.add_argument('--ttft', type=float, default=0.4, help="premier token du faux serveur hors durées enregistrées")
+    parser.add_argument('--limit', type=int, default=None, help="nombre maximal de requêtes rejouées")
+    parser.add_argument('--output', default=None, help="fichier JSON (défaut : benchmarks/results/replay_<commit>.json)")
+    parser.add_argument('--compare', default=None, help="fichier JSON du rejeu d'une autre version")
+    parser.add_argument('--threshold', type=float, default=0.10, help="écart signalé comme régression")
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    envelopes = [envelope for envelope in load(args.captures) if envelope.get('status', 'ok') != 'cancelled']
+    envelopes = envelopes[:args.limit] if args.limit else envelopes
+    if not envelopes:
+        sys.exit("Aucune requête à rejouer")
+    output = args.output or f"benchmarks/results/replay_{(commit_info()['id'] or 'local')[:10]}.json"
+    output = os.path.abspath(output)
+    previous = os.path.abspath(args.compare) if args.compare else None
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+
+    duration = (envelopes[-1]['ts'] - envelopes[0]['ts']) / args.speed if args.speed > 0 else 0
+    print(f"{len(envelopes)} requêtes rejouées" + (f" en {duration:.0f}s (vitesse ×{args.speed:g})" if duration else "") + "\n")
+
+    # Les modules écrivent dans data/ relatif au dossier courant : tout se passe dans un dossier temporaire
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'replay')
+    os.environ['TRAFFIC_RECORD'] = 'false'
+    root = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        results = asyncio.run(main_async(args, envelopes))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root, ignore_errors=True)
+
+    summary = summarize(results)
+    print_summary(summary)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'machine_info': machine_info(),
+            'commit_info': commit_info(),
+            'captures': args.captures,
+            'options': {key: value for key, value in vars(args).items() if key not in ('captures', 'output', 'compare')},
+            'summary': summary,
+            'requests': results,
+            'datetime': datetime.now().isoformat(timespec='seconds')
+        }, f, indent=2)
+    print(f"\nRésultats enregistrés dans {os.path.relpath(output)}")
+    if previous and compare(previous, summary, args.threshold) and args.fail_on_regression:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,31 @@
+import time
+STARTED_AT = time.perf_counter()  # avant les imports lourds, pour --profile-startup
+
 import asyncio
 import os
+import sys
+import signal
 from dotenv import load_dotenv
+from src.utils.startup import StartupProfile
 from src.bot.client import DiscordBot
 from src.utils.logger import setup_logger
+from src.utils.persistence import persistence
+
+async def run_bot(bot, token):
+    """Démarre le bot ; Ctrl-C ou SIGTERM le ferment dans sa propre boucle, écritures en attente comprises"""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, lambda: loop.create_task(bot.close()))
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows : Ctrl-C reste géré par KeyboardInterrupt
+    async with bot:
+        await bot.start(token)
 
 def main():
+    profile = StartupProfile(STARTED_AT)
+    profile.mark('imports')
+    
     # Charger les variables d'environnement
     load_dotenv()
     
@@ -24,17 +45,20 @@ def main():
         logger.error(f"Variables d'environnement manquantes : {', '.join(missing_vars)}")
         return
     
-    # Création et démarrage du bot
-    bot = DiscordBot()
+    # Création et démarrage du bot (--profile-startup : rapport de démarrage puis arrêt)
+    bot = DiscordBot(startup_profile=profile, profile_startup='--profile-startup' in sys.argv)
     
     try:
-        asyncio.run(bot.start(os.getenv('DISCORD_TOKEN')))
+        asyncio.run(run_bot(bot, os.getenv('DISCORD_TOKEN')))
+        logger.info("Bot arrêté")
     except KeyboardInterrupt:
         logger.info("Arrêt du bot...")
-        asyncio.run(bot.close())
     except Exception as e:
         logger.error(f"Erreur lors de l'exécution du bot : {e}")
-        asyncio.run(bot.close())
+    finally:
+        # Écrit ce qui n'a pas pu l'être avant l'arrêt de la boucle
+        persistence.close()
+        logger.info("Écritures disque terminées")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,45 +1,122 @@
 import os
+import time
+import asyncio
 import discord
 from discord.ext import commands
 import logging
+from ..utils.persistence import persistence
+from ..utils.startup import StartupProfile
+from ..utils.tracing import tracer
+from ..utils.profiler import profiler
+from ..utils.metrics import metrics
 
-class DiscordBot(commands.Bot):
-    def __init__(self):
-        intents = discord.Intents.default()
-        intents.message_content = True
-        intents.messages = True
-        intents.guild_messages = True
+def gateway_options(profile: str, message_events: bool = True, typing_events: bool = False) -> dict:
+    """Options de connexion à la passerelle Discord selon GATEWAY_PROFILE.
+
+    `full` garde le comportement historique (intent membres, tous les membres mis en cache au démarrage).
+    `lean` ne demande que ce que le bot utilise : serveurs et salons (rôles, fils), messages des serveurs
+    et leur contenu ; aucun membre n'est mis en cache ni demandé au démarrage, et le cache de messages est borné.
+    Sans `message_events` (commandes slash seules), `lean` ne reçoit plus du tout les messages des salons.
+    `typing_events` (préchauffage, PREWARM_ON_TYPING) y ajoute les événements de frappe des serveurs.
+    """
+    if profile == 'lean':
+        intents = discord.Intents.none()
         intents.guilds = True
-        intents.members = True
+        intents.guild_messages = message_events
+        intents.message_content = message_events
+        intents.guild_typing = typing_events
+        return {
+            'intents': intents,
+            'member_cache_flags': discord.MemberCacheFlags.none(),
+            'chunk_guilds_at_startup': False,
+            'max_messages': int(os.getenv('GATEWAY_MAX_MESSAGES', '100')) or None
+        }
+
+    intents = discord.Intents.default()
+    intents.message_content = True
+    intents.messages = True
+    intents.guild_messages = True
+    intents.guilds = True
+    intents.members = True
+    return {'intents': intents}
+
+class DiscordBot(commands.Bot):
+    def __init__(self, startup_profile=None, profile_startup=False):
+        self.gateway_profile = os.getenv('GATEWAY_PROFILE', 'full').lower()
+        # prefix : commandes !k ; slash : commandes slash seules ; both : les deux
+        self.command_mode = os.getenv('COMMAND_MODE', 'prefix').lower()
+        # Les messages des salons ne servent qu'aux commandes préfixées, aux mentions et aux fils du bot
+        message_events = self.command_mode != 'slash' or os.getenv('THREAD_MODE', 'false').lower() == 'true'
+        typing_events = os.getenv('PREWARM_ON_TYPING', 'false').lower() == 'true'
         
         super().__init__(
             command_prefix='!',
-            intents=intents,
-            help_command=None
+            help_command=None,
+            **gateway_options(self.gateway_profile, message_events, typing_events)
         )
         
         self.logger = logging.getLogger('discord_claude_bot')
         self.allowed_user_id = int(os.getenv('ALLOWED_USER_ID'))
+        
+        # Jalons du démarrage ; avec profile_startup, rapport détaillé une fois prêt puis arrêt
+        self.startup_profile = startup_profile or StartupProfile(time.perf_counter())
+        self.profile_startup = profile_startup
+        self.warm_up_task = None
     
     async def setup_hook(self):
         try:
             self.logger.info("Tentative de chargement du cog Claude...")
             await self.load_extension('src.cogs.claude_commands')
-            self.logger.info("Cog Claude chargé avec succès")
+            if self.command_mode in ('slash', 'both'):
+                await self.load_extension('src.cogs.slash_commands')
+            self.startup_profile.mark('setup_hook')
+            self.logger.info(f"Cog Claude chargé avec succès (commandes : {self.command_mode})")
         except Exception as e:
             self.logger.error(f"Erreur lors du chargement du cog Claude: {str(e)}")
             raise e
     
+    async def close(self):
+        """Termine les écritures disque en attente avant de fermer la connexion"""
+        await persistence.flush()
+        await super().close()
+
     async def on_ready(self):
-        self.logger.info(f'Bot connecté en tant que {self.user.name}')
+        self.startup_profile.mark('ready')
+        self.logger.info(
+            f'Bot connecté en tant que {self.user.name} (prêt en {self.startup_profile.marks["ready"]:.2f}s, '
+            f'profil de passerelle {self.gateway_profile})'
+        )
+        
+        # Initialisation différée (client Anthropic, index de recherche) une fois le bot prêt
+        claude_cog = self.get_cog('ClaudeCommands')
+        if claude_cog and self.warm_up_task is None:
+            self.warm_up_task = asyncio.create_task(self._warm_up(claude_cog))
         await self.change_presence(activity=discord.Game(name="!kask pour discuter"))
         
         self.logger.info("Commandes disponibles :")
         for command in self.commands:
             self.logger.info(f"- {command.name}")
+
+    async def _warm_up(self, claude_cog):
+        await claude_cog.warm_up()
+        self.startup_profile.mark('warm_up')
+        self.logger.info(f"Démarrage : {self.startup_profile.summary()}")
+        if self.profile_startup:
+            report = await asyncio.to_thread(self.startup_profile.report)
+            print(report, flush=True)
+            await self.close()
     
+    async def on_typing(self, channel, user, when):
+        """Le propriétaire commence à écrire : préchauffage de sa prochaine requête (PREWARM_ON_TYPING)"""
+        if user.id != self.allowed_user_id:
+            return
+        claude_cog = self.get_cog('ClaudeCommands')
+        if claude_cog:
+            claude_cog.schedule_prewarm(channel)
+
     async def on_message(self, message: discord.Message):
         """Gestion des messages reçus"""
+        metrics.incr('gateway.messages')
         if message.author == self.user:
             return
 
@@ -47,12 +124,18 @@ class DiscordBot(commands.Bot):
         if message.mention_everyone or any(role.mention in message.content for role in message.guild.roles):
             return
 
-        # Vérifie si le message est une commande ou mentionne spécifiquement le bot
+        # Vérifie si le message est une commande, mentionne spécifiquement le bot ou poursuit un fil du bot
         is_bot_command = message.content.startswith('!k')
         is_bot_mention = self.user.mentioned_in(message) and not any(role.mention in message.content for role in message.guild.roles)
+        claude_cog = self.get_cog('ClaudeCommands')
+        in_bot_thread = claude_cog is not None and claude_cog.is_bot_thread(message.channel)
         
-        if not (is_bot_command or is_bot_mention):
+        if not (is_bot_command or is_bot_mention or in_bot_thread):
+            return
+        # Commandes slash seules : seuls les messages des fils du bot sont encore traités
+        if self.command_mode == 'slash' and not in_bot_thread:
             return
+        metrics.incr('gateway.messages.handled')
 
         self.logger.info("\n=== Nouveau message reçu ===")
         self.logger.info(f"ID : {message.id}")
@@ -71,30 +154,42 @@ class DiscordBot(commands.Bot):
                     await message.channel.send("Désolé, je ne réponds qu'à mon propriétaire. 🔒")
             return
 
-        claude_cog = self.get_cog('ClaudeCommands')
         if not claude_cog:
             self.logger.error("Le cog ClaudeCommands n'est pas chargé")
             return
 
-        # Vérifier si c'est une commande avec référence
-        if message.reference and message.content.startswith('!k'):
-            try:
-                self.logger.info("=== Commande avec référence détectée ===")
-                referenced_message = await message.channel.fetch_message(message.reference.message_id)
-                self.logger.info(f"Message référencé trouvé :")
-                self.logger.info(f"- Auteur : {referenced_message.author.name}")
-                self.logger.info(f"- Contenu : {referenced_message.content}")
-                self.logger.info(f"- ID : {referenced_message.id}")
-
-                command_content = message.content[2:]  # Enlève '!k'
-                self.logger.info(f"Contenu de la commande : {command_content}")
-                self.logger.info("Transmission au gestionnaire de réponses contextuelles...")
-                await claude_cog.handle_contextual_command(message, referenced_message)
-                return
-            except discord.NotFound:
-                self.logger.warning(f"Message référencé non trouvé : {message.reference.message_id}")
-            except Exception as e:
-                self.logger.error(f"Erreur lors de la gestion de la commande contextuelle : {e}")
-
-        # Traitement normal des commandes
-        await self.process_commands(message)
\ No newline at end of file
+        # Trace de la requête : l'identifiant suit toutes les étapes (chaîne, API, stats, envoi)
+        command = message.content.split(maxsplit=1)[0][:20] if message.content else ''
+        session = profiler.session  # profilage en cours : la requête compte si elle commence pendant la session
+        try:
+            async with tracer.start_trace('on_message', message_id=message.id, command=command):
+                # Message dans un fil du bot : la conversation continue avec l'historique gardé côté bot
+                if in_bot_thread and not is_bot_command:
+                    await claude_cog.handle_thread_message(message)
+                    return
+
+                # Vérifier si c'est une commande avec référence (hors fil du bot)
+                if message.reference and message.content.startswith('!k') and not in_bot_thread:
+                    try:
+                        self.logger.info("=== Commande avec référence détectée ===")
+                        referenced_message = await claude_cog.fetch_message(message.channel, message.reference.message_id)
+                        self.logger.info(f"Message référencé trouvé :")
+                        self.logger.info(f"- Auteur : {referenced_message.author.name}")
+                        self.logger.info(f"- Contenu : {referenced_message.content}")
+                        self.logger.info(f"- ID : {referenced_message.id}")
+
+                        command_content = message.content[2:]  # Enlève '!k'
+                        self.logger.info(f"Contenu de la commande : {command_content}")
+                        self.logger.info("Transmission au gestionnaire de réponses contextuelles...")
+                        await claude_cog.handle_contextual_command(message, referenced_message)
+                        return
+                    except discord.NotFound:
+                        self.logger.warning(f"Message référencé non trouvé : {message.reference.message_id}")
+                    except Exception as e:
+                        self.logger.error(f"Erreur lors de la gestion de la commande contextuelle : {e}")
+
+                # Traitement normal des commandes
+                await self.process_commands(message)
+        finally:
+            if session is not None:
+                session.request_done()
\ No newline at end of file
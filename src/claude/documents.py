@@ -0,0 +1,255 @@
+import os
+import time
+import asyncio
+import logging
+import aiohttp
+from ..utils.metrics import metrics
+
+class DocumentProcessor:
+    """Répond à une question sur un long document joint (logs, texte) par map-reduce.
+
+    Le fichier est téléchargé (au plus DOC_MAX_BYTES) puis découpé en parties d'environ DOC_CHUNK_TOKENS
+    tokens, analysées au plus DOC_CONCURRENCY à la fois ; les notes obtenues sont ensuite fusionnées, par
+    niveaux si nécessaire, en une réponse finale. La durée dépend donc surtout de la concurrence.
+    """
+
+    TEXT_EXTENSIONS = (
+        '.txt', '.log', '.md', '.csv', '.tsv', '.json', '.jsonl', '.xml', '.yaml', '.yml', '.ini', '.cfg',
+        '.py', '.js', '.ts', '.java', '.c', '.cpp', '.h', '.go', '.rs', '.rb', '.php', '.sh', '.sql', '.html', '.css'
+    )
+    CHARS_PER_TOKEN = 4
+
+    def __init__(self, create_message, cost_tracker, models: dict):
+        self.logger = logging.getLogger('discord_claude_bot')
+        self.create_message = create_message
+        self.cost_tracker = cost_tracker
+        self.models = models
+
+        self.inline_tokens = int(os.getenv('DOC_INLINE_TOKENS', '4000'))  # en dessous : fichier inclus tel quel
+        self.chunk_tokens = int(os.getenv('DOC_CHUNK_TOKENS', '6000'))
+        self.concurrency = int(os.getenv('DOC_CONCURRENCY', '4'))
+        self.max_bytes = int(os.getenv('DOC_MAX_BYTES', str(5 * 1024 * 1024)))
+        self.map_model = os.getenv('DOC_MAP_MODEL', 'kask')  # clé de modèle pour l'analyse des parties
+        self.map_max_tokens = int(os.getenv('DOC_MAP_MAX_TOKENS', '500'))
+        self.reduce_max_tokens = int(os.getenv('DOC_REDUCE_MAX_TOKENS', '1500'))
+        self.progress_interval = 1.5  # secondes entre deux mises à jour du message d'attente
+
+        self.session = None
+
+    def text_attachments(self, *messages):
+        """Pièces jointes textuelles des messages Discord donnés"""
+        attachments = []
+        for message in messages:
+            for attachment in message.attachments:
+                content_type = (attachment.content_type or '').split(';')[0].strip()
+                if content_type.startswith('text/') or attachment.filename.lower().endswith(self.TEXT_EXTENSIONS):
+                    attachments.append(attachment)
+        return attachments
+
+    def is_large(self, attachments) -> bool:
+        """Indique si les fichiers justifient le mode document (map-reduce) plutôt qu'une inclusion directe"""
+        return sum(attachment.size for attachment in attachments) > self.inline_tokens * self.CHARS_PER_TOKEN
+
+    async def read_inline(self, attachments) -> str:
+        """Contenu des petits fichiers, à inclure directement dans la question"""
+        contents = await asyncio.gather(*(attachment.read() for attachment in attachments))
+        return "\n\n".join(
+            f"Fichier joint « {attachment.filename} » :\n```\n{data.decode('utf-8', errors='replace')}\n```"
+            for attachment, data in zip(attachments, contents)
+        )
+
+    async def _session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120))
+        return self.session
+
+    async def iter_chunks(self, attachment, stats: dict):
+        """Télécharge un fichier (au plus max_bytes) et produit des parties d'environ chunk_tokens tokens, coupées aux fins de ligne.
+
+        Le fichier est lu en entier avant la première partie : le découpage est consommé au rythme des appels
+        de la phase map, et une connexion laissée en attente pendant ces appels expirerait.
+        """
+        chunk_chars = self.chunk_tokens * self.CHARS_PER_TOKEN
+        data = bytearray()
+        session = await self._session()
+        async with session.get(attachment.url) as response:
+            response.raise_for_status()
+            async for raw in response.content.iter_chunked(64 * 1024):
+                stats['bytes'] += len(raw)
+                if stats['bytes'] > self.max_bytes:
+                    stats['truncated'] = True
+                    break
+                data += raw
+        text = data.decode('utf-8', errors='replace')
+        del data
+        start = 0
+        while len(text) - start >= chunk_chars:
+            cut = text.rfind('\n', start + chunk_chars // 2, start + chunk_chars)
+            cut = cut + 1 if cut != -1 else start + chunk_chars
+            yield text[start:cut]
+            start = cut
+        if text[start:].strip():
+            yield text[start:]
+
+    async def _call(self, model_key, prompt, max_tokens, totals):
+        """Appel à l'API dont le coût est imputé au document"""
+        response, model_key = await self.create_message(
+            model_key,
+            [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
+            max_tokens=max_tokens,
+            temperature=0.2,
+            usage_sink=totals['usage_sink']
+        )
+        cost = self.cost_tracker.track_request(
+            model=self.models[model_key],
+            input_tokens=response.usage.input_tokens,
+            output_tokens=response.usage.output_tokens,
+            category='document'
+        )
+        totals['calls'] += 1
+        totals['input_tokens'] += response.usage.input_tokens
+        totals['output_tokens'] += response.usage.output_tokens
+        totals['cost'] += cost
+        return response.content[0].text
+
+    async def _map(self, semaphore, filename, index, chunk, question, totals, progress):
+        try:
+            prompt = (
+                f"Voici la partie {index} du document « {filename} ».\n"
+                f"Question de l'utilisateur : {question or 'résumer le document'}\n\n"
+                "Relève dans cette partie tout ce qui aide à répondre (faits, erreurs, chiffres, noms, "
+                "courtes citations), sous forme de notes concises et sans préambule. "
+                "Si rien n'est pertinent, réponds « RAS ».\n\n"
+                f"<partie>\n{chunk}\n</partie>"
+            )
+            return await self._call(self.map_model, prompt, self.map_max_tokens, totals)
+        except Exception as e:
+            self.logger.error(f"Document {filename} : échec de l'analyse de la partie {index} : {str(e)}")
+            totals['failed'] += 1
+            return None
+        finally:
+            semaphore.release()
+            totals['done'] += 1
+            await progress()
+
+    async def _reduce(self, notes, question, model_key, totals):
+        """Fusionne les notes ; par groupes successifs tant qu'elles dépassent la taille d'une partie"""
+        budget = self.chunk_tokens * self.CHARS_PER_TOKEN
+        while len("\n\n".join(notes)) > budget and len(notes) > 1:
+            groups, current = [], []
+            for note in notes:
+                if current and len("\n\n".join(current + [note])) > budget:
+                    groups.append(current)
+                    current = []
+                current.append(note)
+            groups.append(current)
+
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def merge(group):
+                async with semaphore:
+                    prompt = (
+                        f"Question de l'utilisateur : {question or 'résumer le document'}\n\n"
+                        "Fusionne ces notes sur des parties successives d'un document en notes plus concises, "
+                        "sans perdre les éléments utiles pour répondre, sans préambule.\n\n" + "\n\n".join(group)
+                    )
+                    return await self._call(self.map_model, prompt, self.map_max_tokens, totals)
+
+            notes = list(await asyncio.gather(*(merge(group) for group in groups)))
+
+        prompt = (
+            "Voici des notes prises sur les parties successives d'un ou plusieurs documents joints.\n\n"
+            + "\n\n".join(notes)
+            + f"\n\nEn t'appuyant sur ces notes, réponds à la demande de l'utilisateur : {question or 'résume le document'}"
+        )
+        return await self._call(model_key, prompt, self.reduce_max_tokens, totals)
+
+    async def answer(self, attachments, question, model_key, on_progress=None, usage_sink=None) -> dict:
+        """Répond à une question sur des fichiers joints ; retourne la réponse et le coût imputé au document.
+
+        Si le traitement est annulé, les tokens consommés par les appels interrompus sont ajoutés à `usage_sink`.
+        """
+        start = time.monotonic()
+        totals = {
+            'chunks': 0, 'done': 0, 'failed': 0, 'calls': 0, 'bytes': 0, 'truncated': False,
+            'input_tokens': 0, 'output_tokens': 0, 'cost': 0.0, 'reading': True, 'usage_sink': usage_sink
+        }
+        last_progress = 0.0
+
+        async def progress(force=False):
+            nonlocal last_progress
+            now = time.monotonic()
+            if on_progress and (force or now - last_progress >= self.progress_interval):
+                last_progress = now
+                try:
+                    await on_progress(totals)
+                except Exception as e:
+                    self.logger.warning(f"Mise à jour de la progression impossible : {str(e)}")
+
+        # Phase map : au plus `concurrency` parties analysées à la fois
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = []
+        try:
+            for attachment in attachments:
+                async for chunk in self.iter_chunks(attachment, totals):
+                    await semaphore.acquire()
+                    totals['chunks'] += 1
+                    tasks.append(asyncio.create_task(
+                        self._map(semaphore, attachment.filename, totals['chunks'], chunk, question, totals, progress)
+                    ))
+            totals['reading'] = False
+            await progress(force=True)
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        if not results:
+            raise ValueError("Le document joint est vide")
+        notes = [
+            f"## Partie {index}\n{note}"
+            for index, note in enumerate(results, start=1)
+            if note and note.strip() != 'RAS'
+        ]
+        if totals['failed'] == len(results):
+            raise RuntimeError("Aucune partie du document n'a pu être analysée")
+
+        # Phase reduce
+        await progress(force=True)
+        text = await self._reduce(notes or ["(aucune information pertinente relevée)"], question, model_key, totals)
+
+        totals['duration'] = time.monotonic() - start
+        totals['answer'] = text
+        totals['filenames'] = [attachment.filename for attachment in attachments]
+        metrics.observe('documents.seconds', totals['duration'])
+        metrics.incr('documents.chunks', totals['chunks'])
+        self.cost_tracker.track_document(totals)
+        return totals
+
+    @staticmethod
+    def format_progress(totals) -> str:
+        """Texte du message d'attente pendant le traitement d'un document"""
+        if totals['reading']:
+            return f"📄 Lecture du document… {totals['done']} partie(s) analysée(s) sur au moins {totals['chunks']}"
+        if totals['done'] < totals['chunks']:
+            return f"📄 {totals['done']}/{totals['chunks']} parties analysées…"
+        return f"📄 {totals['chunks']} parties analysées, synthèse en cours…"
+
+    @staticmethod
+    def format_summary(totals) -> str:
+        """Ligne récapitulative (durée, volume, coût imputé au document)"""
+        line = (
+            f"📄 {', '.join(totals['filenames'])} : {totals['chunks']} parties, {totals['calls']} appels, "
+            f"{totals['input_tokens'] + totals['output_tokens']:,} tokens, ${totals['cost']:.4f}, {totals['duration']:.1f}s"
+        )
+        if totals['failed']:
+            line += f" ⚠️ {totals['failed']} partie(s) en échec"
+        if totals['truncated']:
+            line += " ⚠️ document tronqué"
+        return line
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
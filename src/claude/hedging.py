@@ -0,0 +1,178 @@
+import os
+import time
+import asyncio
+import logging
+from collections import defaultdict, deque
+from ..utils.metrics import metrics
+
+class StreamAttempt:
+    """Un appel en streaming à l'API, primaire ou de secours"""
+
+    def __init__(self, client, params: dict, label: str):
+        self.client = client
+        self.params = params
+        self.model = params['model']
+        self.label = label
+        self.first_token = asyncio.Event()
+        self.ttft = None
+        self.stream = None
+        self.started_at = time.monotonic()
+        self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        async with self.client.messages.stream(**self.params) as stream:
+            self.stream = stream
+            async for _ in stream.text_stream:
+                if not self.first_token.is_set():
+                    self.ttft = time.monotonic() - self.started_at
+                    self.first_token.set()
+            return await stream.get_final_message()
+
+    def partial_usage(self) -> tuple:
+        """Tokens consommés par un appel interrompu (entrée connue, sortie estimée)"""
+        return partial_usage(self.stream)
+
+
+def partial_usage(stream) -> tuple:
+    """Tokens consommés par un flux interrompu (entrée connue, sortie estimée) ; (0, 0) s'il n'a pas commencé"""
+    try:
+        snapshot = stream.current_message_snapshot
+    except (AttributeError, AssertionError):
+        # Flux jamais ouvert ou annulé avant message_start
+        return 0, 0
+    # message_start annonce 1 token de sortie : le décompte réel n'arrive qu'avec message_delta
+    text = ''.join(block.text for block in snapshot.content if block.type == 'text')
+    output_tokens = max(snapshot.usage.output_tokens or 0, len(text) // 4)
+    return snapshot.usage.input_tokens or 0, output_tokens
+
+
+class RequestHedger:
+    """Relance une requête de secours si le premier token tarde, et garde la plus rapide"""
+
+    def __init__(self, client):
+        self.client = client
+        self.logger = logging.getLogger('discord_claude_bot')
+
+        self.enabled = os.getenv('HEDGING_ENABLED', 'false').lower() == 'true'
+        self.percentile = float(os.getenv('HEDGE_PERCENTILE', '95'))
+        self.default_delay = float(os.getenv('HEDGE_DEFAULT_DELAY', '8'))  # secondes, sans historique
+        self.min_delay = float(os.getenv('HEDGE_MIN_DELAY', '1'))
+        self.min_samples = int(os.getenv('HEDGE_MIN_SAMPLES', '20'))
+
+        # Fenêtre glissante des temps de premier token par modèle
+        self.ttfts = defaultdict(lambda: deque(maxlen=200))
+
+    def hedge_delay(self, model: str) -> float:
+        """Délai avant relance : percentile configuré des TTFT récents du modèle"""
+        samples = self.ttfts[model]
+        if len(samples) < self.min_samples:
+            return self.default_delay
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return max(self.min_delay, ordered[index])
+
+    async def stream(self, params: dict, backup_model: str = None, usage_sink: list = None) -> dict:
+        """Exécute la requête en streaming, avec une relance de secours éventuelle.
+
+        En cas d'annulation (ou de délai dépassé) et d'échec, les tokens déjà consommés par chaque appel sont
+        ajoutés à `usage_sink`.
+        """
+        primary = StreamAttempt(self.client, params, 'primary')
+        attempts = [primary]
+        try:
+            winner = None
+            if self.enabled:
+                delay = self.hedge_delay(params['model'])
+                winner = await self._wait_winner(attempts, timeout=delay)
+                if winner is None:
+                    backup_params = dict(params, model=backup_model or params['model'])
+                    self.logger.info(
+                        f"Hedging : pas de premier token après {delay:.2f}s, "
+                        f"relance sur {backup_params['model']}"
+                    )
+                    attempts.append(StreamAttempt(self.client, backup_params, 'backup'))
+                    metrics.incr('api.hedges')
+            if winner is None:
+                winner = await self._wait_winner(attempts)
+
+            # Annulation du perdant et récupération de sa consommation
+            losers = []
+            for attempt in attempts:
+                if attempt is winner:
+                    continue
+                if not attempt.task.done():
+                    attempt.task.cancel()
+                try:
+                    await attempt.task
+                except (asyncio.CancelledError, Exception):
+                    pass
+                input_tokens, output_tokens = attempt.partial_usage()
+                losers.append({
+                    'model': attempt.model,
+                    'label': attempt.label,
+                    'input_tokens': input_tokens,
+                    'output_tokens': output_tokens
+                })
+
+            message = await winner.task
+            self._record_ttfts(attempts)
+            return {
+                'message': message,
+                'model': winner.model,
+                'ttft': winner.ttft,
+                'hedged': len(attempts) > 1,
+                'winner': winner.label,
+                'losers': losers
+            }
+        except (asyncio.CancelledError, Exception):
+            # Requête abandonnée (!kstop, remplacement, délai) ou flux en échec : seule la consommation réelle compte
+            for attempt in attempts:
+                attempt.task.cancel()
+            await asyncio.gather(*(attempt.task for attempt in attempts), return_exceptions=True)
+            if usage_sink is not None:
+                for attempt in attempts:
+                    input_tokens, output_tokens = attempt.partial_usage()
+                    usage_sink.append({'model': attempt.model, 'input_tokens': input_tokens, 'output_tokens': output_tokens})
+            raise
+        finally:
+            for attempt in attempts:
+                if not attempt.task.done():
+                    attempt.task.cancel()
+
+    async def _wait_winner(self, attempts: list, timeout: float = None):
+        """Attend le premier appel qui produit un token (ou se termine) ; None si timeout"""
+        waiters = {}
+        for attempt in attempts:
+            waiters[asyncio.ensure_future(attempt.first_token.wait())] = attempt
+            waiters[attempt.task] = attempt
+        live = set(attempts)
+        last_error = None
+        try:
+            while live:
+                done, _ = await asyncio.wait(waiters.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    return None
+                for future in done:
+                    attempt = waiters.pop(future)
+                    if future is attempt.task and not future.cancelled() and future.exception():
+                        # Appel en échec : on attend les autres
+                        last_error = future.exception()
+                        live.discard(attempt)
+                        continue
+                    return attempt
+                for future, attempt in list(waiters.items()):
+                    if attempt not in live:
+                        future.cancel()
+                        del waiters[future]
+            raise last_error
+        finally:
+            for future, attempt in waiters.items():
+                if future is not attempt.task:
+                    future.cancel()
+
+    def _record_ttfts(self, attempts: list):
+        """Alimente la fenêtre des TTFT (durée écoulée pour un appel annulé avant son premier token)"""
+        now = time.monotonic()
+        for attempt in attempts:
+            ttft = attempt.ttft if attempt.ttft is not None else now - attempt.started_at
+            self.ttfts[attempt.model].append(ttft)
@@ -0,0 +1,278 @@
+import os
+import re
+import json
+import time
+import logging
+from collections import defaultdict, deque
+from datetime import datetime
+from ..utils.persistence import persistence
+
+class ModelRouter:
+    """Choisit automatiquement un modèle selon la requête et un objectif de latence ou de coût"""
+
+    # Rang de capacité des modèles (plus élevé = plus capable)
+    CAPABILITY = {
+        'claude-3-haiku-20240307': 0,
+        'claude-3-5-haiku-20241022': 1,
+        'claude-3-sonnet-20240229': 2,
+        'claude-3-opus-20240229': 3
+    }
+
+    # Latences a priori (secondes) utilisées tant qu'aucune mesure n'est disponible
+    DEFAULT_LATENCY = {
+        'claude-3-haiku-20240307': 2.0,
+        'claude-3-5-haiku-20241022': 3.0,
+        'claude-3-sonnet-20240229': 6.0,
+        'claude-3-opus-20240229': 12.0
+    }
+    DEFAULT_OUTPUT_TOKENS = 300
+
+    CODE_PATTERN = re.compile(
+        r"```|^\s*(def|class|import|from|function|const|let|var|public|#include)\b|[{};]\s*$",
+        re.MULTILINE
+    )
+    COMPLEX_HINTS = (
+        'réfléchis', 'en détail', 'détaillé', 'approfondi', 'analyse', 'démontre',
+        'explique pourquoi', 'étape par étape', 'step by step', 'compare', 'architecture'
+    )
+    SIMPLE_HINTS = (
+        'rapide', 'vite', 'bref', 'brièvement', 'en un mot', 'oui ou non', 'tl;dr', 'court'
+    )
+
+    def __init__(self, models: dict, costs: dict):
+        self.logger = logging.getLogger('discord_claude_bot')
+        self.models = models
+        self.costs = costs
+
+        # Objectif : 'latency' (respecter une latence cible) ou 'cost' (respecter un coût cible)
+        self.objective = os.getenv('ROUTER_OBJECTIVE', 'latency').lower()
+        self.latency_target = float(os.getenv('ROUTER_LATENCY_TARGET', '8'))  # secondes
+        self.cost_target = float(os.getenv('ROUTER_COST_TARGET', '0.005'))  # $ par requête
+        self.failure_threshold = int(os.getenv('ROUTER_FAILURE_THRESHOLD', '2'))
+        self.cooldown = float(os.getenv('ROUTER_COOLDOWN', '120'))  # secondes
+
+        # Statistiques apprises (moyennes mobiles exponentielles)
+        self.alpha = 0.2
+        self.latency = {}
+        self.output_tokens = {}
+        self.failures = defaultdict(int)
+        self.overloaded_until = {}
+        self.breakers = None  # CircuitBreakerRegistry optionnel
+
+        # Journal des décisions de routage
+        self.decisions = deque(maxlen=200)
+        self.log_file = 'data/stats/routing_decisions.jsonl'
+
+    def seed_from_stats(self, stats: dict):
+        """Initialise les tokens de sortie moyens à partir de l'historique du CostTracker"""
+        totals = defaultdict(lambda: {'requests': 0, 'output': 0})
+        for daily_stats in stats.values():
+            for model, count in daily_stats.get('model_usage', {}).items():
+                totals[model]['requests'] += count
+            for model, tokens in daily_stats.get('token_usage', {}).items():
+                totals[model]['output'] += tokens.get('output', 0)
+
+        for model, total in totals.items():
+            if total['requests']:
+                self.output_tokens[model] = total['output'] / total['requests']
+
+    def seed_from_comparisons(self, comparisons):
+        """Initialise latences et tokens de sortie à partir des comparaisons de modèles enregistrées"""
+        for record in comparisons:
+            for result in record.get('results', []):
+                if not result.get('error'):
+                    self.latency[result['model']] = self._ewma(self.latency.get(result['model']), result['latency'])
+                    self.output_tokens[result['model']] = self._ewma(
+                        self.output_tokens.get(result['model']), result['output_tokens']
+                    )
+
+    def classify(self, prompt: str, chain_depth: int = 0) -> tuple:
+        """Estime le niveau de capacité requis (0-3) et les raisons de ce choix"""
+        score = 0
+        reasons = []
+        text = prompt.lower()
+
+        if len(prompt) > 2000:
+            score += 2
+            reasons.append('prompt long')
+        elif len(prompt) > 500:
+            score += 1
+            reasons.append('prompt moyen')
+
+        if chain_depth >= 6:
+            score += 2
+            reasons.append(f'chaîne profonde ({chain_depth})')
+        elif chain_depth >= 3:
+            score += 1
+            reasons.append(f'chaîne ({chain_depth})')
+
+        if self.CODE_PATTERN.search(prompt):
+            score += 1
+            reasons.append('code')
+
+        if any(hint in text for hint in self.COMPLEX_HINTS):
+            score += 2
+            reasons.append('indice complexe')
+        if any(hint in text for hint in self.SIMPLE_HINTS):
+            score -= 1
+            reasons.append('indice simple')
+
+        if score < 0:
+            tier = 0
+        elif score <= 1:
+            tier = 1
+        elif score <= 3:
+            tier = 2
+        else:
+            tier = 3
+        return tier, reasons
+
+    def expected_latency(self, model: str) -> float:
+        """Latence attendue pour un modèle"""
+        return self.latency.get(model, self.DEFAULT_LATENCY.get(model, 5.0))
+
+    def expected_cost(self, model: str, prompt_tokens: int) -> float:
+        """Coût attendu d'une requête pour un modèle"""
+        model_costs = self.costs.get(model)
+        if not model_costs:
+            return float('inf')
+        output_tokens = self.output_tokens.get(model, self.DEFAULT_OUTPUT_TOKENS)
+        return (prompt_tokens / 1000) * model_costs['input'] + (output_tokens / 1000) * model_costs['output']
+
+    def is_overloaded(self, model: str) -> bool:
+        """Indique si un modèle est temporairement écarté après des erreurs répétées"""
+        if self.breakers and self.breakers.is_open(model):
+            return True
+        until = self.overloaded_until.get(model)
+        if until and time.monotonic() < until:
+            return True
+        if until:
+            del self.overloaded_until[model]
+        return False
+
+    def route(self, prompt: str, chain_depth: int = 0) -> str:
+        """Retourne la clé de modèle choisie pour une requête"""
+        tier, reasons = self.classify(prompt, chain_depth)
+        prompt_tokens = len(prompt) // 4
+
+        available = [key for key, model in self.models.items() if not self.is_overloaded(model)]
+        if not available:
+            available = list(self.models.keys())
+
+        # Modèles assez capables, du moins capable au plus capable
+        candidates = sorted(
+            (key for key in available if self.CAPABILITY.get(self.models[key], 1) >= tier),
+            key=lambda key: self.CAPABILITY.get(self.models[key], 1)
+        )
+
+        choice = None
+        for key in candidates:
+            model = self.models[key]
+            if self.objective == 'cost':
+                if self.expected_cost(model, prompt_tokens) <= self.cost_target:
+                    choice = key
+                    break
+            elif self.expected_latency(model) <= self.latency_target:
+                choice = key
+                break
+
+        if not choice:
+            # Aucun modèle ne respecte l'objectif : on prend le plus rapide ou le moins cher disponible
+            pool = candidates or available
+            if self.objective == 'cost':
+                choice = min(pool, key=lambda key: self.expected_cost(self.models[key], prompt_tokens))
+            else:
+                choice = min(pool, key=lambda key: self.expected_latency(self.models[key]))
+            reasons.append('objectif non atteignable')
+
+        model = self.models[choice]
+        self._log_decision({
+            'type': 'route',
+            'model': model,
+            'tier': tier,
+            'objective': self.objective,
+            'reasons': reasons,
+            'prompt_chars': len(prompt),
+            'chain_depth': chain_depth,
+            'expected_latency': round(self.expected_latency(model), 2),
+            'expected_cost': round(self.expected_cost(model, prompt_tokens), 6)
+        })
+        return choice
+
+    def fallback(self, model_key: str):
+        """Retourne un modèle plus rapide disponible, ou None"""
+        current_latency = self.expected_latency(self.models[model_key])
+        faster = [
+            key for key, model in self.models.items()
+            if key != model_key and not self.is_overloaded(model)
+            and self.expected_latency(model) < current_latency
+        ]
+        if not faster:
+            return None
+
+        choice = min(faster, key=lambda key: self.expected_latency(self.models[key]))
+        self._log_decision({
+            'type': 'fallback',
+            'from': self.models[model_key],
+            'model': self.models[choice]
+        })
+        return choice
+
+    def record_success(self, model: str, latency: float, input_tokens: int, output_tokens: int):
+        """Met à jour les statistiques apprises après une requête réussie"""
+        self.failures[model] = 0
+        self.latency[model] = self._ewma(self.latency.get(model), latency)
+        self.output_tokens[model] = self._ewma(self.output_tokens.get(model), output_tokens)
+
+    def record_failure(self, model: str, reason: str):
+        """Enregistre une erreur (timeout, surcharge) et écarte le modèle si elles se répètent"""
+        self.failures[model] += 1
+        self.logger.warning(f"Routage : échec {self.failures[model]} pour {model} ({reason})")
+        if self.failures[model] >= self.failure_threshold:
+            self.overloaded_until[model] = time.monotonic() + self.cooldown
+            self.failures[model] = 0
+            self._log_decision({'type': 'overloaded', 'model': model, 'reason': reason})
+
+    def _ewma(self, previous, value):
+        if previous is None:
+            return float(value)
+        return self.alpha * value + (1 - self.alpha) * previous
+
+    def _log_decision(self, decision: dict):
+        """Journalise une décision de routage (log, mémoire et fichier)"""
+        decision['timestamp'] = datetime.now().isoformat(timespec='seconds')
+        self.decisions.append(decision)
+        self.logger.info(f"Routage : {json.dumps(decision, ensure_ascii=False)}")
+        persistence.append(self.log_file, json.dumps(decision, ensure_ascii=False) + '\n')
+
+    def generate_report(self, limit: int = 10) -> str:
+        """Génère un rapport des décisions de routage récentes"""
+        if not self.decisions:
+            return "Aucune décision de routage enregistrée"
+
+        counts = defaultdict(int)
+        for decision in self.decisions:
+            if decision['type'] == 'route':
+                counts[decision['model']] += 1
+
+        report = f"""# Routage automatique
+
+## Configuration
+- Objectif : {self.objective}
+- Latence cible : {self.latency_target:.1f}s
+- Coût cible : ${self.cost_target:.4f}
+
+## Modèles choisis"""
+        for model, count in counts.items():
+            report += f"\n- {model} : {count:,} requêtes (latence moyenne {self.expected_latency(model):.2f}s)"
+
+        report += "\n\n## Dernières décisions"
+        for decision in list(self.decisions)[-limit:]:
+            if decision['type'] == 'route':
+                reasons = ', '.join(decision['reasons']) or 'aucune'
+                report += f"\n- {decision['timestamp']} → {decision['model']} (niveau {decision['tier']} ; {reasons})"
+            elif decision['type'] == 'fallback':
+                report += f"\n- {decision['timestamp']} ↪ repli {decision['from']} → {decision['model']}"
+            else:
+                report += f"\n- {decision['timestamp']} ⚠ {decision['model']} écarté ({decision['reason']})"
+        return report
@@ -0,0 +1,156 @@
+import os
+import time
+import random
+import logging
+from ..utils.metrics import metrics
+
+class CircuitOpenError(Exception):
+    """Levée quand le disjoncteur d'un modèle est ouvert"""
+
+    def __init__(self, model: str, retry_in: float):
+        super().__init__(f"Disjoncteur ouvert pour {model} (nouvel essai dans {retry_in:.0f}s)")
+        self.model = model
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Disjoncteur d'un modèle : fermé, ouvert (échec immédiat) puis semi-ouvert (requête de test)"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, model: str, failure_threshold: int, recovery_timeout: float):
+        self.logger = logging.getLogger('discord_claude_bot')
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        metrics.set_gauge(f"breaker.state[{model}]", self.state)
+
+    def retry_in(self) -> float:
+        """Secondes restantes avant le passage en semi-ouvert"""
+        return max(0.0, self.opened_at + self.recovery_timeout - time.monotonic())
+
+    def allow_request(self) -> bool:
+        """Indique si une requête peut partir vers ce modèle"""
+        if self.state == self.OPEN:
+            if self.retry_in() > 0:
+                metrics.incr(f"breaker.rejected[{self.model}]")
+                return False
+            self._transition(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            # Une seule requête de test à la fois
+            if self.probe_in_flight:
+                metrics.incr(f"breaker.rejected[{self.model}]")
+                return False
+            self.probe_in_flight = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.probe_in_flight = False
+        if self.state != self.CLOSED:
+            self._transition(self.CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self.probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._transition(self.OPEN)
+
+    def release(self):
+        """Libère la requête de test si elle s'est terminée sans verdict (annulation)"""
+        self.probe_in_flight = False
+
+    def _transition(self, state: str):
+        self.logger.warning(f"Disjoncteur {self.model} : {self.state} → {state}")
+        self.state = state
+        metrics.set_gauge(f"breaker.state[{self.model}]", state)
+        metrics.incr(f"breaker.transitions[{self.model}]")
+
+
+class CircuitBreakerRegistry:
+    """Disjoncteurs par modèle, créés à la demande"""
+
+    def __init__(self):
+        self.failure_threshold = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))
+        self.recovery_timeout = float(os.getenv('BREAKER_RECOVERY_TIMEOUT', '30'))
+        self.breakers = {}
+
+    def get(self, model: str) -> CircuitBreaker:
+        if model not in self.breakers:
+            self.breakers[model] = CircuitBreaker(model, self.failure_threshold, self.recovery_timeout)
+        return self.breakers[model]
+
+    def is_open(self, model: str) -> bool:
+        breaker = self.breakers.get(model)
+        return bool(breaker) and breaker.state == CircuitBreaker.OPEN and breaker.retry_in() > 0
+
+    def format_report(self) -> str:
+        """État des disjoncteurs pour !kperf"""
+        if not self.breakers:
+            return "## Disjoncteurs\n- Aucun appel enregistré"
+        report = "## Disjoncteurs"
+        for model, breaker in sorted(self.breakers.items()):
+            line = f"\n- {model} : {breaker.state} ({breaker.failures} échecs consécutifs)"
+            if breaker.state == CircuitBreaker.OPEN:
+                line += f", nouvel essai dans {breaker.retry_in():.0f}s"
+            report += line
+        return report
+
+
+class RetryPolicy:
+    """Backoff exponentiel avec jitter complet, qui respecte l'en-tête retry-after"""
+
+    # Codes HTTP qui justifient une nouvelle tentative
+    RETRYABLE_STATUS = (408, 409, 429, 500, 502, 503, 504, 529)
+    # Codes qui traduisent un modèle en difficulté (comptés par le disjoncteur)
+    BREAKER_STATUS = (500, 502, 503, 504, 529)
+
+    def __init__(self):
+        self.max_attempts = int(os.getenv('RETRY_MAX_ATTEMPTS', '3'))
+        self.base_delay = float(os.getenv('RETRY_BASE_DELAY', '0.5'))
+        self.max_delay = float(os.getenv('RETRY_MAX_DELAY', '8'))
+
+    def is_retryable(self, error: Exception) -> bool:
+        import anthropic  # déjà chargé par le client (import différé au démarrage)
+        if isinstance(error, anthropic.APIConnectionError):  # inclut APITimeoutError
+            return True
+        return isinstance(error, anthropic.APIStatusError) and error.status_code in self.RETRYABLE_STATUS
+
+    def counts_for_breaker(self, error: Exception) -> bool:
+        import anthropic
+        if isinstance(error, anthropic.APIConnectionError):
+            return True
+        return isinstance(error, anthropic.APIStatusError) and error.status_code in self.BREAKER_STATUS
+
+    def retry_after(self, error: Exception):
+        """Délai demandé par le serveur (en secondes), ou None"""
+        response = getattr(error, 'response', None)
+        if response is None:
+            return None
+        value = response.headers.get('retry-after-ms')
+        if value:
+            try:
+                return float(value) / 1000
+            except ValueError:
+                pass
+        value = response.headers.get('retry-after')
+        try:
+            return float(value) if value else None
+        except ValueError:
+            return None
+
+    def delay(self, attempt: int, error: Exception) -> float:
+        """Délai avant la tentative suivante (attempt commence à 0)"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        retry_after = self.retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
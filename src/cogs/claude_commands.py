@@ -1,34 +1,46 @@
 from discord.ext import commands
 import discord
-import anthropic
+import asyncio
+import threading
 import os
+import re
+import time
+import io
 import json
 from datetime import datetime, timedelta
+from collections import OrderedDict
 import logging
 from ..utils.conversation_manager import ConversationManager
 from ..utils.cost_tracker import CostTracker
 from ..utils.system_prompt_manager import SystemPromptManager
+from ..claude.model_router import ModelRouter
+from ..claude.hedging import RequestHedger, partial_usage
+from ..claude.documents import DocumentProcessor
+from ..claude.resilience import CircuitBreakerRegistry, CircuitOpenError, RetryPolicy
+from ..utils.metrics import metrics
+from ..utils.image_processor import ImageProcessor
+from ..utils.request_queue import RequestQueue
+from ..utils.tracing import tracer, traced
+from ..utils.profiler import profiler
+from ..utils.discord_reply import DiscordReply, InteractionReply
+from ..utils.traffic_recorder import recorder
 
 class ClaudeCommands(commands.Cog):
+    # Durées d'archivage automatique des fils acceptées par Discord (minutes)
+    THREAD_ARCHIVE_DURATIONS = (60, 1440, 4320, 10080)
+
     def __init__(self, bot):
         self.bot = bot
         self.logger = logging.getLogger('discord_claude_bot')
         self.system_prompt_manager = SystemPromptManager()
         
-        try:
-            api_key = os.getenv('ANTHROPIC_API_KEY')
-            self.logger.info(f"API Key présente : {'Oui' if api_key else 'Non'}")
-            self.client = anthropic.Anthropic(
-                api_key=api_key,
-                timeout=30.0,  # Timeout en secondes
-                max_retries=2  # Limite les retries
-            )
-            self.logger.info("Client Anthropic initialisé avec succès")
-        except Exception as e:
-            self.logger.error(f"Erreur lors de l'initialisation du client Anthropic: {str(e)}")
-            raise e
+        # Client Anthropic créé au premier usage ou par warm_up() une fois le bot connecté (import lourd)
+        self._client = None
+        self._client_lock = threading.Lock()
         
         self.conversation_manager = ConversationManager()
+        self.conversation_manager.summarizer = self.summarize_history
+        self.summary_max_tokens = int(os.getenv('SUMMARY_MAX_TOKENS', '400'))
         self.cost_tracker = CostTracker()
     
         # Définition des modèles disponibles
@@ -47,6 +59,284 @@ class ClaudeCommands(commands.Cog):
             'claude-3-opus-20240229': {'input': 0.008, 'output': 0.008}
         }
 
+        # Routage automatique des requêtes (!kask auto, ou par défaut si AUTO_ROUTING=true)
+        self.auto_routing = os.getenv('AUTO_ROUTING', 'false').lower() == 'true'
+        self.router = ModelRouter(self.models, self.cost_tracker.costs)
+        self.router.seed_from_stats(self.cost_tracker.stats)
+        self.router.seed_from_comparisons(self.cost_tracker.comparisons)
+
+        # Résilience : disjoncteur par modèle, retries avec jitter et délai maximal par requête
+        self.breakers = CircuitBreakerRegistry()
+        self.router.breakers = self.breakers
+        self.retry_policy = RetryPolicy()
+        self.request_deadline = float(os.getenv('REQUEST_DEADLINE', '45'))  # attente max côté Discord
+        self.breaker_fallback = os.getenv('BREAKER_FALLBACK', 'true').lower() == 'true'
+
+        # Images jointes : réduites localement et mises en cache par empreinte
+        self.image_processor = ImageProcessor()
+        self.text_only_models = {'claude-3-5-haiku-20241022'}  # Pas d'entrée image pour Claude 3.5 Haiku
+
+        # File de requêtes par salon (remplacement des requêtes obsolètes, !kstop)
+        self.request_queue = RequestQueue()
+
+        # Mode fil : !kask ouvre un fil Discord dont l'historique est gardé côté bot, par identifiant de fil
+        self.thread_mode = os.getenv('THREAD_MODE', 'false').lower() == 'true'
+        timeout_minutes = self.conversation_manager.timeout / 60
+        self.thread_archive_minutes = next(
+            (minutes for minutes in self.THREAD_ARCHIVE_DURATIONS if minutes >= timeout_minutes),
+            self.THREAD_ARCHIVE_DURATIONS[-1]
+        )
+        self.threads = {}  # identifiant du fil -> clé de modèle de la conversation
+
+        # Attente d'une réponse : message modifiable (par défaut) ou indicateur de saisie (REPLY_INDICATOR=typing)
+        self.reply_indicator = os.getenv('REPLY_INDICATOR', 'message').lower()
+        self.conversation_manager.on_expired = self.archive_expired_threads
+
+        # Comparaison de modèles (!kcompare)
+        self.compare_max_tokens = int(os.getenv('COMPARE_MAX_TOKENS', '1000'))
+        self.stream_edit_interval = float(os.getenv('STREAM_EDIT_INTERVAL', '1.5'))  # secondes entre deux éditions
+
+        # Longs fichiers texte joints : analyse par parties en parallèle puis synthèse
+        self.document_processor = DocumentProcessor(self.create_message, self.cost_tracker, self.models)
+
+        # Relance de secours des requêtes lentes (HEDGING_ENABLED=true) ; client fourni à sa création
+        self.hedger = RequestHedger(None)
+        self.hedge_backup = os.getenv('HEDGE_BACKUP_MODEL', 'same').lower()  # 'same' ou 'faster'
+
+        # Préchauffage spéculatif quand le propriétaire écrit dans un salon où le bot vient de répondre
+        self.prewarm_enabled = os.getenv('PREWARM_ON_TYPING', 'false').lower() == 'true'
+        self.prewarm_interval = float(os.getenv('PREWARM_INTERVAL', '30'))  # secondes entre deux préchauffages d'un salon
+        self.prewarm_ttl = float(os.getenv('PREWARM_TTL', '120'))  # validité des messages gardés en cache
+        self.prewarm_keepalive = float(os.getenv('PREWARM_KEEPALIVE', '60'))  # connexions HTTP inactives gardées
+        self.last_replies = {}  # salon -> (identifiant de la dernière réponse, clé de modèle, instant)
+        self.prewarmed_at = {}  # salon -> instant du dernier préchauffage
+        self.message_cache = OrderedDict()  # identifiant -> (message, instant), 500 au plus
+        self.message_cache_size = 500
+
+    @property
+    def client(self):
+        """Client Anthropic, créé au premier accès"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self.client = self._create_client()
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+        self.hedger.client = client
+
+    def _create_client(self):
+        import anthropic
+
+        try:
+            api_key = os.getenv('ANTHROPIC_API_KEY')
+            self.logger.info(f"API Key présente : {'Oui' if api_key else 'Non'}")
+            http_client = None
+            if self.prewarm_enabled:
+                import httpx
+                # Connexion ouverte pendant la frappe gardée jusqu'à l'envoi du message (5 s par défaut dans httpx)
+                http_client = anthropic.DefaultAsyncHttpxClient(limits=httpx.Limits(
+                    max_connections=1000, max_keepalive_connections=100, keepalive_expiry=self.prewarm_keepalive
+                ))
+            client = anthropic.AsyncAnthropic(
+                api_key=api_key,
+                timeout=30.0,  # Timeout en secondes
+                max_retries=0,  # Les retries sont gérés par RetryPolicy
+                http_client=http_client
+            )
+            self.logger.info("Client Anthropic initialisé avec succès")
+            return client
+        except Exception as e:
+            self.logger.error(f"Erreur lors de l'initialisation du client Anthropic: {str(e)}")
+            raise e
+
+    async def api_client(self):
+        """Client Anthropic ; s'il n'existe pas encore (requête arrivée avant la fin de warm_up), créé hors de la boucle"""
+        if self._client is None:
+            await asyncio.to_thread(lambda: self.client)
+        return self._client
+
+    async def warm_up(self):
+        """Initialise en arrière-plan, une fois le bot connecté, ce qui a été différé au démarrage"""
+        start = time.perf_counter()
+        try:
+            await asyncio.to_thread(lambda: self.client)
+            await asyncio.to_thread(self.conversation_manager.warm_up)
+            self.logger.info(f"Initialisation différée terminée en {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            self.logger.error(f"Erreur lors de l'initialisation différée : {str(e)}")
+
+    def resolve_model_key(self, model_key, prompt, chain_depth=0):
+        """Résout la clé 'auto' (ou la clé par défaut si le routage est activé) en un modèle concret"""
+        if model_key == 'auto' or (model_key == 'kask' and self.auto_routing):
+            return self.router.route(prompt, chain_depth), True
+        return model_key, False
+
+    def hedge_backup_model(self, model):
+        """Modèle utilisé pour la relance de secours"""
+        if self.hedge_backup == 'faster':
+            fastest = min(self.models.values(), key=self.router.expected_latency)
+            if self.router.expected_latency(fastest) < self.router.expected_latency(model):
+                return fastest
+        return model
+
+    async def cog_unload(self):
+        self.image_processor.close()
+        await self.document_processor.close()
+
+    def vision_model_key(self, model_key):
+        """Modèle à utiliser quand la requête contient des images"""
+        if self.models[model_key] in self.text_only_models:
+            self.logger.info(f"Images jointes : {self.models[model_key]} remplacé par {self.models['kask-haiku']}")
+            return 'kask-haiku'
+        return model_key
+
+    @staticmethod
+    def user_content(text, images):
+        """Blocs de contenu d'un message utilisateur : images d'abord, puis le texte"""
+        content = [image['block'] for image in images]
+        if text:
+            content.append({"type": "text", "text": text})
+        return content
+
+    async def add_related_context(self, messages, channel_id, text):
+        """Ajoute au dernier tour utilisateur les extraits archivés pertinents pour `text` (RETRIEVAL_ENABLED)"""
+        if not self.conversation_manager.retrieval_enabled:
+            return
+        with tracer.span('retrieval') as span:
+            context = await self.conversation_manager.related_context(channel_id, text)
+            span.set(found=context is not None)
+        if context and messages and messages[-1]['role'] == 'user':
+            # En tête du nouveau tour : le prompt système et l'historique restent identiques (cache de prompt)
+            messages[-1]['content'].insert(0, {"type": "text", "text": context})
+
+    def prompt_scope(self, channel):
+        """Identifiants (salon, serveur, salon parent) utilisés pour résoudre le prompt système lié"""
+        guild = getattr(channel, 'guild', None)
+        return channel.id, guild.id if guild else None, getattr(channel, 'parent_id', None)
+
+    async def create_message(self, model_key, messages, max_tokens=1000, temperature=0.7, routed=False, system=None,
+                             usage_sink=None):
+        """Appelle l'API avec retries, disjoncteur et délai maximal ; bascule vers un modèle plus rapide si besoin"""
+        await self.api_client()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.request_deadline
+        attempt = 0
+        while True:
+            model = self.models[model_key]
+            breaker = self.breakers.get(model)
+            if not breaker.allow_request():
+                # Disjoncteur ouvert : repli immédiat ou échec rapide
+                fallback_key = self.router.fallback(model_key) if (routed or self.breaker_fallback) else None
+                if not fallback_key:
+                    raise CircuitOpenError(model, breaker.retry_in())
+                self.logger.warning(f"Disjoncteur ouvert pour {model}, repli vers {self.models[fallback_key]}")
+                model_key = fallback_key
+                continue
+
+            params = {
+                'model': model,
+                'max_tokens': max_tokens,
+                'messages': messages,
+                'temperature': temperature
+            }
+            if system:
+                params['system'] = system
+
+            remaining = deadline - loop.time()
+            start_time = datetime.now()
+            try:
+                with tracer.span('api_call', model=model, attempt=attempt) as span:
+                    result = await asyncio.wait_for(
+                        self.hedger.stream(params, backup_model=self.hedge_backup_model(model), usage_sink=usage_sink),
+                        timeout=remaining
+                    )
+                    span.set(
+                        ttft=round(result['ttft'], 3) if result['ttft'] is not None else None,
+                        input_tokens=result['message'].usage.input_tokens,
+                        output_tokens=result['message'].usage.output_tokens,
+                        hedged=result['hedged']
+                    )
+            except asyncio.TimeoutError:
+                breaker.record_failure()
+                self.router.record_failure(model, 'deadline')
+                metrics.incr(f"api.deadline_exceeded[{model}]")
+                if usage_sink is not None:
+                    self.track_consumed(usage_sink, 'error')
+                raise
+            except Exception as e:
+                # Flux coupé en cours de route : les tokens déjà consommés sont facturés, même si un essai suit
+                if usage_sink is not None:
+                    self.track_consumed(usage_sink, 'error')
+                if not self.retry_policy.is_retryable(e):
+                    breaker.release()
+                    metrics.incr(f"api.errors[{model}]")
+                    raise
+                if self.retry_policy.counts_for_breaker(e):
+                    breaker.record_failure()
+                else:
+                    breaker.release()
+                self.router.record_failure(model, type(e).__name__)
+                metrics.incr(f"api.errors[{model}]")
+
+                # Repli vers un modèle plus rapide pour une requête routée ou si le disjoncteur vient de s'ouvrir
+                fallback_key = None
+                if routed or (self.breaker_fallback and self.breakers.is_open(model)):
+                    fallback_key = self.router.fallback(model_key)
+                if fallback_key:
+                    self.logger.warning(f"Repli de {model} vers {self.models[fallback_key]}")
+                    model_key = fallback_key
+                    continue
+
+                attempt += 1
+                delay = self.retry_policy.delay(attempt - 1, e)
+                if attempt >= self.retry_policy.max_attempts or loop.time() + delay >= deadline:
+                    raise
+                self.logger.warning(f"Erreur {type(e).__name__} sur {model}, nouvel essai {attempt} dans {delay:.2f}s")
+                metrics.incr(f"api.retries[{model}]")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+
+            breaker.record_success()
+            response = result['message']
+            if result['hedged']:
+                for loser in result['losers']:
+                    self.cost_tracker.track_hedge(
+                        model=loser['model'],
+                        input_tokens=loser['input_tokens'],
+                        output_tokens=loser['output_tokens'],
+                        backup_won=result['winner'] == 'backup'
+                    )
+            if result['model'] != model:
+                model_key = next(key for key, value in self.models.items() if value == result['model'])
+
+            duration = (datetime.now() - start_time).total_seconds()
+            recorder.add('api_calls', 1)
+            recorder.note(
+                model_used=result['model'], attempts=attempt + 1, hedged=result['hedged'],
+                ttft=round(result['ttft'], 4) if result['ttft'] is not None else None, api_seconds=round(duration, 4),
+                input_tokens=response.usage.input_tokens, output_tokens=response.usage.output_tokens,
+                response_chars=sum(len(block.text) for block in response.content if block.type == 'text')
+            )
+            self.router.record_success(result['model'], duration, response.usage.input_tokens, response.usage.output_tokens)
+            metrics.observe(f"api.latency[{result['model']}]", duration)
+            if result['ttft'] is not None:
+                metrics.observe(f"api.ttft[{result['model']}]", result['ttft'])
+            return response, model_key
+
+    def error_message(self, error):
+        """Message d'erreur adapté à la cause de l'échec"""
+        if isinstance(error, CircuitOpenError):
+            return f"❌ Claude est surchargé ({error.model}), réessayez dans {error.retry_in:.0f}s."
+        if isinstance(error, asyncio.TimeoutError):
+            return f"⌛ Pas de réponse de Claude après {self.request_deadline:.0f}s, réessayez plus tard."
+        return None
+
     def calculate_cost(self, model, input_tokens, output_tokens):
         """Calcule le coût détaillé d'une requête"""
         model_costs = self.costs[model]
@@ -62,6 +352,47 @@ class ClaudeCommands(commands.Cog):
             'output_tokens': output_tokens
         }
 
+    async def summarize_history(self, previous_summary, messages):
+        """Résume les tours évincés de l'historique avec le modèle le moins cher"""
+        costs = self.cost_tracker.costs
+        model_key = min(
+            (key for key in self.models if self.models[key] in costs),
+            key=lambda key: costs[self.models[key]]['input'] + costs[self.models[key]]['output']
+        )
+        
+        transcript = "\n".join(
+            f"{'Utilisateur' if message.role == 'user' else 'Assistant'} : {message.content}"
+            for message in messages
+        )
+        prompt = (
+            "Mets à jour le résumé d'une conversation entre un utilisateur et un assistant. "
+            "Garde les faits, décisions, préférences et questions en suspens utiles pour la suite, "
+            f"en moins de {self.summary_max_tokens // 2} mots, sans préambule.\n\n"
+            f"Résumé actuel :\n{previous_summary or '(aucun)'}\n\n"
+            f"Nouveaux échanges :\n{transcript}"
+        )
+        
+        response, model_key = await self.create_message(
+            model_key,
+            [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
+            max_tokens=self.summary_max_tokens,
+            temperature=0.3
+        )
+        self.cost_tracker.track_request(
+            model=self.models[model_key],
+            input_tokens=response.usage.input_tokens,
+            output_tokens=response.usage.output_tokens,
+            category='summary'
+        )
+        return response.content[0].text
+
+    def record_exchange(self, channel_id, question, answer):
+        """Enregistre une paire question/réponse dans l'historique du canal (archivé et indexé)"""
+        if question:
+            self.conversation_manager.add_message(channel_id, {"role": "user", "content": question})
+        self.conversation_manager.add_message(channel_id, {"role": "assistant", "content": answer})
+
+    @traced('send_response')
     async def send_response(self, ctx, response_text, cost_details):
         """Envoie la réponse"""
         if len(response_text) > 2000:  # Limite standard de Discord
@@ -71,6 +402,24 @@ class ClaudeCommands(commands.Cog):
         else:
             await ctx.send(response_text)
 
+    async def fetch_message(self, channel, message_id):
+        """Message d'un salon, repris du cache du préchauffage s'il y est encore valide"""
+        if self.prewarm_enabled:
+            entry = self.message_cache.get(message_id)
+            if entry and time.monotonic() - entry[1] < self.prewarm_ttl:
+                metrics.incr('prewarm.cache_hits')
+                return entry[0]
+        with tracer.span('fetch_message', message_id=message_id):
+            message = await channel.fetch_message(message_id)
+        recorder.add('discord_fetches', 1)
+        if self.prewarm_enabled:
+            self.message_cache[message_id] = (message, time.monotonic())
+            self.message_cache.move_to_end(message_id)
+            while len(self.message_cache) > self.message_cache_size:
+                self.message_cache.popitem(last=False)
+        return message
+
+    @traced('get_message_chain')
     async def get_message_chain(self, channel, message_id):
         """Récupère la chaîne complète des messages liés"""
         messages = []
@@ -82,7 +431,7 @@ class ClaudeCommands(commands.Cog):
         
         while current_id and len(messages) < max_depth:
             try:
-                current_message = await channel.fetch_message(current_id)
+                current_message = await self.fetch_message(channel, current_id)
                 self.logger.info(f"\nMessage trouvé dans la chaîne:")
                 self.logger.info(f"ID: {current_message.id}")
                 self.logger.info(f"Auteur: {current_message.author.name}")
@@ -109,6 +458,22 @@ class ClaudeCommands(commands.Cog):
         self.logger.info(f"\nNombre total de messages dans la chaîne: {len(messages)}")
         return messages
     
+    def clean_user_content(self, content):
+        """Retire d'un message utilisateur la mention du bot et la commande !k* qui le précède"""
+        content = content.replace(f'<@{self.bot.user.id}>', '').strip()
+        if content.startswith('!k'):
+            content = content[content.index(' ')+1:] if ' ' in content else ''
+        return content
+
+    @staticmethod
+    def clean_bot_content(content):
+        """Retire d'une réponse du bot les lignes de métadonnées en petit texte (-# durée, prompt, coût) qui la précèdent"""
+        lines = content.split('\n')
+        start = 0
+        while start < len(lines) and lines[start].startswith('-# '):
+            start += 1
+        return '\n'.join(lines[start:])
+
     def format_message_chain(self, messages):
         """Formate la chaîne de messages pour Claude"""
         formatted_conversation = []
@@ -121,12 +486,7 @@ class ClaudeCommands(commands.Cog):
             role = "assistant" if is_bot else "user"
             
             # Nettoyer le contenu si nécessaire
-            content = msg.content
-            if not is_bot:
-                # Nettoyer les mentions du bot et les commandes
-                content = content.replace(f'<@{self.bot.user.id}>', '').strip()
-                if content.startswith('!k'):
-                    content = content[content.index(' ')+1:] if ' ' in content else ''
+            content = self.clean_bot_content(msg.content) if is_bot else self.clean_user_content(msg.content)
             
             # Si le contenu n'est pas vide après nettoyage
             if content.strip():
@@ -142,196 +502,688 @@ class ClaudeCommands(commands.Cog):
         
         return formatted_conversation
 
+    def is_bot_thread(self, channel):
+        """Indique si le salon est un fil de conversation ouvert par le bot"""
+        return (
+            self.thread_mode
+            and isinstance(channel, discord.Thread)
+            and self.bot.user is not None
+            and channel.owner_id == self.bot.user.id
+        )
+
+    async def open_thread(self, message, prompt, model_key):
+        """Ouvre un fil sur le message de commande ; retourne le salon d'origine si c'est impossible"""
+        name = re.sub(r"\s+", " ", prompt or '').strip()[:90] or "Conversation avec Claude"
+        try:
+            thread = await message.create_thread(name=name, auto_archive_duration=self.thread_archive_minutes)
+        except discord.HTTPException as e:
+            self.logger.warning(f"Impossible d'ouvrir un fil, réponse dans le salon : {str(e)}")
+            return message.channel
+        self.threads[thread.id] = model_key
+        self.conversation_manager.restored.add(thread.id)
+        metrics.incr('threads.opened')
+        return thread
+
+    def archive_expired_threads(self, channel_ids):
+        """Archive les fils dont l'historique a expiré (CONVERSATION_TIMEOUT)"""
+        for channel_id in channel_ids:
+            self.threads.pop(channel_id, None)
+            thread = self.bot.get_channel(channel_id)
+            if self.is_bot_thread(thread) and not thread.archived:
+                asyncio.get_running_loop().create_task(self.archive_thread(thread))
+
+    async def archive_thread(self, thread):
+        try:
+            await thread.edit(archived=True)
+            metrics.incr('threads.archived')
+        except discord.HTTPException as e:
+            self.logger.warning(f"Impossible d'archiver le fil {thread.id} : {str(e)}")
+
+    async def handle_thread_message(self, message):
+        """Continue la conversation d'un fil ouvert par le bot, sans relire les messages du fil"""
+        ctx = await self.bot.get_context(message)
+        content = message.content.replace(f'<@{self.bot.user.id}>', '').strip()
+        await self.handle_claude_request(ctx, content, 'kask')
+
+    def schedule_prewarm(self, channel):
+        """Le propriétaire écrit : préchauffage de la requête probable, au plus une fois par PREWARM_INTERVAL et par salon"""
+        if not self.prewarm_enabled:
+            return
+        last = self.last_replies.get(channel.id)
+        now = time.monotonic()
+        if last is None or now - last[2] > self.conversation_manager.timeout:
+            return  # pas de conversation en cours dans ce salon
+        if now - self.prewarmed_at.get(channel.id, float('-inf')) < self.prewarm_interval:
+            metrics.incr('prewarm.rate_limited')
+            return
+        self.prewarmed_at[channel.id] = now
+        asyncio.get_running_loop().create_task(self.prewarm(channel, last[0], last[1]))
+
+    async def prewarm(self, channel, message_id, model_key):
+        """Prépare la relance probable : chaîne de la dernière réponse en cache, historique rechargé, prompt
+        système compilé et connexion à l'API ouverte (requête gratuite de liste des modèles)"""
+        start = time.perf_counter()
+        try:
+            if self.is_bot_thread(channel):
+                chain = self.conversation_manager.restore_conversation(channel.id)
+            else:
+                chain = self.get_message_chain(channel, message_id)
+            await asyncio.gather(chain, self.warm_connection())
+            self.system_prompt_manager.get_compiled_prefix(self.models[model_key], *self.prompt_scope(channel))
+            metrics.incr('prewarm.count')
+            metrics.observe('prewarm.seconds', time.perf_counter() - start)
+        except Exception as e:
+            metrics.incr('prewarm.errors')
+            self.logger.warning(f"Préchauffage du salon {channel.id} impossible : {str(e)}")
+
+    async def warm_connection(self):
+        """Ouvre (ou garde ouverte) une connexion du pool du client Anthropic"""
+        client = await self.api_client()
+        await client.models.list(limit=1)
+
+    def remember_reply(self, channel, reply, model_key, received):
+        """Dernière réponse du salon (point de départ du préchauffage) et durée des relances, préchauffées ou non"""
+        if not self.prewarm_enabled:
+            return
+        now = time.monotonic()
+        previous = self.last_replies.get(channel.id)
+        if previous is not None and received - previous[2] < self.conversation_manager.timeout:
+            warm = received - self.prewarmed_at.get(channel.id, float('-inf')) < self.prewarm_ttl
+            metrics.observe(f"reply.followup_seconds.{'prewarmed' if warm else 'cold'}", now - received)
+        if reply.last_message is not None and not isinstance(reply, InteractionReply):
+            self.last_replies[channel.id] = (reply.last_message.id, model_key, now)
+
+    def wait_text(self, job):
+        """Message d'attente selon la position de la requête dans la file du salon"""
+        ahead = job.position()
+        if ahead:
+            return f"⏳ En file d'attente : {ahead} requête(s) avant celle-ci dans ce salon… (`!kstop` pour tout arrêter)"
+        text = "⏳ Génération de la réponse en cours... (~30s)"
+        waiting = self.request_queue.depth(job.channel_id) - 1
+        if waiting > 0:
+            text += f" — {waiting} autre(s) en attente"
+        return text
+
+    def reply_header(self, duration, prefix, cost):
+        """En-tête d'une réponse : durée de génération, prompt système appliqué et coût"""
+        return DiscordReply.header(
+            f"⌛ Réponse générée en {duration:.2f}s",
+            f"🔧 Prompt : `{prefix['name']}`" if prefix else None,
+            f"💰 ${cost:.4f}"
+        )
+
+    async def start_reply(self, channel, job, interaction=None):
+        """Affiche l'attente de la réponse (un message si la requête doit attendre son tour dans la file)"""
+        reply = InteractionReply(interaction) if interaction else DiscordReply(channel, self.reply_indicator)
+        await reply.start(self.wait_text(job), force_message=job.position() > 0)
+        return reply
+
+    async def wait_turn(self, job, reply):
+        """Attend le tour de la requête dans la file du salon, puis met à jour le message d'attente"""
+        queued = job.position() > 0
+        await job.start()
+        if queued:
+            await reply.status(self.wait_text(job))
+
+    def track_consumed(self, usage, category):
+        """Enregistre les tokens consommés par des appels interrompus (annulés ou en échec) et vide `usage` ;
+        retourne leur total"""
+        tokens = 0
+        while usage:
+            consumed = usage.pop(0)
+            if consumed['input_tokens'] or consumed['output_tokens']:
+                self.cost_tracker.track_request(
+                    model=consumed['model'],
+                    input_tokens=consumed['input_tokens'],
+                    output_tokens=consumed['output_tokens'],
+                    category=category
+                )
+                tokens += consumed['input_tokens'] + consumed['output_tokens']
+        return tokens
+
+    async def report_cancelled(self, job, reply, usage):
+        """Enregistre les seuls tokens consommés par une requête annulée et l'indique dans le message d'attente"""
+        tokens = self.track_consumed(usage, 'cancelled')
+        if job.cancel_reason and reply:
+            reason = "remplacée par votre nouvelle demande" if job.cancel_reason == 'superseded' else "arrêtée"
+            try:
+                text = f"⏹️ Requête {reason}"
+                if tokens:
+                    text += f" ({tokens:,} tokens consommés)"
+                await reply.status(text, create=True)
+            except discord.HTTPException:
+                pass
+
+    @traced('handle_claude_request')
     async def handle_claude_request(self, ctx, message, model_key):
         """Version complète optimisée"""
-        if not message and not ctx.message.reference:
-            await ctx.send(f"Merci de fournir un message avec la commande !{model_key}")
+        received = time.monotonic()
+        attachments = self.image_processor.image_attachments(ctx.message)
+        documents = self.document_processor.text_attachments(ctx.message)
+        if not message and not attachments and not documents and not ctx.message.reference:
+            await ctx.send(f"Merci de fournir un message avec la commande !kask")
             return
 
-        if ctx.message.reference:
+        # Dans un fil du bot, l'historique est gardé côté bot : les réponses n'ont pas à être remontées
+        channel = ctx.channel
+        interaction = getattr(ctx, 'interaction', None)  # commande slash : réponse différée puis suivis
+        in_thread = self.is_bot_thread(channel)
+        if ctx.message.reference and not in_thread:
             await self.handle_contextual_command(
                 ctx.message, 
-                await ctx.channel.fetch_message(ctx.message.reference.message_id), 
+                await self.fetch_message(ctx.channel, ctx.message.reference.message_id), 
                 model_key
             )
             return
 
+        if in_thread:
+            # Modèle choisi à l'ouverture du fil, sauf s'il est précisé de nouveau
+            if model_key == 'kask':
+                model_key = self.threads.get(channel.id, model_key)
+            else:
+                self.threads[channel.id] = model_key
+            metrics.incr('threads.turns')
+        elif self.thread_mode and isinstance(channel, discord.TextChannel) and not interaction:
+            channel = await self.open_thread(ctx.message, message, model_key)
+
+        # Forme de la requête (TRAFFIC_RECORD), pour la rejouer ensuite
+        envelope = recorder.begin(
+            'slash' if interaction else 'thread' if in_thread else 'kask', channel.id, ctx.author.id,
+            model=model_key, question_chars=len(message or ''), attachments=len(attachments) + len(documents)
+        )
+
+        # Inscription dans la file du salon (une nouvelle demande remplace la précédente du même utilisateur)
+        job = self.request_queue.submit(channel.id, ctx.author.id)
+        reply = None
+        usage = []
         try:
-            # Message d'attente modifiable
-            wait_message = await ctx.send("⏳ Génération de la réponse en cours... (~30s)")
+            # Message d'attente modifiable (ou indicateur de saisie), remplacé ensuite par la réponse
+            reply = await self.start_reply(channel, job, interaction)
+            with tracer.span('queue_wait', depth=self.request_queue.depth(channel.id)):
+                await self.wait_turn(job, reply)
+            recorder.mark('queue_seconds')
         
-            start_time = datetime.now()
-            
-            # Récupération du prompt système
-            prompt_name, system_prompt = self.system_prompt_manager.get_active_prompt()
-            
             # Log de début
             start_time = datetime.now()
-            self.logger.info(f"\n=== Nouvelle requête Claude ===\n⏰ Début : {start_time.strftime('%H:%M:%S.%f')[:-3]}")
+            self.logger.info(
+                f"\n=== Nouvelle requête Claude [{tracer.current_id()}] ===\n⏰ Début : {start_time.strftime('%H:%M:%S.%f')[:-3]}"
+            )
 
-            # Construction des messages
-            messages = [{
-                "role": "user",
-                "content": [{"type": "text", "text": message}]
-            }]
-
-            # Ajout du system prompt si présent
-            if system_prompt:
-                messages.insert(0, {
-                    "role": "system",
-                    "content": [{"type": "text", "text": system_prompt}]
+            # Long fichier texte joint : mode document (map-reduce)
+            if documents and self.document_processor.is_large(documents):
+                await self.handle_document_request(channel, reply, documents, message, model_key, usage)
+                return
+            
+            # Construction des messages : historique du fil ou du canal (KASK_HISTORY), précédé de son résumé, puis la question
+            with tracer.span('build_prompt') as span:
+                images = await self.image_processor.process_attachments(attachments) if attachments else []
+                prompt_text = message
+                if documents:
+                    prompt_text = f"{await self.document_processor.read_inline(documents)}\n\n{message or ''}".strip()
+                messages = []
+                if in_thread or self.conversation_manager.channel_history:
+                    if in_thread or channel.id in self.conversation_manager.evicted:
+                        await self.conversation_manager.restore_conversation(channel.id)
+                    messages = self.conversation_manager.get_prompt_messages(channel.id)
+                messages.append({
+                    "role": "user",
+                    "content": self.user_content(prompt_text, images)
                 })
+                await self.add_related_context(messages, channel.id, message)
+                span.set(messages=len(messages), images=len(images))
 
-            # Appel API
-            response = self.client.messages.create(
+            # Appel API (avec routage automatique éventuel) et prompt système précompilé du salon
+            model_key, routed = self.resolve_model_key(model_key, message or '')
+            if images:
+                model_key = self.vision_model_key(model_key)
+            prefix = self.system_prompt_manager.get_compiled_prefix(self.models[model_key], *self.prompt_scope(channel))
+            recorder.note(system_tokens=prefix['tokens'] if prefix else 0, **recorder.prompt_shape(messages))
+            response, model_key = await self.create_message(
+                model_key, messages, routed=routed, system=prefix['system'] if prefix else None, usage_sink=usage
+            )
+            
+            # Tracking des coûts (aussitôt la réponse reçue, avant toute annulation possible)
+            cost = self.cost_tracker.track_request(
                 model=self.models[model_key],
-                max_tokens=1000,
-                messages=messages,
-                temperature=0.7
+                input_tokens=response.usage.input_tokens,
+                output_tokens=response.usage.output_tokens
             )
+            if images:
+                self.cost_tracker.track_images(images)
             
             # Logs et mesures
             end_time = datetime.now()
             duration = (end_time - start_time).total_seconds()
             self.logger.info(f"⏱️ Durée : {duration:.2f}s - Tokens : {response.usage.input_tokens}/{response.usage.output_tokens}")
 
-            # Mise à jour du message d'attente avec le temps réel
-            await wait_message.edit(content=f"⌛ Réponse générée en {duration:.2f}s")
-            
-            # Tracking des coûts
-            self.cost_tracker.track_request(
-                model=self.models[model_key],
-                input_tokens=response.usage.input_tokens,
-                output_tokens=response.usage.output_tokens
+            # Réponse dans le message d'attente : durée, prompt et coût en en-tête, puis le début du texte
+            await reply.finish(
+                response.content[0].text,
+                self.reply_header(duration, prefix, cost),
+                [self.image_processor.summarize(images)] if images else []
             )
+            self.remember_reply(channel, reply, model_key, received)
+            question = message or ''
+            if images:
+                question += f" [{len(images)} image(s)]"
+            if documents:
+                question += f" [fichier : {', '.join(document.filename for document in documents)}]"
+            self.record_exchange(channel.id, question.strip(), response.content[0].text)
 
-            # Envoi des réponses
-            if system_prompt:
-                await ctx.send(f"🔧 Prompt : `{prompt_name}`")
-            
-            await self.send_response(ctx, response.content[0].text, None)
-
+        except asyncio.CancelledError:
+            recorder.note(status='cancelled')
+            await self.report_cancelled(job, reply, usage)
+            raise
         except Exception as e:
+            recorder.note(status='error')
             self.logger.error(f"Erreur Claude: {str(e)}")
-            await ctx.send("❌ Désolé, une erreur s'est produite lors de la génération de la réponse.")
+            self.track_consumed(usage, 'error')
+            error = self.error_message(e) or "❌ Désolé, une erreur s'est produite lors de la génération de la réponse."
+            if reply:
+                await reply.fail(error)
+            else:
+                await channel.send(error)
+        finally:
+            job.finish()
+            if reply:
+                reply.close()
+            recorder.end(envelope)
     
+    @traced('handle_contextual_command')
     async def handle_contextual_command(self, command_message, referenced_message, model_key='kask'):
         """Gère une commande !k* qui répond à un message spécifique"""
         self.logger.info("\n=== Traitement d'une commande contextuelle ===")
+        received = time.monotonic()
+        envelope = recorder.begin(
+            'contextual', command_message.channel.id, command_message.author.id,
+            model=model_key, question_chars=max(0, len(command_message.content) - len(model_key) - 2)
+        )
+        job = self.request_queue.submit(command_message.channel.id, command_message.author.id)
+        reply = None
+        usage = []
         try:
-            # Message d'attente modifiable
-            wait_message = await command_message.channel.send("⏳ Génération de la réponse en cours... (~30s)")
+            # Message d'attente modifiable (ou indicateur de saisie), remplacé ensuite par la réponse
+            reply = await self.start_reply(command_message.channel, job)
+            with tracer.span('queue_wait', depth=self.request_queue.depth(command_message.channel.id)):
+                await self.wait_turn(job, reply)
+            recorder.mark('queue_seconds')
             
             # Récupération et formatage de la chaîne de messages
             message_chain = await self.get_message_chain(command_message.channel, referenced_message.id)
+            recorder.note(chain_depth=len(message_chain))
             
             # Construction des messages
             messages = []
             
-            # Ajout du prompt système si présent
-            prompt_name, system_prompt = self.system_prompt_manager.get_active_prompt()
-            if system_prompt:
-                messages.append({
-                    "role": "system",
-                    "content": [{"type": "text", "text": system_prompt}]
-                })
+            # Images de la chaîne et de la commande, préparées en parallèle (déjà vues : reprises du cache)
+            image_sources = [
+                msg for msg in message_chain if msg.author.id != self.bot.user.id
+            ] + [command_message]
+            with tracer.span('images', messages=len(image_sources)):
+                prepared = await asyncio.gather(*(
+                    self.image_processor.process_attachments(self.image_processor.image_attachments(msg))
+                    for msg in image_sources
+                ))
+            chain_images = {msg.id: msg_images for msg, msg_images in zip(image_sources, prepared)}
+            images = [image for msg_images in prepared for image in msg_images]
             
             # Ajout de l'historique des messages
             for msg in message_chain:
                 role = "assistant" if msg.author.id == self.bot.user.id else "user"
-                content = msg.content
-                if role == "user":
-                    content = content.replace(f'<@{self.bot.user.id}>', '').strip()
-                    if content.startswith('!k'):
-                        content = content[content.index(' ')+1:] if ' ' in content else ''
+                content = self.clean_user_content(msg.content) if role == "user" else self.clean_bot_content(msg.content)
                 
-                if content.strip():
+                msg_images = chain_images.get(msg.id, []) if role == "user" else []
+                if content.strip() or msg_images:
                     messages.append({
                         "role": role,
-                        "content": [{"type": "text", "text": content}]
+                        "content": self.user_content(content.strip(), msg_images)
                     })
 
             # Ajout de la nouvelle commande si présente
             command_content = command_message.content[len(model_key) + 2:].strip()
-            if command_content:
+            
+            # Fichiers texte de la chaîne : long document en map-reduce, sinon inclus avec la commande
+            documents = self.document_processor.text_attachments(*image_sources)
+            if documents and self.document_processor.is_large(documents):
+                await self.handle_document_request(
+                    command_message.channel, reply, documents, command_content, model_key, usage
+                )
+                return
+            command_text = command_content
+            if documents:
+                command_text = f"{await self.document_processor.read_inline(documents)}\n\n{command_content}".strip()
+            
+            if command_text or chain_images[command_message.id]:
                 messages.append({
                     "role": "user",
-                    "content": [{"type": "text", "text": command_content}]
+                    "content": self.user_content(command_text, chain_images[command_message.id])
                 })
+            await self.add_related_context(
+                messages, command_message.channel.id,
+                command_content or (self.clean_user_content(message_chain[-1].content) if message_chain else '')
+            )
 
             start_time = datetime.now()
             
-            # Appel API
-            response = self.client.messages.create(
-                model=self.models[model_key],
-                max_tokens=1000,
-                messages=messages,
-                temperature=0.7
+            # Appel API (avec routage automatique éventuel)
+            routing_prompt = "\n".join(
+                block['text'] for msg in messages for block in msg['content'] if block['type'] == 'text'
+            )
+            model_key, routed = self.resolve_model_key(model_key, routing_prompt, len(message_chain))
+            if images:
+                model_key = self.vision_model_key(model_key)
+            prefix = self.system_prompt_manager.get_compiled_prefix(
+                self.models[model_key], *self.prompt_scope(command_message.channel)
+            )
+            recorder.note(system_tokens=prefix['tokens'] if prefix else 0, **recorder.prompt_shape(messages))
+            response, model_key = await self.create_message(
+                model_key, messages, routed=routed, system=prefix['system'] if prefix else None, usage_sink=usage
             )
-
-            # Calcul de la durée
-            end_time = datetime.now()
-            duration = (end_time - start_time).total_seconds()
-            
-            # Mise à jour du message d'attente
-            await wait_message.edit(content=f"⌛ Réponse générée en {duration:.2f}s")
 
             # Tracking des coûts
-            self.cost_tracker.track_request(
+            cost = self.cost_tracker.track_request(
                 model=self.models[model_key],
                 input_tokens=response.usage.input_tokens,
                 output_tokens=response.usage.output_tokens
             )
+            if images:
+                self.cost_tracker.track_images(images)
 
-            # Envoi de la réponse
-            if system_prompt:
-                await command_message.channel.send(f"🔧 Prompt : `{prompt_name}`")
-            await self.send_response(command_message.channel, response.content[0].text, None)
+            # Calcul de la durée
+            end_time = datetime.now()
+            duration = (end_time - start_time).total_seconds()
+            
+            # Réponse dans le message d'attente, métadonnées en en-tête
+            await reply.finish(
+                response.content[0].text,
+                self.reply_header(duration, prefix, cost),
+                [self.image_processor.summarize(images)] if images else []
+            )
+            self.remember_reply(command_message.channel, reply, model_key, received)
+            self.record_exchange(command_message.channel.id, command_content, response.content[0].text)
 
+        except asyncio.CancelledError:
+            recorder.note(status='cancelled')
+            await self.report_cancelled(job, reply, usage)
+            raise
         except Exception as e:
+            recorder.note(status='error')
             self.logger.error(f"Erreur lors du traitement de la commande contextuelle : {e}", exc_info=True)
-            await command_message.reply("❌ Désolé, une erreur s'est produite lors du traitement de votre commande.")
+            self.track_consumed(usage, 'error')
+            error = self.error_message(e) or "❌ Désolé, une erreur s'est produite lors du traitement de votre commande."
+            if reply:
+                await reply.fail(error)
+            else:
+                await command_message.reply(error)
+        finally:
+            job.finish()
+            if reply:
+                reply.close()
+            recorder.end(envelope)
+
+    @traced('handle_document_request')
+    async def handle_document_request(self, channel, reply, documents, question, model_key, usage_sink=None):
+        """Répond à une question sur un long fichier joint par map-reduce, avec progression dans le message d'attente"""
+        model_key, _ = self.resolve_model_key(model_key, question or '')
+
+        async def on_progress(totals):
+            await reply.status(self.document_processor.format_progress(totals))
+
+        result = await self.document_processor.answer(documents, question, model_key, on_progress, usage_sink)
+        await reply.finish(result['answer'], reply.header(self.document_processor.format_summary(result)))
+        self.record_exchange(
+            channel.id,
+            f"{question or ''} [fichier : {', '.join(result['filenames'])}]".strip(),
+            result['answer']
+        )
 
     @commands.command(name='kask')
     async def kask(self, ctx, model_arg=None, *, message=None):
         """
         Pose une question à Claude avec choix du modèle optionnel
         Usage: !kask [modèle] message
-        Modèles disponibles: haiku (ancien), sonnet, opus
+        Modèles disponibles: haiku (ancien), sonnet, opus, auto (routage automatique)
         """
-        # Gérer les réponses contextuelles
-        if ctx.message.reference:
-            await self.handle_contextual_command(ctx.message, await ctx.channel.fetch_message(ctx.message.reference.message_id))
+        # Gérer les réponses contextuelles (sauf dans un fil du bot, qui garde son propre historique)
+        if ctx.message.reference and not self.is_bot_thread(ctx.channel):
+            await self.handle_contextual_command(ctx.message, await self.fetch_message(ctx.channel, ctx.message.reference.message_id))
             return
 
-        # Si pas de message du tout
-        if not model_arg:
-            await ctx.send("Usage: !kask [modèle] message\nModèles disponibles: haiku (ancien), sonnet, opus")
+        # Si pas de message du tout (une image ou un fichier seul suffit)
+        has_attachments = bool(
+            self.image_processor.image_attachments(ctx.message) or self.document_processor.text_attachments(ctx.message)
+        )
+        if not model_arg and not has_attachments:
+            await ctx.send("Usage: !kask [modèle] message\nModèles disponibles: haiku (ancien), sonnet, opus, auto")
             return
 
         # Détecter si le premier argument est un modèle
         selected_model = 'kask'  # modèle par défaut
-        if model_arg.lower() in ['haiku', 'sonnet', 'opus']:
-            if not message:  # Si on a spécifié un modèle mais pas de message
+        if model_arg and model_arg.lower() in ['haiku', 'sonnet', 'opus', 'auto']:
+            if not message and not has_attachments:  # Si on a spécifié un modèle mais pas de message
                 await ctx.send("Merci de fournir un message avec la commande !kask")
                 return
             selected_model = f'kask-{model_arg.lower()}'
             if model_arg.lower() == 'haiku':
                 selected_model = 'kask-haiku'  # Pour utiliser l'ancien Haiku
-        else:
+            elif model_arg.lower() == 'auto':
+                selected_model = 'auto'  # Routage automatique
+        elif model_arg:
             # Si le premier argument n'est pas un modèle, c'est le début du message
-            message = f"{model_arg} {message if message else ''}"
+            message = f"{model_arg} {message if message else ''}".strip()
 
         # Utiliser handle_claude_request pour traiter la demande
         await self.handle_claude_request(ctx, message, selected_model)
 
 
 
+    # Mêmes noms que pour !kask : « haiku » désigne l'ancien Haiku, le modèle par défaut (Haiku 3.5) est « kask »
+    MODEL_ALIASES = {
+        'kask': 'kask', 'haiku35': 'kask',
+        'haiku': 'kask-haiku', 'haiku3': 'kask-haiku', 'sonnet': 'kask-sonnet', 'opus': 'kask-opus'
+    }
+
+    async def compare_model(self, channel, model_key, prompt):
+        """Envoie la question à un modèle en streaming dans son propre message ; retourne les mesures"""
+        model = self.models[model_key]
+        header = f"**{model_key}** (`{model}`)"
+        message = await channel.send(f"{header} ⏳")
+        result = {'model': model, 'ttft': None, 'latency': None, 'input_tokens': 0, 'output_tokens': 0, 'cost': 0.0, 'error': None}
+
+        breaker = self.breakers.get(model)
+        if not breaker.allow_request():
+            result['error'] = 'disjoncteur ouvert'
+            await message.edit(content=f"{header} ❌ {result['error']}")
+            return result
+
+        prefix = self.system_prompt_manager.get_compiled_prefix(model, *self.prompt_scope(channel))
+        params = {
+            'model': model,
+            'max_tokens': self.compare_max_tokens,
+            'messages': [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
+            'temperature': 0.7
+        }
+        if prefix:
+            params['system'] = prefix['system']
+
+        client = await self.api_client()
+        parts = []
+        edit_task = None
+        last_edit = 0.0
+        current = None  # flux en cours, pour la consommation d'un appel interrompu
+        start = time.monotonic()
+
+        def render(final=False):
+            text = ''.join(parts)
+            if len(text) > 1900 - len(header):
+                text = text[:1900 - len(header)] + ('…' if not final else '')
+            return f"{header}\n{text}" + ('' if final else ' ▌')
+
+        try:
+            async def consume():
+                nonlocal edit_task, last_edit, current
+                async with client.messages.stream(**params) as stream:
+                    current = stream
+                    async for text in stream.text_stream:
+                        if result['ttft'] is None:
+                            result['ttft'] = time.monotonic() - start
+                        parts.append(text)
+                        # Éditions espacées et non bloquantes : le flux continue pendant l'appel à Discord
+                        now = time.monotonic()
+                        if now - last_edit >= self.stream_edit_interval and (edit_task is None or edit_task.done()):
+                            last_edit = now
+                            edit_task = asyncio.create_task(message.edit(content=render()))
+                    return await stream.get_final_message()
+
+            response = await asyncio.wait_for(consume(), timeout=self.request_deadline)
+        except Exception as e:
+            if self.retry_policy.counts_for_breaker(e) or isinstance(e, asyncio.TimeoutError):
+                breaker.record_failure()
+            else:
+                breaker.release()
+            result['error'] = type(e).__name__
+            result['latency'] = time.monotonic() - start
+            # Délai dépassé ou flux coupé : les tokens déjà consommés sont comptés
+            result['input_tokens'], result['output_tokens'] = partial_usage(current)
+            if result['input_tokens'] or result['output_tokens']:
+                result['cost'] = self.cost_tracker.track_request(
+                    model=model, input_tokens=result['input_tokens'], output_tokens=result['output_tokens'],
+                    category='compare'
+                )
+            self.logger.error(f"Comparaison : échec de {model} : {str(e)}")
+            if edit_task:
+                await asyncio.gather(edit_task, return_exceptions=True)
+            await message.edit(content=f"{header} ❌ {self.error_message(e) or result['error']}")
+            return result
+        except BaseException:
+            # Comparaison arrêtée (!kstop) : seule la consommation réelle est comptée
+            breaker.release()
+            input_tokens, output_tokens = partial_usage(current)
+            if input_tokens or output_tokens:
+                self.cost_tracker.track_request(
+                    model=model, input_tokens=input_tokens, output_tokens=output_tokens, category='cancelled'
+                )
+            if edit_task:
+                edit_task.cancel()
+            raise
+
+        breaker.record_success()
+        result['latency'] = time.monotonic() - start
+        result['input_tokens'] = response.usage.input_tokens
+        result['output_tokens'] = response.usage.output_tokens
+        result['cost'] = self.cost_tracker.track_request(
+            model=model,
+            input_tokens=response.usage.input_tokens,
+            output_tokens=response.usage.output_tokens,
+            category='compare'
+        )
+        self.router.record_success(model, result['latency'], response.usage.input_tokens, response.usage.output_tokens)
+        metrics.observe(f"api.latency[{model}]", result['latency'])
+        if result['ttft'] is not None:
+            metrics.observe(f"api.ttft[{model}]", result['ttft'])
+
+        if edit_task:
+            await asyncio.gather(edit_task, return_exceptions=True)
+        await message.edit(content=render(final=True))
+        # Suite d'une réponse trop longue pour un seul message
+        text = ''.join(parts)
+        overflow = text[1900 - len(header):]
+        for i in range(0, len(overflow), 2000):
+            await channel.send(overflow[i:i + 2000])
+        return result
+
+    @staticmethod
+    def format_comparison(results):
+        """Tableau récapitulatif d'une comparaison"""
+        lines = [f"{'Modèle':<28} {'TTFT':>6} {'Total':>7} {'Entrée':>7} {'Sortie':>7} {'Coût':>9}"]
+        for result in results:
+            if result['error']:
+                lines.append(f"{result['model']:<28} {'échec : ' + result['error']}")
+                continue
+            ttft = f"{result['ttft']:.2f}s" if result['ttft'] is not None else '-'
+            lines.append(
+                f"{result['model']:<28} {ttft:>6} {result['latency']:>6.2f}s {result['input_tokens']:>7,} "
+                f"{result['output_tokens']:>7,} {'$' + format(result['cost'], '.4f'):>9}"
+            )
+        return "```\n" + "\n".join(lines) + "\n```"
+
+    @commands.command(name='kcompare')
+    async def kcompare(self, ctx, *, args=None):
+        """Pose la même question à plusieurs modèles en parallèle : !kcompare [haiku,sonnet,opus] <message>"""
+        if not args:
+            await ctx.send(
+                "Usage: !kcompare [modèles] message\n"
+                "Modèles (séparés par des virgules, tous par défaut) : kask (Haiku 3.5), haiku (ancien), sonnet, opus"
+            )
+            return
+
+        first, _, rest = args.partition(' ')
+        aliases = [alias.strip().lower() for alias in first.split(',')]
+        if rest and all(alias in self.MODEL_ALIASES for alias in aliases):
+            model_keys = list(dict.fromkeys(self.MODEL_ALIASES[alias] for alias in aliases))
+            prompt = rest.strip()
+        else:
+            model_keys = list(self.models)
+            prompt = args
+
+        # Une requête de la file du salon : la comparaison attend son tour et s'arrête avec !kstop
+        job = self.request_queue.submit(ctx.channel.id, ctx.author.id)
+        try:
+            await job.start()
+            start = time.monotonic()
+            results = await asyncio.gather(*(self.compare_model(ctx.channel, key, prompt) for key in model_keys))
+            wall = time.monotonic() - start
+        except asyncio.CancelledError:
+            if job.cancel_reason:
+                reason = "remplacée par votre nouvelle demande" if job.cancel_reason == 'superseded' else "arrêtée"
+                try:
+                    await ctx.send(f"⏹️ Comparaison {reason}")
+                except discord.HTTPException:
+                    pass
+            raise
+        finally:
+            job.finish()
+
+        tier, reasons = self.router.classify(prompt)
+        self.cost_tracker.track_comparison({
+            'prompt_chars': len(prompt),
+            'tier': tier,
+            'reasons': reasons,
+            'wall': round(wall, 3),
+            'results': [
+                dict(result, ttft=round(result['ttft'], 3) if result['ttft'] is not None else None,
+                     latency=round(result['latency'], 3), cost=round(result['cost'], 6))
+                for result in results
+            ]
+        })
+
+        total_cost = sum(result['cost'] for result in results)
+        await ctx.send(
+            f"📊 Comparaison de {len(results)} modèles en {wall:.2f}s (coût total ${total_cost:.4f})\n"
+            f"{self.format_comparison(results)}"
+        )
+
+    @commands.command(name='kstop')
+    async def kstop(self, ctx):
+        """Arrête les requêtes en cours et en attente dans ce salon (le streaming est interrompu)"""
+        stopped = self.request_queue.stop(ctx.channel.id)
+        if stopped:
+            await ctx.send(f"⏹️ {stopped} requête(s) arrêtée(s).")
+        else:
+            await ctx.send("Aucune requête en cours dans ce salon.")
+
     @commands.command(name='kstats')
     async def kstats(self, ctx, period='day'):
-        """Affiche les statistiques d'utilisation (day/week/all)"""
+        """Affiche les statistiques d'utilisation (day/week/month/all/heatmap/routing/documents/compare ou AAAA-MM-JJ..AAAA-MM-JJ)"""
         try:
-            report = self.cost_tracker.generate_report(period)
+            if period == 'routing':
+                report = self.router.generate_report()
+            elif period == 'documents':
+                report = self.cost_tracker.format_documents()
+            elif period == 'compare':
+                report = self.cost_tracker.format_comparisons()
+            else:
+                report = self.cost_tracker.generate_report(period)
             # Découpage du rapport en chunks si nécessaire
             max_length = 1990  # Limite de Discord moins une marge
             chunks = [report[i:i + max_length] for i in range(0, len(report), max_length)]
@@ -341,10 +1193,116 @@ class ClaudeCommands(commands.Cog):
             self.logger.error(f"Erreur lors de la génération des stats: {str(e)}")
             await ctx.send("Désolé, une erreur s'est produite lors de la génération des statistiques.")
 
+    @commands.command(name='kperf')
+    async def kperf(self, ctx):
+        """Affiche les métriques de performance et l'état des disjoncteurs"""
+        report = f"# Performances\n\n{self.breakers.format_report()}\n\n{metrics.format_report()}"
+        max_length = 1990
+        for chunk in [report[i:i + max_length] for i in range(0, len(report), max_length)]:
+            await ctx.send(f"```md\n{chunk}\n```")
+
+    @commands.command(name='ktrace')
+    async def ktrace(self, ctx, action=None):
+        """Résume les étapes de la dernière requête lente (!ktrace last)"""
+        if action != 'last':
+            await ctx.send(
+                f"Usage: !ktrace last\n{len(tracer.recent)} requête(s) tracée(s) en mémoire ; "
+                f"{tracer.sample_rate:.0%} exportées dans `{tracer.trace_dir}` (format Chrome trace), "
+                f"ainsi que toutes celles de plus de {tracer.slow_seconds:g}s"
+            )
+            return
+
+        trace = tracer.last_slow()
+        if trace is None:
+            await ctx.send("Aucune requête tracée depuis le démarrage")
+            return
+        summary = tracer.format_summary(trace)
+        max_length = 1990
+        for chunk in [summary[i:i + max_length] for i in range(0, len(summary), max_length)]:
+            await ctx.send(f"```\n{chunk}\n```")
+
+    @commands.command(name='kprofile')
+    async def kprofile(self, ctx, arg=None):
+        """Profile le CPU et la mémoire pendant les N prochaines requêtes ou T secondes (!kprofile 10, !kprofile 60s, !kprofile stop)"""
+        if ctx.author.id != getattr(self.bot, 'allowed_user_id', None):
+            await ctx.send("Commande réservée au propriétaire du bot. 🔒")
+            return
+
+        session = profiler.session
+        if arg == 'stop':
+            if profiler.stop() is None:
+                await ctx.send("Aucun profilage en cours.")
+            return
+        if session is not None:
+            await ctx.send(
+                f"Profilage en cours : {session.completed}/{session.requests or '∞'} requête(s), "
+                f"encore {session.remaining():.0f}s au plus (`!kprofile stop` pour l'arrêter)."
+            )
+            return
+
+        requests, seconds = None, None
+        try:
+            if arg is not None and arg.endswith('s'):
+                seconds = float(arg[:-1])
+            elif arg is not None:
+                requests = int(arg)
+        except ValueError:
+            await ctx.send("Usage: !kprofile [N requêtes | Ts | stop]")
+            return
+        if (requests is not None and requests <= 0) or (seconds is not None and seconds <= 0):
+            await ctx.send("Usage: !kprofile [N requêtes | Ts | stop]")
+            return
+
+        async def send_report(session, report):
+            filename = f"profile_{session.started_at.strftime('%Y%m%d_%H%M%S')}.txt"
+            await ctx.send(
+                f"📈 Profil : {session.completed} requête(s) en {session.duration:.1f}s ({session.stop_reason})",
+                file=discord.File(io.BytesIO(report.encode('utf-8')), filename=filename)
+            )
+
+        session = profiler.start(send_report, requests=requests, seconds=seconds)
+        await ctx.send(
+            f"📈 Profilage CPU et mémoire activé pour "
+            + (f"les {session.requests} prochaines requêtes, " if session.requests else "")
+            + f"{session.seconds:.0f}s au plus. Le rapport sera joint ici."
+        )
+
+    @commands.command(name='ksearch')
+    async def search_conversations(self, ctx, *, args=None):
+        """Recherche dans les conversations archivées : !ksearch <requête> [canal] [AAAA-MM-JJ..AAAA-MM-JJ]"""
+        if not args:
+            await ctx.send("Usage: !ksearch <requête> [#canal|ici] [AAAA-MM-JJ..AAAA-MM-JJ]")
+            return
+
+        terms = args.split()
+        start = end = channel_id = None
+        if terms and re.fullmatch(r"\d{4}-\d{2}-\d{2}\.\.\d{4}-\d{2}-\d{2}", terms[-1]):
+            start, end = terms.pop().split('..')
+        if terms and terms[-1] == 'ici':
+            terms.pop()
+            channel_id = ctx.channel.id
+        elif terms and re.fullmatch(r"<#\d+>|\d{15,}", terms[-1]):
+            channel_id = int(terms.pop().strip('<#>'))
+
+        query = ' '.join(terms)
+        start_time = time.perf_counter()
+        results = await self.conversation_manager.search(query, channel_id, start, end)
+        duration = (time.perf_counter() - start_time) * 1000
+
+        if not results:
+            await ctx.send(f"🔎 Aucun résultat pour `{query}` ({duration:.1f} ms)")
+            return
+
+        response = f"🔎 **{len(results)} résultats pour `{query}`** ({duration:.1f} ms)\n"
+        for result in results:
+            author = "🤖" if result['role'] == 'assistant' else "👤"
+            response += f"\n{author} <#{result['channel_id']}> · {result['timestamp']}\n> {result['excerpt']}\n"
+        await self.send_response(ctx, response, None)
+
     @commands.command(name='kexport')
     async def export_stats(self, ctx):
         """Exporte toutes les statistiques en CSV"""
-        file_path = self.cost_tracker.export_stats_to_csv()
+        file_path = await self.cost_tracker.export_stats_to_csv()
         if file_path:
             await ctx.send(
                 "Voici l'export des statistiques :", 
@@ -369,11 +1327,25 @@ class ClaudeCommands(commands.Cog):
     - `!kask haiku <message>` - Poser une question en utilisant Claude 3 Haiku (ancienne version)
     - `!kask sonnet <message>` - Poser une question en utilisant Claude Sonnet
     - `!kask opus <message>` - Poser une question en utilisant Claude Opus
+    - `!kask auto <message>` - Laisser le bot choisir le modèle (latence/coût)
+    - `!kcompare [haiku,sonnet,opus] <message>` - Comparer les réponses de plusieurs modèles en parallèle
+    - `!kstop` - Arrêter les requêtes en cours et en attente dans ce salon
     - `!kclear` - Efface l'historique de la conversation courante
+    Avec le mode fil (THREAD_MODE=true), `!kask` ouvre un fil : chaque message du fil poursuit la conversation.
+    - `!ksearch <requête> [#canal|ici] [AAAA-MM-JJ..AAAA-MM-JJ]` - Recherche dans les conversations archivées
 
     📊 Commandes de statistiques :
     - `!kstats` - Affiche les statistiques d'utilisation du jour
+    - `!kstats week|month|all` - Statistiques sur 7 jours, le mois en cours ou depuis le début
+    - `!kstats AAAA-MM-JJ..AAAA-MM-JJ` - Statistiques sur une période personnalisée
+    - `!kstats heatmap` - Répartition des requêtes par jour et par heure
+    - `!kstats routing` - Affiche les décisions du routage automatique
+    - `!kstats documents` - Coût des derniers documents joints analysés
+    - `!kstats compare` - Moyennes par modèle issues des comparaisons
     - `!kexport` - Exporte toutes les statistiques au format CSV
+    - `!kperf` - Affiche les métriques de performance et l'état des disjoncteurs
+    - `!ktrace last` - Détaille les étapes de la dernière requête lente
+    - `!kprofile [N|Ts|stop]` - Profile le CPU et la mémoire des N prochaines requêtes (propriétaire)
 
     🔧 Commandes de prompt système :
     - `!ksys create <nom> <prompt>` - Créer un prompt système
@@ -381,6 +1353,8 @@ class ClaudeCommands(commands.Cog):
     - `!ksys show <nom>` - Afficher un prompt système
     - `!ksys use <nom>` - Utiliser un prompt système
     - `!ksys clear` - Désactiver le prompt système actif
+    - `!ksys bind <nom> [salon|serveur]` - Lier un prompt à ce salon ou ce serveur
+    - `!ksys unbind [salon|serveur]` - Retirer le prompt lié
     - `!ksys delete <nom>` - Supprimer un prompt système
 
     ℹ️ Commande d'aide :
@@ -399,7 +1373,11 @@ class ClaudeCommands(commands.Cog):
     - `!ksys show <nom>` - Afficher un prompt système spécifique
     - `!ksys use <nom>` - Utiliser un prompt système
     - `!ksys clear` - Désactiver l'utilisation du prompt système
-    - `!ksys delete <nom>` - Supprimer un prompt système"""
+    - `!ksys bind <nom> [salon|serveur]` - Lier un prompt à ce salon ou à ce serveur
+    - `!ksys unbind [salon|serveur]` - Retirer le prompt lié à ce salon ou à ce serveur
+    - `!ksys delete <nom>` - Supprimer un prompt système
+
+    Priorité : salon, salon parent (fil), serveur, puis prompt global (`use`)."""
 
         if not action:
             await ctx.send(help_text)
@@ -413,11 +1391,21 @@ class ClaudeCommands(commands.Cog):
                 await ctx.send("Aucun prompt système défini.")
                 return
 
-            active_name, _ = self.system_prompt_manager.get_active_prompt()
+            active_name = self.system_prompt_manager.resolve_prompt_name(*self.prompt_scope(ctx.channel))
+            bindings = self.system_prompt_manager.bindings
             
             response = "**Prompts système disponibles :**\n\n"
             for name, data in prompts.items():
                 active_marker = "✅ " if name == active_name else "  "
+                scopes = []
+                if bindings['channels'].get(str(ctx.channel.id)) == name:
+                    scopes.append("salon")
+                if ctx.guild and bindings['guilds'].get(str(ctx.guild.id)) == name:
+                    scopes.append("serveur")
+                if self.system_prompt_manager.active_prompt == name:
+                    scopes.append("global")
+                if scopes:
+                    active_marker += f"({', '.join(scopes)}) "
                 created = datetime.fromisoformat(data['created_at']).strftime("%d/%m/%Y")
                 updated = datetime.fromisoformat(data['updated_at']).strftime("%d/%m/%Y")
                 response += f"{active_marker}`{name}`\n"
@@ -467,6 +1455,29 @@ class ClaudeCommands(commands.Cog):
             self.system_prompt_manager.set_active_prompt(None)
             await ctx.send("✅ Plus aucun prompt système actif.")
 
+        elif action in ('bind', 'unbind'):
+            # bind <nom> [salon|serveur] ; unbind [salon|serveur]
+            prompt_name = name if action == 'bind' else None
+            scope_arg = (content if action == 'bind' else name) or 'salon'
+            if action == 'bind' and not prompt_name:
+                await ctx.send("❌ Veuillez spécifier le nom du prompt à lier.")
+                return
+            if scope_arg.lower() in ('serveur', 'guild', 'server'):
+                if not ctx.guild:
+                    await ctx.send("❌ Pas de serveur dans une conversation privée.")
+                    return
+                scope, target_id, label = 'guilds', ctx.guild.id, "ce serveur"
+            else:
+                scope, target_id, label = 'channels', ctx.channel.id, "ce salon"
+
+            if self.system_prompt_manager.bind_prompt(scope, target_id, prompt_name):
+                if prompt_name:
+                    await ctx.send(f"✅ Prompt système '{prompt_name}' lié à {label}.")
+                else:
+                    await ctx.send(f"✅ Plus aucun prompt système lié à {label}.")
+            else:
+                await ctx.send(f"❌ Prompt '{prompt_name}' non trouvé.")
+
         elif action == 'delete':
             if not name:
                 await ctx.send("❌ Veuillez spécifier le nom du prompt à supprimer.")
@@ -489,7 +1500,7 @@ class ClaudeCommands(commands.Cog):
             async with ctx.typing():
                 request_time = datetime.now()
                 
-                response = self.client.messages.create(
+                response = await self.client.messages.create(
                     model=self.models['kask'],  # Utilise le modèle par défaut (Haiku 3.5)
                     max_tokens=10,  # Limite petite car on attend juste "OK"
                     messages=[{
@@ -534,7 +1545,7 @@ class ClaudeCommands(commands.Cog):
         try:
             request_time = datetime.now()
             # Requête directe sans le ctx.typing() ni autre chose
-            response = self.client.messages.create(
+            response = await self.client.messages.create(
                 model=self.models['kask'],
                 max_tokens=10,
                 messages=[{
@@ -0,0 +1,171 @@
+import os
+import logging
+from types import SimpleNamespace
+import discord
+from discord import app_commands
+from discord.ext import commands
+from ..utils.metrics import metrics
+from ..utils.tracing import tracer
+from ..utils.profiler import profiler
+
+MODEL_CHOICES = [
+    app_commands.Choice(name='Haiku 3.5 (défaut)', value='kask'),
+    app_commands.Choice(name='Haiku (ancien)', value='kask-haiku'),
+    app_commands.Choice(name='Sonnet', value='kask-sonnet'),
+    app_commands.Choice(name='Opus', value='kask-opus'),
+    app_commands.Choice(name='Automatique', value='auto')
+]
+
+SYS_ACTIONS = [
+    app_commands.Choice(name=action, value=action)
+    for action in ('list', 'show', 'create', 'use', 'clear', 'bind', 'unbind', 'delete')
+]
+
+
+class InteractionContext:
+    """Contexte d'une commande slash, utilisable à la place du contexte d'une commande préfixée.
+
+    Le premier `send` répond à l'interaction si elle n'a pas encore été différée ; les suivants sont des
+    messages de suivi.
+    """
+
+    def __init__(self, interaction: discord.Interaction, attachments=()):
+        self.interaction = interaction
+        self.bot = interaction.client
+        self.channel = interaction.channel
+        self.guild = interaction.guild
+        self.author = interaction.user
+        self.message = SimpleNamespace(
+            id=interaction.id, attachments=list(attachments), reference=None, content='',
+            channel=interaction.channel, author=interaction.user
+        )
+
+    async def send(self, content=None, **kwargs):
+        if not self.interaction.response.is_done():
+            await self.interaction.response.send_message(content, **kwargs)
+            return await self.interaction.original_response()
+        return await self.interaction.followup.send(content, wait=True, **kwargs)
+
+
+class SlashCommands(commands.Cog):
+    """Commandes slash (/kask, /kstats, /ksys, /kexport, /kclear), chargées avec COMMAND_MODE=slash ou both.
+
+    Elles reprennent le traitement des commandes préfixées : la réponse est différée aussitôt (Discord
+    laisse 3 s pour répondre), puis complétée par modification et messages de suivi. Le bot n'a alors
+    plus besoin de recevoir ni de lire les messages des salons.
+    """
+
+    def __init__(self, bot, claude):
+        self.bot = bot
+        self.claude = claude
+        self.logger = logging.getLogger('discord_claude_bot')
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        """Même restriction que pour les commandes préfixées : seul le propriétaire est servi"""
+        metrics.incr('gateway.interactions')
+        if interaction.user.id == getattr(self.bot, 'allowed_user_id', None):
+            return True
+        self.logger.warning(f"Tentative d'utilisation non autorisée par {interaction.user.name} (commande slash)")
+        await interaction.response.send_message("Désolé, je ne réponds qu'à mon propriétaire. 🔒", ephemeral=True)
+        return False
+
+    async def cog_app_command_error(self, interaction, error):
+        if isinstance(error, app_commands.CheckFailure):
+            return
+        self.logger.error(f"Erreur lors de la commande slash /{interaction.command.name if interaction.command else '?'} : {error}")
+        try:
+            ctx = InteractionContext(interaction)
+            await ctx.send("❌ Désolé, une erreur s'est produite lors du traitement de votre commande.")
+        except discord.HTTPException:
+            pass
+
+    async def run(self, interaction, name, handler, defer=True):
+        """Trace la commande comme une requête reçue par on_message, après avoir différé la réponse"""
+        session = profiler.session
+        try:
+            async with tracer.start_trace('interaction', interaction_id=interaction.id, command=f"/{name}"):
+                if defer:
+                    with tracer.span('discord.defer'):
+                        await interaction.response.defer(thinking=True)
+                await handler()
+        finally:
+            if session is not None:
+                session.request_done()
+
+    @commands.command(name='ksync')
+    async def ksync(self, ctx):
+        """Enregistre les commandes slash auprès de Discord (après l'ajout ou la modification d'une commande)"""
+        try:
+            count = await sync_commands(self.bot)
+        except discord.HTTPException as e:
+            await ctx.send(f"❌ Synchronisation impossible : {e}")
+            return
+        await ctx.send(f"✅ {count} commande(s) slash synchronisée(s)")
+
+    @app_commands.command(name='kask', description="Poser une question à Claude")
+    @app_commands.describe(
+        message="Votre question", modele="Modèle à utiliser", fichier="Image ou fichier texte joint à la question"
+    )
+    @app_commands.choices(modele=MODEL_CHOICES)
+    async def kask(self, interaction: discord.Interaction, message: str = None,
+                   modele: app_commands.Choice[str] = None, fichier: discord.Attachment = None):
+        ctx = InteractionContext(interaction, [fichier] if fichier else [])
+        model_key = modele.value if modele else 'kask'
+        # Réponse différée par le pipeline de réponse, après l'inscription dans la file du salon
+        await self.run(interaction, 'kask', lambda: self.claude.handle_claude_request(ctx, message, model_key), defer=False)
+
+    @app_commands.command(name='kstats', description="Statistiques d'utilisation")
+    @app_commands.describe(periode="day, week, month, all, heatmap, routing, documents, compare ou AAAA-MM-JJ..AAAA-MM-JJ")
+    async def kstats(self, interaction: discord.Interaction, periode: str = 'day'):
+        ctx = InteractionContext(interaction)
+        await self.run(interaction, 'kstats', lambda: self.claude.kstats.callback(self.claude, ctx, periode))
+
+    @app_commands.command(name='ksys', description="Gérer les prompts système")
+    @app_commands.describe(
+        action="Action à effectuer", nom="Nom du prompt",
+        contenu="Contenu du prompt (create) ou portée salon/serveur (bind)"
+    )
+    @app_commands.choices(action=SYS_ACTIONS)
+    async def ksys(self, interaction: discord.Interaction, action: app_commands.Choice[str] = None,
+                   nom: str = None, contenu: str = None):
+        ctx = InteractionContext(interaction)
+        await self.run(
+            interaction, 'ksys',
+            lambda: self.claude.system_prompt.callback(self.claude, ctx, action.value if action else None, nom, content=contenu)
+        )
+
+    @app_commands.command(name='kexport', description="Exporter les statistiques en CSV")
+    async def kexport(self, interaction: discord.Interaction):
+        ctx = InteractionContext(interaction)
+        await self.run(interaction, 'kexport', lambda: self.claude.export_stats.callback(self.claude, ctx))
+
+    @app_commands.command(name='kclear', description="Effacer l'historique de conversation du salon")
+    async def kclear(self, interaction: discord.Interaction):
+        ctx = InteractionContext(interaction)
+        await self.run(interaction, 'kclear', lambda: self.claude.clear_conversation.callback(self.claude, ctx), defer=False)
+
+
+async def sync_commands(bot):
+    """Enregistre les commandes slash auprès de Discord : sur le serveur SLASH_GUILD_ID (immédiat), sinon
+    globalement (propagation plus lente, limite de débit stricte) ; retourne le nombre de commandes"""
+    guild_id = os.getenv('SLASH_GUILD_ID')
+    if guild_id:
+        guild = discord.Object(id=int(guild_id))
+        bot.tree.copy_global_to(guild=guild)
+        synced = await bot.tree.sync(guild=guild)
+    else:
+        synced = await bot.tree.sync()
+    logging.getLogger('discord_claude_bot').info(f"{len(synced)} commande(s) slash synchronisée(s)")
+    return len(synced)
+
+
+async def setup(bot):
+    claude = bot.get_cog('ClaudeCommands')
+    if claude is None:
+        raise RuntimeError("Le cog ClaudeCommands doit être chargé avant les commandes slash")
+    await bot.add_cog(SlashCommands(bot, claude))
+
+    # Les commandes enregistrées restent valables d'un démarrage à l'autre : la synchronisation globale (lente
+    # et limitée) n'a lieu qu'avec SLASH_SYNC=true ou via !ksync ; celle d'un serveur de test est immédiate
+    if os.getenv('SLASH_GUILD_ID') or os.getenv('SLASH_SYNC', 'false').lower() == 'true':
+        await sync_commands(bot)
@@ -0,0 +1,238 @@
+import os
+import re
+import sys
+import glob
+import gzip
+import json
+import shutil
+import hashlib
+import logging
+import argparse
+
+class ConversationArchive:
+    """Archive append-only des conversations : un dossier par canal, un enregistrement compact par message.
+
+    Les messages sont ajoutés à `current.jsonl` ; au-delà de ARCHIVE_SEGMENT_MAX_BYTES le segment est
+    compressé en `seg_<n>.jsonl.gz` et référencé dans `index.json` avec ses horodatages extrêmes,
+    ce qui permet de sauter les segments hors d'une période lors de la lecture.
+    """
+
+    CURRENT = 'current.jsonl'
+    INDEX = 'index.json'
+    LEGACY_PATTERN = re.compile(r"(?P<channel>-?\d+)_(?P<timestamp>\d{8}_\d{6})\.json")
+
+    def __init__(self, archive_dir='data/conversations'):
+        self.logger = logging.getLogger('discord_claude_bot')
+        self.archive_dir = archive_dir
+        self.segment_max_bytes = int(os.getenv('ARCHIVE_SEGMENT_MAX_BYTES', str(1024 * 1024)))
+
+        # Métadonnées du segment courant par canal (premier/dernier horodatage, nombre de messages)
+        self.current_meta = {}
+
+    def _channel_dir(self, channel_id):
+        return f"{self.archive_dir}/{channel_id}"
+
+    @staticmethod
+    def _encode(message):
+        """Enregistrement compact d'un message"""
+        return json.dumps(
+            {'t': message.get('timestamp'), 'r': message.get('role'), 'c': message.get('content')},
+            ensure_ascii=False,
+            separators=(',', ':')
+        )
+
+    @staticmethod
+    def _decode(line):
+        record = json.loads(line)
+        return {'role': record['r'], 'content': record['c'], 'timestamp': record['t']}
+
+    def _load_index(self, channel_id):
+        path = f"{self._channel_dir(channel_id)}/{self.INDEX}"
+        if not os.path.exists(path):
+            return []
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _current_meta(self, channel_id):
+        """Métadonnées du segment courant (relues depuis le disque au premier accès)"""
+        if channel_id not in self.current_meta:
+            meta = {'first': None, 'last': None, 'count': 0}
+            for message in self._read_file(f"{self._channel_dir(channel_id)}/{self.CURRENT}"):
+                meta['first'] = meta['first'] or message['timestamp']
+                meta['last'] = message['timestamp']
+                meta['count'] += 1
+            self.current_meta[channel_id] = meta
+        return self.current_meta[channel_id]
+
+    def append(self, channel_id, messages):
+        """Ajoute des messages à la fin de l'archive du canal"""
+        if not messages:
+            return
+        channel_dir = self._channel_dir(channel_id)
+        os.makedirs(channel_dir, exist_ok=True)
+        meta = self._current_meta(channel_id)
+
+        path = f"{channel_dir}/{self.CURRENT}"
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(''.join(self._encode(message) + '\n' for message in messages))
+            size = f.tell()
+
+        meta['first'] = meta['first'] or messages[0].get('timestamp')
+        meta['last'] = messages[-1].get('timestamp')
+        meta['count'] += len(messages)
+
+        if size >= self.segment_max_bytes:
+            self.rotate(channel_id)
+
+    def rotate(self, channel_id):
+        """Compresse le segment courant et l'ajoute à l'index du canal"""
+        channel_dir = self._channel_dir(channel_id)
+        current = f"{channel_dir}/{self.CURRENT}"
+        if not os.path.exists(current) or not os.path.getsize(current):
+            return
+
+        meta = self._current_meta(channel_id)
+        index = self._load_index(channel_id)
+        segment = f"seg_{len(index):06d}.jsonl.gz"
+        with open(current, 'rb') as src, gzip.open(f"{channel_dir}/{segment}", 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+
+        index.append({
+            'file': segment,
+            'first': meta['first'],
+            'last': meta['last'],
+            'count': meta['count'],
+            'bytes': os.path.getsize(f"{channel_dir}/{segment}")
+        })
+        tmp_path = f"{channel_dir}/{self.INDEX}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, f"{channel_dir}/{self.INDEX}")
+        os.remove(current)
+
+        self.current_meta[channel_id] = {'first': None, 'last': None, 'count': 0}
+        self.logger.info(f"Segment d'archive compressé : {channel_dir}/{segment} ({meta['count']} messages)")
+
+    def _read_file(self, path):
+        """Lit un segment (compressé ou non) message par message"""
+        if not os.path.exists(path):
+            return
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield self._decode(line)
+
+    def iter_messages(self, channel_id, start=None, end=None):
+        """Lit en streaming les messages d'un canal, éventuellement bornés dans le temps (ISO)"""
+        channel_dir = self._channel_dir(channel_id)
+        files = [
+            f"{channel_dir}/{segment['file']}"
+            for segment in self._load_index(channel_id)
+            if not (start and segment['last'] and segment['last'] < start)
+            and not (end and segment['first'] and segment['first'] > end)
+        ]
+        files.append(f"{channel_dir}/{self.CURRENT}")
+
+        for path in files:
+            for message in self._read_file(path):
+                timestamp = message['timestamp'] or ''
+                if start and timestamp < start:
+                    continue
+                if end and timestamp > end:
+                    continue
+                yield message
+
+    def channels(self):
+        """Canaux présents dans l'archive"""
+        if not os.path.isdir(self.archive_dir):
+            return []
+        return [
+            int(name) for name in os.listdir(self.archive_dir)
+            if re.fullmatch(r"-?\d+", name) and os.path.isdir(f"{self.archive_dir}/{name}")
+        ]
+
+    def files(self):
+        """Fichiers de l'archive (segments puis segment courant) par canal : [(channel_id, path)]"""
+        result = []
+        for channel_id in self.channels():
+            channel_dir = self._channel_dir(channel_id)
+            for segment in self._load_index(channel_id):
+                result.append((channel_id, f"{channel_dir}/{segment['file']}"))
+            if os.path.exists(f"{channel_dir}/{self.CURRENT}"):
+                result.append((channel_id, f"{channel_dir}/{self.CURRENT}"))
+        return result
+
+    def read_file(self, path):
+        return list(self._read_file(path))
+
+    def migrate_legacy(self, keep=True):
+        """Convertit les anciennes archives `{canal}_{horodatage}.json` (historiques complets qui se recouvrent)"""
+        legacy_files = []
+        for path in glob.glob(f"{self.archive_dir}/*.json"):
+            match = self.LEGACY_PATTERN.fullmatch(os.path.basename(path))
+            if match:
+                legacy_files.append((match['timestamp'], int(match['channel']), path))
+
+        seen = set()
+        migrated = 0
+        before_bytes = 0
+        for timestamp, channel_id, path in sorted(legacy_files):
+            before_bytes += os.path.getsize(path)
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            default_timestamp = (
+                f"{timestamp[0:4]}-{timestamp[4:6]}-{timestamp[6:8]}"
+                f"T{timestamp[9:11]}:{timestamp[11:13]}:{timestamp[13:15]}"
+            )
+
+            # Les sauvegardes successives d'un canal répètent l'historique : on ne garde que les nouveaux messages
+            new_messages = []
+            for message in data.get('messages', []):
+                key = hashlib.sha1(
+                    f"{channel_id}|{message.get('role')}|{message.get('timestamp', '')}|{message.get('content')}".encode('utf-8')
+                ).hexdigest()
+                if key in seen:
+                    continue
+                seen.add(key)
+                message = dict(message)
+                message.setdefault('timestamp', default_timestamp)
+                new_messages.append(message)
+
+            self.append(channel_id, new_messages)
+            migrated += len(new_messages)
+
+            if keep:
+                os.makedirs(f"{self.archive_dir}/legacy", exist_ok=True)
+                os.replace(path, f"{self.archive_dir}/legacy/{os.path.basename(path)}")
+            else:
+                os.remove(path)
+
+        for channel_id in self.channels():
+            self.rotate(channel_id)
+
+        after_bytes = sum(os.path.getsize(path) for _, path in self.files())
+        self.logger.info(
+            f"Migration des archives : {len(legacy_files)} fichiers, {migrated} messages, "
+            f"{before_bytes:,} → {after_bytes:,} octets"
+        )
+        return {'files': len(legacy_files), 'messages': migrated, 'before_bytes': before_bytes, 'after_bytes': after_bytes}
+
+def main():
+    parser = argparse.ArgumentParser(description="Outils de l'archive des conversations")
+    parser.add_argument('--dir', default='data/conversations')
+    parser.add_argument('--migrate', action='store_true', help="convertit les anciennes archives JSON")
+    parser.add_argument('--delete-legacy', action='store_true', help="supprime les anciens fichiers au lieu de les déplacer dans legacy/")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if not args.migrate:
+        parser.print_help()
+        return 1
+    result = ConversationArchive(args.dir).migrate_legacy(keep=not args.delete_legacy)
+    print(f"{result['files']} fichiers migrés, {result['messages']} messages, "
+          f"{result['before_bytes']:,} → {result['after_bytes']:,} octets")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
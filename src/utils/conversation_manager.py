@@ -1,71 +1,344 @@
 import os
-import json
+import sys
+import time
+import heapq
+import asyncio
+import threading
 from datetime import datetime, timedelta
-from collections import defaultdict
+from collections import defaultdict, deque
 import logging
+from .conversation_archive import ConversationArchive
+from .search_index import ConversationSearchIndex
+from .persistence import persistence
+from .metrics import metrics
+
+class HistoryMessage:
+    """Message de l'historique en mémoire : rôle interné (partagé par tous les messages), horodatage epoch"""
+
+    __slots__ = ('role', 'content', 'timestamp')
+
+    # Taille d'un float horodatage (le rôle interné et la chaîne vide ne sont pas comptés)
+    FLOAT_BYTES = sys.getsizeof(0.0)
+
+    def __init__(self, role: str, content: str, timestamp: float):
+        self.role = sys.intern(role)
+        self.content = content
+        self.timestamp = timestamp
+
+    @classmethod
+    def from_dict(cls, message: dict):
+        timestamp = message.get('timestamp')
+        return cls(
+            message['role'],
+            message['content'],
+            datetime.fromisoformat(timestamp).timestamp() if timestamp else time.time()
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            'role': self.role,
+            'content': self.content,
+            'timestamp': datetime.fromtimestamp(self.timestamp).isoformat(timespec='seconds')
+        }
+
+    def nbytes(self) -> int:
+        """Octets occupés par le message (enregistrement, texte et horodatage)"""
+        return sys.getsizeof(self) + sys.getsizeof(self.content) + self.FLOAT_BYTES
+
 
 class ConversationManager:
+    """Historiques de conversation par canal, bornés en nombre de messages et, globalement, en octets.
+
+    Chaque canal garde au plus MAX_HISTORY paires dans une deque de HistoryMessage. Au-delà de
+    HISTORY_MAX_BYTES pour l'ensemble des canaux, les canaux inactifs depuis le plus longtemps (LRU) sont
+    retirés de la mémoire ; leurs messages étant déjà archivés, ils sont rechargés à la requête suivante.
+    """
+
     def __init__(self):
-        self.conversations = defaultdict(list)
-        self.last_activity = defaultdict(datetime.now)
         self.max_history = int(os.getenv('MAX_HISTORY', 10))
         self.timeout = int(os.getenv('CONVERSATION_TIMEOUT', 3600))  # 1 heure par défaut
+        self.max_bytes = int(os.getenv('HISTORY_MAX_BYTES', str(64 * 1024 * 1024)))
         self.logger = logging.getLogger('discord_claude_bot')
+
+        self.conversations = {}  # canal -> deque(HistoryMessage)
+        self.last_activity = {}  # canal -> dernière activité (epoch), dans l'ordre d'activité (LRU en tête)
+        self.total_bytes = 0
+        self.evicted = set()  # canaux retirés de la mémoire par manque de place, à recharger depuis l'archive
         
-        # Création du dossier de sauvegarde si nécessaire
+        # Dossier de sauvegarde (créé à la première écriture)
         self.save_dir = 'data/conversations'
-        os.makedirs(self.save_dir, exist_ok=True)
+        
+        # Archive append-only par canal : chaque message y est ajouté une seule fois
+        self.archive = ConversationArchive(self.save_dir)
+        
+        # Index plein texte des archives, complété à chaque sauvegarde (ouvert au premier usage)
+        self._search_index = None
+        self._search_index_lock = threading.Lock()
+        
+        # Rappel du contexte archivé : extraits pertinents ajoutés à chaque requête (RETRIEVAL_ENABLED=true)
+        self.retrieval_enabled = os.getenv('RETRIEVAL_ENABLED', 'false').lower() == 'true'
+        self.retrieval_scope = os.getenv('RETRIEVAL_SCOPE', 'channel').lower()  # channel ou all
+        self.retrieval_top_k = int(os.getenv('RETRIEVAL_TOP_K', '5'))
+        self.retrieval_token_budget = int(os.getenv('RETRIEVAL_TOKEN_BUDGET', '500'))
+        self.retrieval_min_score = float(os.getenv('RETRIEVAL_MIN_SCORE', '0'))  # score BM25 minimal d'un extrait
+        self.retrieval_max_term_docs = int(os.getenv('RETRIEVAL_MAX_TERM_DOCS', '2000'))  # mots plus fréquents ignorés
+        
+        # Compaction : les tours évincés sont résumés en arrière-plan par un modèle économique
+        self.compaction_enabled = os.getenv('HISTORY_COMPACTION', 'false').lower() == 'true'
+        # Historique du salon envoyé avec chaque !kask : sur demande (ou avec la compaction) ; toujours dans un fil
+        self.channel_history = os.getenv('KASK_HISTORY', 'false').lower() == 'true' or self.compaction_enabled
+        self.summarizer = None  # coroutine (résumé précédent, messages évincés) -> nouveau résumé
+        self.summaries = {}
+        self.pending_evicted = defaultdict(list)
+        self.compaction_tasks = {}
+        
+        # Canaux dont l'historique a déjà été recherché dans l'archive, et rappel à l'expiration d'un historique
+        self.restored = set()
+        self.on_expired = None  # fonction (identifiants des canaux expirés)
+
+    @property
+    def search_index(self):
+        """Index de recherche, ouvert et mis à jour depuis l'archive au premier usage (ou par warm_up)"""
+        if self._search_index is None:
+            with self._search_index_lock:
+                if self._search_index is None:
+                    search_index = ConversationSearchIndex(self.save_dir)
+                    search_index.rebuild(self.archive)
+                    self._search_index = search_index
+        return self._search_index
+
+    def warm_up(self):
+        """Prépare l'index de recherche (appelé dans le pool de persistance une fois le bot connecté)"""
+        return self.search_index
 
     def _cleanup_old_conversations(self):
-        """Nettoie les conversations inactives"""
-        current_time = datetime.now()
+        """Nettoie les conversations inactives (parcourt seulement les plus anciennes, dans l'ordre LRU)"""
+        cutoff = time.time() - self.timeout
         channels_to_remove = []
         
         for channel_id, last_time in self.last_activity.items():
-            if (current_time - last_time).total_seconds() > self.timeout:
-                channels_to_remove.append(channel_id)
+            if last_time > cutoff:
+                break
+            channels_to_remove.append(channel_id)
                 
+        # Les messages sont déjà archivés au fil de l'eau
         for channel_id in channels_to_remove:
-            self._save_conversation(channel_id)
-            del self.conversations[channel_id]
-            del self.last_activity[channel_id]
+            self._drop(channel_id)
+        if channels_to_remove and self.on_expired:
+            self.on_expired(channels_to_remove)
+
+    def _drop(self, channel_id, keep_summary=False):
+        """Retire un canal de la mémoire (en gardant son résumé si `keep_summary`, l'historique devant être rechargé)"""
+        history = self.conversations.pop(channel_id, None)
+        if history is not None:
+            self.total_bytes -= self.channel_bytes(history)
+        self.last_activity.pop(channel_id, None)
+        if not keep_summary:
+            self.summaries.pop(channel_id, None)
+
+    def _touch(self, channel_id):
+        """Marque le canal comme le plus récemment actif"""
+        # Dict ordinaire (plus compact qu'un OrderedDict) : retirer puis réinsérer place la clé en fin d'ordre
+        self.last_activity.pop(channel_id, None)
+        self.last_activity[channel_id] = time.time()
 
-    def _save_conversation(self, channel_id):
-        """Sauvegarde une conversation dans un fichier"""
+    def _history(self, channel_id):
+        """Deque du canal, créée au premier message"""
+        history = self.conversations.get(channel_id)
+        if history is None:
+            history = self.conversations[channel_id] = deque(maxlen=self.max_history * 2)  # *2 car on compte les paires Q/R
+            self.total_bytes += sys.getsizeof(history)
+        return history
+
+    @staticmethod
+    def channel_bytes(history) -> int:
+        """Octets occupés par l'historique d'un canal"""
+        return sys.getsizeof(history) + sum(record.nbytes() for record in history)
+
+    def _push(self, channel_id, record):
+        """Ajoute un message à la deque du canal ; retourne le message évincé s'il y en a un"""
+        history = self._history(channel_id)
+        evicted = history.popleft() if len(history) == history.maxlen else None
+        history.append(record)
+        self.total_bytes += record.nbytes() - (evicted.nbytes() if evicted else 0)
+        return evicted
+
+    def _enforce_memory_cap(self, keep):
+        """Retire les canaux les moins récemment actifs tant que le plafond d'octets est dépassé"""
+        while self.total_bytes > self.max_bytes and self.last_activity:
+            channel_id = next(iter(self.last_activity))
+            if channel_id == keep:
+                break
+            # Le résumé glissant (déjà payé) n'est pas dans l'archive : il reste en mémoire jusqu'au rechargement
+            self._drop(channel_id, keep_summary=True)
+            self.evicted.add(channel_id)
+            metrics.incr('history.evicted')
+
+    def memory_report(self) -> dict:
+        """Occupation mémoire des historiques : total, moyenne et plus gros canaux"""
+        channels = len(self.conversations)
+        largest = heapq.nlargest(
+            5, ((channel_id, self.channel_bytes(history)) for channel_id, history in self.conversations.items()),
+            key=lambda item: item[1]
+        )
+        return {
+            'channels': channels,
+            'total_bytes': self.total_bytes,
+            'max_bytes': self.max_bytes,
+            'bytes_per_channel': self.total_bytes / channels if channels else 0.0,
+            'largest': largest,
+            'evicted': len(self.evicted)
+        }
+
+    def _recent_archived(self, channel_id):
+        """Derniers messages archivés d'un canal, s'ils datent de moins de CONVERSATION_TIMEOUT"""
+        messages = deque(self.archive.iter_messages(channel_id), maxlen=self.max_history * 2)
+        if not messages or not messages[-1]['timestamp']:
+            return []
+        records = [HistoryMessage.from_dict(message) for message in messages]
+        if time.time() - records[-1].timestamp > self.timeout:
+            return []
+        return records
+
+    async def restore_conversation(self, channel_id):
+        """Recharge depuis l'archive l'historique encore actif d'un canal absent de la mémoire
+        (après un redémarrage, ou après son éviction par manque de place)"""
+        if channel_id in self.restored and channel_id not in self.evicted:
+            return
+        self.restored.add(channel_id)
+        self.evicted.discard(channel_id)
+        if self.conversations.get(channel_id):
+            return
+        records = await persistence.run(self._recent_archived, channel_id)
+        if not records and not self.conversations.get(channel_id):
+            self.summaries.pop(channel_id, None)  # conversation expirée depuis l'éviction : son résumé aussi
+        if records and not self.conversations.get(channel_id):
+            for record in records:
+                self._push(channel_id, record)
+            # Rechargé pour une nouvelle requête : le canal redevient le plus récemment actif
+            self._touch(channel_id)
+            self._enforce_memory_cap(keep=channel_id)
+            self.logger.info(f"Historique du canal {channel_id} restauré depuis l'archive ({len(records)} messages)")
+
+    def _save_conversation(self, channel_id, messages):
+        """Ajoute des messages à l'archive du canal et à l'index de recherche (dans le pool de persistance)"""
+        persistence.submit('conversations', self._write_conversation, channel_id, messages)
+
+    def _write_conversation(self, channel_id, messages):
         try:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"{self.save_dir}/{channel_id}_{timestamp}.json"
-            
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump({
-                    'channel_id': channel_id,
-                    'timestamp': timestamp,
-                    'messages': self.conversations[channel_id]
-                }, f, ensure_ascii=False, indent=2)
-                
-            self.logger.info(f"Conversation sauvegardée : {filename}")
-            
+            self.archive.append(channel_id, messages)
+            self.search_index.index_messages(channel_id, messages, messages[-1]['timestamp'])
         except Exception as e:
             self.logger.error(f"Erreur lors de la sauvegarde de la conversation : {str(e)}")
 
     def get_conversation(self, channel_id):
         """Récupère l'historique de conversation pour un canal"""
         self._cleanup_old_conversations()
-        return self.conversations[channel_id]
+        return self.conversations.get(channel_id, ())
 
     def add_message(self, channel_id, message):
         """Ajoute un message à l'historique de conversation"""
-        self.conversations[channel_id].append(message)
-        self.last_activity[channel_id] = datetime.now()
+        message.setdefault('timestamp', datetime.now().isoformat(timespec='seconds'))
+        record = HistoryMessage.from_dict(message)
+        evicted = self._push(channel_id, record)
+        self._touch(channel_id)
+        self._save_conversation(channel_id, [message])
         
-        # Limite la taille de l'historique
-        if len(self.conversations[channel_id]) > self.max_history * 2:  # *2 car on compte les paires Q/R
-            self._save_conversation(channel_id)
-            self.conversations[channel_id] = self.conversations[channel_id][-self.max_history*2:]
+        # La deque limite la taille de l'historique ; le message évincé peut alimenter le résumé
+        if evicted is not None and self.compaction_enabled and self.summarizer:
+            self._schedule_compaction(channel_id, [evicted])
+        self._enforce_memory_cap(keep=channel_id)
+        metrics.set_gauge('history.bytes', self.total_bytes)
+        metrics.set_gauge('history.channels', len(self.conversations))
+
+    def _schedule_compaction(self, channel_id, evicted):
+        """Met les tours évincés en attente de résumé, avec au plus une tâche de compaction par canal"""
+        self.pending_evicted[channel_id].extend(evicted)
+        task = self.compaction_tasks.get(channel_id)
+        if task and not task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # Pas de boucle : les tours restent en attente jusqu'au prochain débordement
+        self.compaction_tasks[channel_id] = loop.create_task(self._compact(channel_id))
+
+    async def _compact(self, channel_id):
+        """Intègre les tours évincés au résumé glissant du canal"""
+        while self.pending_evicted.get(channel_id):
+            evicted = self.pending_evicted.pop(channel_id)
+            try:
+                summary = await self.summarizer(self.summaries.get(channel_id), evicted)
+                if summary:
+                    self.summaries[channel_id] = summary
+                    self.logger.info(f"Résumé du canal {channel_id} mis à jour ({len(evicted)} messages intégrés)")
+            except Exception as e:
+                self.logger.error(f"Erreur lors de la compaction de l'historique : {str(e)}")
+        self.compaction_tasks.pop(channel_id, None)
+
+    def get_prompt_messages(self, channel_id):
+        """Historique au format de l'API, précédé du résumé glissant s'il existe"""
+        messages = []
+        summary = self.summaries.get(channel_id)
+        if summary:
+            messages.append({"role": "user", "content": [{"type": "text", "text": f"Résumé de notre conversation précédente :\n{summary}"}]})
+            messages.append({"role": "assistant", "content": [{"type": "text", "text": "Compris, je garde ce contexte en tête."}]})
+        
+        for message in self.get_conversation(channel_id):
+            block = {"type": "text", "text": message.content}
+            if messages and messages[-1]['role'] == message.role:
+                # Tours consécutifs du même rôle fusionnés pour garder l'alternance
+                messages[-1]['content'].append(block)
+            elif messages or message.role == 'user':
+                messages.append({"role": message.role, "content": [block]})
+        
+        # L'historique doit se terminer par une réponse pour accueillir la nouvelle question
+        if messages and messages[-1]['role'] == 'user':
+            messages.pop()
+        return messages
+
+    async def search(self, query, channel_id=None, start=None, end=None):
+        """Recherche dans les conversations archivées (!ksearch), hors de la boucle : l'index peut être encore
+        en construction (warm_up), auquel cas la recherche attend sa fin dans un thread"""
+        return await asyncio.to_thread(lambda: self.search_index.search(query, channel_id, start, end))
+
+    async def related_context(self, channel_id, text):
+        """Extraits archivés les plus pertinents pour `text`, dans la limite de RETRIEVAL_TOKEN_BUDGET, ou None.
+
+        Les messages encore dans l'historique du canal sont écartés : ils sont déjà envoyés avec la requête.
+        L'index n'est interrogé qu'une fois ouvert (warm_up), pour ne jamais attendre sa construction.
+        """
+        if not self.retrieval_enabled or self._search_index is None or not text:
+            return None
+        start = time.perf_counter()
+        history = self.conversations.get(channel_id)
+        exclude = (channel_id, history[0].to_dict()['timestamp']) if history else None
+        hits = await asyncio.to_thread(
+            self._search_index.related, text,
+            channel_id=channel_id if self.retrieval_scope == 'channel' else None,
+            exclude=exclude, limit=self.retrieval_top_k, min_score=self.retrieval_min_score,
+            max_docs=self.retrieval_max_term_docs
+        )
+
+        lines = []
+        tokens = 0
+        for hit in hits:
+            speaker = 'Utilisateur' if hit['role'] == 'user' else 'Assistant'
+            line = f"- [{hit['timestamp'][:10]}] {speaker} : {hit['excerpt']}"
+            line_tokens = len(line) // 4 + 1  # Estimation : ~4 caractères par token
+            if tokens + line_tokens > self.retrieval_token_budget:
+                continue
+            lines.append(line)
+            tokens += line_tokens
+        metrics.observe('retrieval.seconds', time.perf_counter() - start)
+        metrics.observe('retrieval.tokens', tokens)
+        if not lines:
+            return None
+        metrics.incr('retrieval.snippets', len(lines))
+        return "Extraits de conversations passées, à utiliser seulement s'ils sont utiles :\n" + '\n'.join(lines)
 
     def clear_conversation(self, channel_id):
         """Efface l'historique de conversation pour un canal"""
-        if channel_id in self.conversations:
-            self._save_conversation(channel_id)
-            del self.conversations[channel_id]
-            del self.last_activity[channel_id]
\ No newline at end of file
+        self.pending_evicted.pop(channel_id, None)
+        self.evicted.discard(channel_id)
+        self._drop(channel_id)
\ No newline at end of file
@@ -2,18 +2,17 @@ import os
 import json
 from datetime import datetime, date, timedelta
 import logging
-from collections import defaultdict
-import pandas as pd
+from collections import defaultdict, deque
+from .persistence import persistence
+from .tracing import tracer
 
 class CostTracker:
     def __init__(self):
         self.logger = logging.getLogger('discord_claude_bot')
         
-        # Création des dossiers nécessaires
+        # Dossiers de données (créés à la première écriture)
         self.data_dir = 'data/stats'
         self.reports_dir = 'data/reports'
-        os.makedirs(self.data_dir, exist_ok=True)
-        os.makedirs(self.reports_dir, exist_ok=True)
         
         # Fichier pour les statistiques permanentes
         self.stats_file = f"{self.data_dir}/all_stats.json"
@@ -38,8 +37,17 @@ class CostTracker:
             }
         }
         
-        # Charger les statistiques existantes
+        # Documents traités par map-reduce (coût imputé par document)
+        self.documents_file = f"{self.data_dir}/documents.jsonl"
+        self.documents = deque(maxlen=50)
+        
+        # Comparaisons de modèles (!kcompare), rechargées au démarrage pour le routage
+        self.comparisons_file = f"{self.data_dir}/comparisons.jsonl"
+        self.comparisons = self._load_comparisons()
+        
+        # Charger les statistiques existantes et construire les agrégats
         self.stats = self._load_stats()
+        self._build_rollups()
         
     def _load_stats(self):
         """Charge les statistiques depuis le fichier"""
@@ -55,25 +63,95 @@ class CostTracker:
         # Retourner une structure vide si le fichier n'existe pas ou est corrompu
         return {}
 
-    def _save_stats(self):
-        """Sauvegarde les statistiques dans le fichier"""
+    def _load_comparisons(self, limit=200):
+        """Charge les dernières comparaisons de modèles enregistrées"""
+        comparisons = deque(maxlen=limit)
         try:
-            with open(self.stats_file, 'w', encoding='utf-8') as f:
-                json.dump(self.stats, f, indent=2)
-            self.logger.info("Statistiques sauvegardées avec succès")
+            if os.path.exists(self.comparisons_file):
+                with open(self.comparisons_file, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        if line.strip():
+                            comparisons.append(json.loads(line))
         except Exception as e:
-            self.logger.error(f"Erreur lors de la sauvegarde des stats: {str(e)}")
+            self.logger.error(f"Erreur lors du chargement des comparaisons : {str(e)}")
+        return comparisons
 
-    def track_request(self, model: str, input_tokens: int, output_tokens: int):
-        """Enregistre une requête à l'API"""
-        today = date.today().isoformat()
+    def _save_stats(self):
+        """Planifie la sauvegarde des statistiques (écriture regroupée, hors de la boucle d'événements)"""
+        # La sérialisation a lieu au moment de l'écriture pour n'écrire que l'état le plus récent
+        persistence.write(self.stats_file, lambda: json.dumps(self.stats, indent=2))
+
+    @staticmethod
+    def _empty_bucket():
+        """Structure vide d'agrégat (jour, semaine, mois ou total)"""
+        return {
+            'total_cost': 0.0,
+            'total_tokens': 0,
+            'requests': 0,
+            'model_usage': {},
+            'token_usage': {},
+            'hedges': {'count': 0, 'backup_wins': 0, 'extra_cost': 0.0, 'extra_tokens': 0},
+            'categories': {},
+            'images': {'count': 0, 'original_tokens': 0, 'tokens': 0, 'bytes_in': 0, 'bytes_out': 0}
+        }
+
+    @staticmethod
+    def _merge_bucket(target, source):
+        """Ajoute un agrégat (ou une journée de stats) à un autre"""
+        target['total_cost'] += source['total_cost']
+        target['total_tokens'] += source['total_tokens']
+        target['requests'] += source['requests']
         
-        # Calcul des coûts
-        input_cost = (input_tokens / 1000) * self.costs[model]['input']
-        output_cost = (output_tokens / 1000) * self.costs[model]['output']
-        total_cost = input_cost + output_cost
+        for model, count in source['model_usage'].items():
+            target['model_usage'][model] = target['model_usage'].get(model, 0) + count
         
-        # Initialiser la structure si nécessaire
+        for model, tokens in source['token_usage'].items():
+            if model not in target['token_usage']:
+                target['token_usage'][model] = {'input': 0, 'output': 0}
+            target['token_usage'][model]['input'] += tokens['input']
+            target['token_usage'][model]['output'] += tokens['output']
+        
+        for key, value in source.get('hedges', {}).items():
+            target['hedges'][key] += value
+        
+        for category, usage in source.get('categories', {}).items():
+            totals = target['categories'].setdefault(category, {'requests': 0, 'cost': 0.0, 'tokens': 0})
+            for key, value in usage.items():
+                totals[key] += value
+        
+        for key, value in source.get('images', {}).items():
+            target['images'][key] += value
+
+    @staticmethod
+    def _rollup_keys(date_str):
+        """Clés des agrégats (semaine ISO, mois) auxquels appartient une journée"""
+        year, week, _ = date.fromisoformat(date_str).isocalendar()
+        return f"{year}-W{week:02d}", date_str[:7]
+
+    def _build_rollups(self):
+        """Construit les agrégats par semaine ISO, mois et au total, ainsi que la heatmap horaire"""
+        self.rollups = {'week': {}, 'month': {}, 'all': self._empty_bucket()}
+        self.heatmap = [[0] * 24 for _ in range(7)]
+        
+        for date_str, daily_stats in self.stats.items():
+            week_key, month_key = self._rollup_keys(date_str)
+            for bucket in (
+                self.rollups['week'].setdefault(week_key, self._empty_bucket()),
+                self.rollups['month'].setdefault(month_key, self._empty_bucket()),
+                self.rollups['all']
+            ):
+                self._merge_bucket(bucket, daily_stats)
+            
+            weekday = date.fromisoformat(date_str).weekday()
+            for hour, count in daily_stats.get('hours', {}).items():
+                self.heatmap[weekday][int(hour)] += count
+        
+        # Version des données : tout rapport en cache d'une version antérieure est obsolète
+        self.version = 0
+        self.report_cache = {}
+
+    def _init_day(self, today):
+        """Initialise la structure des statistiques d'une journée si nécessaire"""
         if today not in self.stats:
             self.stats[today] = {
                 'total_cost': 0.0,
@@ -82,73 +160,304 @@ class CostTracker:
                 'model_usage': defaultdict(int),
                 'token_usage': defaultdict(lambda: {'input': 0, 'output': 0})
             }
+
+    def _record_usage(self, model, input_tokens, output_tokens, cost, requests, hedge=None, category=None):
+        """Met à jour la journée courante et les agrégats en O(1)"""
+        now = datetime.now()
+        today = now.date().isoformat()
+        self._init_day(today)
         
-        # Mise à jour des statistiques
-        self.stats[today]['total_cost'] += total_cost
-        self.stats[today]['total_tokens'] += (input_tokens + output_tokens)
-        self.stats[today]['requests'] += 1
-        self.stats[today]['model_usage'][model] = self.stats[today]['model_usage'].get(model, 0) + 1
-        
-        if model not in self.stats[today]['token_usage']:
-            self.stats[today]['token_usage'][model] = {'input': 0, 'output': 0}
+        week_key, month_key = self._rollup_keys(today)
+        buckets = (
+            self.stats[today],
+            self.rollups['week'].setdefault(week_key, self._empty_bucket()),
+            self.rollups['month'].setdefault(month_key, self._empty_bucket()),
+            self.rollups['all']
+        )
+        for bucket in buckets:
+            bucket['total_cost'] += cost
+            bucket['total_tokens'] += (input_tokens + output_tokens)
+            bucket['requests'] += requests
+            if requests:
+                bucket['model_usage'][model] = bucket['model_usage'].get(model, 0) + requests
+            
+            if model not in bucket['token_usage']:
+                bucket['token_usage'][model] = {'input': 0, 'output': 0}
+            bucket['token_usage'][model]['input'] += input_tokens
+            bucket['token_usage'][model]['output'] += output_tokens
+            
+            if hedge:
+                hedges = bucket.setdefault('hedges', {
+                    'count': 0,
+                    'backup_wins': 0,
+                    'extra_cost': 0.0,
+                    'extra_tokens': 0
+                })
+                for key, value in hedge.items():
+                    hedges[key] += value
+            
+            if category:
+                totals = bucket.setdefault('categories', {}).setdefault(category, {'requests': 0, 'cost': 0.0, 'tokens': 0})
+                totals['requests'] += requests
+                totals['cost'] += cost
+                totals['tokens'] += input_tokens + output_tokens
         
-        self.stats[today]['token_usage'][model]['input'] += input_tokens
-        self.stats[today]['token_usage'][model]['output'] += output_tokens
+        if requests:
+            hours = self.stats[today].setdefault('hours', {})
+            hours[str(now.hour)] = hours.get(str(now.hour), 0) + requests
+            self.heatmap[now.weekday()][now.hour] += requests
         
-        # Sauvegarde après chaque mise à jour
-        self._save_stats()
+        self.version += 1
+
+    def track_request(self, model: str, input_tokens: int, output_tokens: int, category: str = 'chat'):
+        """Enregistre une requête à l'API (catégories : chat, summary...)"""
+        with tracer.span('track_request', category=category):
+            # Calcul des coûts
+            input_cost = (input_tokens / 1000) * self.costs[model]['input']
+            output_cost = (output_tokens / 1000) * self.costs[model]['output']
+            total_cost = input_cost + output_cost
+            
+            # Mise à jour de la journée et des agrégats
+            self._record_usage(model, input_tokens, output_tokens, total_cost, requests=1, category=category)
+            
+            # Sauvegarde après chaque mise à jour
+            self._save_stats()
         
         # Log de la requête
         self.logger.info(
-            f"Requête: {model} - {input_tokens}/{output_tokens} tokens "
+            f"Requête ({category}): {model} - {input_tokens}/{output_tokens} tokens "
             f"- Coût: ${total_cost:.4f}"
         )
+        return total_cost
 
-    def _aggregate_stats(self, start_date, end_date):
-        """Agrège les statistiques sur une période donnée"""
-        aggregated = {
-            'total_cost': 0.0,
-            'total_tokens': 0,
-            'requests': 0,
-            'model_usage': defaultdict(int),
-            'token_usage': defaultdict(lambda: {'input': 0, 'output': 0})
+    def track_hedge(self, model: str, input_tokens: int, output_tokens: int, backup_won: bool):
+        """Enregistre le surcoût d'une requête de secours (hedging) annulée"""
+        input_cost = (input_tokens / 1000) * self.costs[model]['input']
+        output_cost = (output_tokens / 1000) * self.costs[model]['output']
+        extra_cost = input_cost + output_cost
+        
+        # Le surcoût est réellement facturé : il compte dans les totaux, mais pas comme une requête
+        self._record_usage(model, input_tokens, output_tokens, extra_cost, requests=0, hedge={
+            'count': 1,
+            'backup_wins': int(backup_won),
+            'extra_cost': extra_cost,
+            'extra_tokens': input_tokens + output_tokens
+        })
+        
+        self._save_stats()
+        
+        self.logger.info(
+            f"Hedging: {model} annulé - {input_tokens}/{output_tokens} tokens "
+            f"- Surcoût: ${extra_cost:.4f} - Secours gagnant: {'oui' if backup_won else 'non'}"
+        )
+
+    def track_images(self, images: list):
+        """Enregistre les images envoyées et les tokens économisés par leur réduction"""
+        today = date.today().isoformat()
+        self._init_day(today)
+        
+        week_key, month_key = self._rollup_keys(today)
+        for bucket in (
+            self.stats[today],
+            self.rollups['week'].setdefault(week_key, self._empty_bucket()),
+            self.rollups['month'].setdefault(month_key, self._empty_bucket()),
+            self.rollups['all']
+        ):
+            totals = bucket.setdefault('images', {'count': 0, 'original_tokens': 0, 'tokens': 0, 'bytes_in': 0, 'bytes_out': 0})
+            totals['count'] += len(images)
+            for image in images:
+                for key in ('original_tokens', 'tokens', 'bytes_in', 'bytes_out'):
+                    totals[key] += image[key]
+        
+        self.version += 1
+        self._save_stats()
+
+    def track_document(self, totals: dict):
+        """Enregistre le coût total d'un document traité par map-reduce (ses appels sont déjà comptés)"""
+        record = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'files': totals['filenames'],
+            'bytes': totals['bytes'],
+            'chunks': totals['chunks'],
+            'calls': totals['calls'],
+            'input_tokens': totals['input_tokens'],
+            'output_tokens': totals['output_tokens'],
+            'cost': round(totals['cost'], 6),
+            'duration': round(totals['duration'], 2)
         }
+        self.documents.append(record)
+        persistence.append(self.documents_file, json.dumps(record, ensure_ascii=False) + '\n')
+        self.logger.info(f"Document {', '.join(record['files'])} : {record['calls']} appels - Coût: ${record['cost']:.4f}")
+
+    def format_documents(self, limit: int = 10) -> str:
+        """Coût des derniers documents traités (depuis le démarrage)"""
+        if not self.documents:
+            return "Aucun document traité depuis le démarrage"
+        report = "# Derniers documents traités\n"
+        for record in list(self.documents)[-limit:]:
+            report += (
+                f"\n- {record['timestamp']} {', '.join(record['files'])} : {record['chunks']} parties, "
+                f"{record['input_tokens'] + record['output_tokens']:,} tokens, ${record['cost']:.4f}, {record['duration']:.1f}s"
+            )
+        return report
+
+    def track_comparison(self, record: dict):
+        """Enregistre le résultat d'une comparaison de modèles (les appels sont déjà comptés)"""
+        record = dict(record, timestamp=datetime.now().isoformat(timespec='seconds'))
+        self.comparisons.append(record)
+        persistence.append(self.comparisons_file, json.dumps(record, ensure_ascii=False) + '\n')
+
+    def format_comparisons(self) -> str:
+        """Moyennes par modèle sur les comparaisons enregistrées"""
+        if not self.comparisons:
+            return "Aucune comparaison enregistrée (voir !kcompare)"
         
-        for date_str, daily_stats in self.stats.items():
-            if start_date <= date_str <= end_date:
-                aggregated['total_cost'] += daily_stats['total_cost']
-                aggregated['total_tokens'] += daily_stats['total_tokens']
-                aggregated['requests'] += daily_stats['requests']
-                
-                for model, count in daily_stats['model_usage'].items():
-                    aggregated['model_usage'][model] += count
-                
-                for model, tokens in daily_stats['token_usage'].items():
-                    if model not in aggregated['token_usage']:
-                        aggregated['token_usage'][model] = {'input': 0, 'output': 0}
-                    aggregated['token_usage'][model]['input'] += tokens['input']
-                    aggregated['token_usage'][model]['output'] += tokens['output']
+        totals = defaultdict(lambda: {'runs': 0, 'errors': 0, 'ttft': 0.0, 'latency': 0.0, 'output_tokens': 0, 'cost': 0.0, 'fastest': 0})
+        for record in self.comparisons:
+            successes = [result for result in record['results'] if not result.get('error')]
+            fastest = min(successes, key=lambda result: result['latency'])['model'] if successes else None
+            for result in record['results']:
+                model_totals = totals[result['model']]
+                if result.get('error'):
+                    model_totals['errors'] += 1
+                    continue
+                model_totals['runs'] += 1
+                model_totals['ttft'] += result['ttft'] or 0.0
+                model_totals['latency'] += result['latency']
+                model_totals['output_tokens'] += result['output_tokens']
+                model_totals['cost'] += result['cost']
+                model_totals['fastest'] += int(result['model'] == fastest)
+        
+        report = f"# Comparaisons de modèles ({len(self.comparisons)} dernières)\n"
+        for model, model_totals in sorted(totals.items(), key=lambda item: item[1]['latency'] / max(1, item[1]['runs'])):
+            runs = max(1, model_totals['runs'])
+            report += (
+                f"\n- {model} : TTFT {model_totals['ttft'] / runs:.2f}s, total {model_totals['latency'] / runs:.2f}s, "
+                f"{model_totals['output_tokens'] / runs:.0f} tokens en sortie, ${model_totals['cost'] / runs:.4f}/requête, "
+                f"le plus rapide {model_totals['fastest']}/{model_totals['runs']} fois"
+            )
+            if model_totals['errors']:
+                report += f" ({model_totals['errors']} erreurs)"
+        return report
+
+    def _aggregate_stats(self, start_date, end_date):
+        """Agrège les statistiques sur une période donnée à partir des agrégats mois/semaine/jour"""
+        aggregated = self._empty_bucket()
+        if not self.stats:
+            return aggregated
+        
+        # On borne la période à l'historique existant
+        current = max(date.fromisoformat(start_date), date.fromisoformat(min(self.stats)))
+        end = min(date.fromisoformat(end_date), date.fromisoformat(max(self.stats)))
+        
+        while current <= end:
+            next_month = (current.replace(day=28) + timedelta(days=4)).replace(day=1)
+            if current.day == 1 and next_month - timedelta(days=1) <= end:
+                # Mois complet
+                bucket = self.rollups['month'].get(current.isoformat()[:7])
+                current = next_month
+            elif current.weekday() == 0 and current + timedelta(days=6) <= end:
+                # Semaine ISO complète
+                bucket = self.rollups['week'].get(self._rollup_keys(current.isoformat())[0])
+                current += timedelta(days=7)
+            else:
+                bucket = self.stats.get(current.isoformat())
+                current += timedelta(days=1)
+            if bucket:
+                self._merge_bucket(aggregated, bucket)
         
         return aggregated
 
+    def _resolve_period(self, period):
+        """Retourne (titre, agrégat) pour une période, ou (None, message d'erreur)"""
+        today = date.today()
+        
+        if period == 'day':
+            stats = self._empty_bucket()
+            if today.isoformat() in self.stats:
+                self._merge_bucket(stats, self.stats[today.isoformat()])
+            return f"Rapport quotidien - {today.isoformat()}", stats
+        
+        if period == 'week':
+            # 7 jours glissants : 7 lectures de journées, quelle que soit la taille de l'historique
+            week_start = today - timedelta(days=6)
+            stats = self._empty_bucket()
+            for offset in range(7):
+                daily_stats = self.stats.get((week_start + timedelta(days=offset)).isoformat())
+                if daily_stats:
+                    self._merge_bucket(stats, daily_stats)
+            return f"Rapport hebdomadaire - Du {week_start.isoformat()} au {today.isoformat()}", stats
+        
+        if period == 'month':
+            month_key = today.isoformat()[:7]
+            stats = self._empty_bucket()
+            self._merge_bucket(stats, self.rollups['month'].get(month_key, self._empty_bucket()))
+            return f"Rapport mensuel - {month_key}", stats
+        
+        if '..' in period:
+            try:
+                start_str, end_str = period.split('..', 1)
+                start_date = date.fromisoformat(start_str).isoformat()
+                end_date = date.fromisoformat(end_str).isoformat()
+            except ValueError:
+                return None, "Période invalide, format attendu : AAAA-MM-JJ..AAAA-MM-JJ"
+            return f"Rapport - Du {start_date} au {end_date}", self._aggregate_stats(start_date, end_date)
+        
+        # 'all'
+        if not self.stats:
+            return None, "Aucune statistique disponible"
+        return f"Rapport complet - Du {min(self.stats)} au {today.isoformat()}", self.rollups['all']
+
+    def _format_heatmap(self):
+        """Heatmap des requêtes par jour de la semaine et par heure"""
+        days = ['Lun', 'Mar', 'Mer', 'Jeu', 'Ven', 'Sam', 'Dim']
+        levels = ' ░▒▓█'
+        peak = max(max(row) for row in self.heatmap)
+        if not peak:
+            return "Aucune donnée horaire disponible"
+        
+        report = "# Heatmap des requêtes (jour × heure)\n\n"
+        report += "     " + ''.join(f"{hour:<3}" for hour in range(0, 24, 3)).rstrip() + "\n"
+        for weekday, row in enumerate(self.heatmap):
+            cells = ''.join(levels[min(len(levels) - 1, (count * (len(levels) - 1) + peak - 1) // peak)] for count in row)
+            report += f"{days[weekday]}  {cells}  {sum(row):,}\n"
+        
+        busiest_day, busiest_hour = max(
+            ((d, h) for d in range(7) for h in range(24)),
+            key=lambda cell: self.heatmap[cell[0]][cell[1]]
+        )
+        report += f"\nPic : {days[busiest_day]} {busiest_hour}h ({peak:,} requêtes)"
+        return report
+
     def generate_report(self, period='day'):
-        """Génère un rapport pour la période spécifiée (day, week, all)"""
+        """Génère un rapport pour la période spécifiée (day, week, month, all, heatmap ou AAAA-MM-JJ..AAAA-MM-JJ)"""
         today = date.today().isoformat()
         
-        if period == 'day':
-            stats = self._aggregate_stats(today, today)
-            title = f"Rapport quotidien - {today}"
-        elif period == 'week':
-            week_start = (date.today() - timedelta(days=6)).isoformat()
-            stats = self._aggregate_stats(week_start, today)
-            title = f"Rapport hebdomadaire - Du {week_start} au {today}"
-        else:  # 'all'
-            if not self.stats:
-                return "Aucune statistique disponible"
-            start_date = min(self.stats.keys())
-            stats = self._aggregate_stats(start_date, today)
-            title = f"Rapport complet - Du {start_date} au {today}"
+        # Rapport en cache tant qu'aucune nouvelle utilisation n'a été enregistrée
+        cached = self.report_cache.get((period, today))
+        if cached and cached[0] == self.version:
+            return cached[1]
+        
+        if period == 'heatmap':
+            report = self._format_heatmap()
+        else:
+            title, stats = self._resolve_period(period)
+            if title is None:
+                return stats
+            report = self._render_report(title, stats)
+        
+        self.report_cache[(period, today)] = (self.version, report)
+            
+        # Sauvegarde du rapport
+        safe_period = period.replace('..', '_')
+        filename = f"{self.reports_dir}/report_{safe_period}_{today}.md"
+        persistence.write(filename, report)
+        self.logger.info(f"Rapport généré : {filename}")
+            
+        return report
 
+    def _render_report(self, title, stats):
+        """Met en forme un rapport à partir d'un agrégat"""
         report = f"""# {title}
 
 ## Résumé
@@ -164,20 +473,40 @@ class CostTracker:
             report += f"- Nombre de requêtes : {count:,}\n"
             report += f"- Tokens en entrée : {token_usage['input']:,}\n"
             report += f"- Tokens en sortie : {token_usage['output']:,}\n"
-            
-        # Sauvegarde du rapport
-        try:
-            filename = f"{self.reports_dir}/report_{period}_{today}.md"
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write(report)
-            self.logger.info(f"Rapport généré : {filename}")
-        except Exception as e:
-            self.logger.error(f"Erreur lors de la génération du rapport : {str(e)}")
-            
+        
+        if stats['hedges']['count']:
+            hedges = stats['hedges']
+            report += "\n## Requêtes de secours (hedging)\n"
+            report += f"- Relances : {hedges['count']:,} (secours plus rapide : {hedges['backup_wins']:,})\n"
+            report += f"- Surcoût : ${hedges['extra_cost']:.4f} ({hedges['extra_tokens']:,} tokens)\n"
+        
+        if stats['images']['count']:
+            images = stats['images']
+            saved = images['original_tokens'] - images['tokens']
+            report += "\n## Images\n"
+            report += f"- Images envoyées : {images['count']:,}\n"
+            report += f"- Tokens estimés : {images['original_tokens']:,} → {images['tokens']:,} ({saved:,} économisés par la réduction)\n"
+            report += f"- Volume envoyé : {images['bytes_in'] / 1024:,.0f} → {images['bytes_out'] / 1024:,.0f} Ko\n"
+        
+        if any(category != 'chat' for category in stats['categories']):
+            report += "\n## Par catégorie\n"
+            for category, usage in sorted(stats['categories'].items()):
+                report += f"- {category} : {usage['requests']:,} requêtes, {usage['tokens']:,} tokens, ${usage['cost']:.4f}\n"
+        
         return report
 
-    def export_stats_to_csv(self, start_date=None, end_date=None):
-        """Exporte les statistiques dans un fichier CSV"""
+    @staticmethod
+    def _write_csv(filename, data):
+        import pandas as pd  # import lourd, différé jusqu'au premier export
+
+        df = pd.DataFrame(data)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmp_path = f"{filename}.tmp"
+        df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, filename)
+
+    async def export_stats_to_csv(self, start_date=None, end_date=None):
+        """Exporte les statistiques dans un fichier CSV (écrit par le pool de persistance)"""
         try:
             # Préparation des données
             data = []
@@ -203,9 +532,8 @@ class CostTracker:
             
             # Création du DataFrame et export
             if data:
-                df = pd.DataFrame(data)
                 filename = f"{self.reports_dir}/stats_export_{date.today().isoformat()}.csv"
-                df.to_csv(filename, index=False)
+                await persistence.run(self._write_csv, filename, data)
                 self.logger.info(f"Stats exportées vers : {filename}")
                 return filename
             else:
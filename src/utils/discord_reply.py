@@ -0,0 +1,133 @@
+import asyncio
+from .metrics import metrics
+from .tracing import tracer
+from .traffic_recorder import recorder
+
+class DiscordReply:
+    """Réponse du bot à une requête, en un minimum d'appels REST à Discord.
+
+    Pendant la génération, le bot affiche soit un message d'attente, soit l'indicateur « en train d'écrire »
+    (REPLY_INDICATOR=typing). Ensuite, le message d'attente est modifié pour contenir les métadonnées (durée,
+    prompt, coût) en petit texte, puis le début de la réponse. Seuls les morceaux suivants donnent lieu à de
+    nouveaux messages. Les appels REST de la réponse sont comptés (métrique `reply.rest_calls`).
+    """
+
+    LIMIT = 2000  # caractères par message Discord
+    TYPING_INTERVAL = 8  # secondes ; l'indicateur de saisie expire après 10 s
+
+    def __init__(self, channel, indicator: str = 'message'):
+        self.channel = channel
+        self.indicator = indicator
+        self.message = None  # message d'attente, modifié par la réponse
+        self.last_message = None  # dernier message de la réponse (celui auquel l'utilisateur répondra)
+        self.rest_calls = 0
+        self._typing_task = None
+
+    async def _send(self, content, purpose):
+        with tracer.span('discord.send', purpose=purpose):
+            self.rest_calls += 1
+            return await self.channel.send(content)
+
+    async def _edit(self, content, purpose):
+        with tracer.span('discord.edit', purpose=purpose):
+            self.rest_calls += 1
+            await self.message.edit(content=content)
+
+    async def _typing(self):
+        try:
+            while True:
+                self.rest_calls += 1
+                await self.channel.typing()
+                await asyncio.sleep(self.TYPING_INTERVAL)
+        except Exception:
+            pass  # indicateur facultatif : une erreur ne doit pas interrompre la requête
+
+    async def start(self, text: str, force_message: bool = False):
+        """Affiche l'attente : message `text` ou indicateur de saisie (sauf si `force_message`, ex. en file d'attente)"""
+        if self.indicator == 'typing' and not force_message:
+            self._typing_task = asyncio.get_running_loop().create_task(self._typing())
+        else:
+            self.message = await self._send(text, 'wait_message')
+
+    async def status(self, text: str, create: bool = False):
+        """Met à jour le message d'attente ; sans message d'attente, n'en crée un que si `create`"""
+        if self.message is not None:
+            await self._edit(text, 'status')
+        elif create:
+            self.message = await self._send(text, 'status')
+
+    @staticmethod
+    def header(*parts) -> str:
+        """Ligne de métadonnées en petit texte (les parties vides sont ignorées)"""
+        parts = [part for part in parts if part]
+        return f"-# {' · '.join(parts)}" if parts else ''
+
+    async def finish(self, answer: str, header: str = '', extra_lines=()):
+        """Envoie la réponse : en-tête et premier morceau dans le message d'attente, puis les morceaux suivants"""
+        self._stop_typing()
+        lines = [header] + [f"-# {line}" for line in extra_lines if line]
+        head = '\n'.join(line for line in lines if line)
+        room = self.LIMIT - len(head) - 1 if head else self.LIMIT
+        first, rest = answer[:room], answer[room:]
+        content = f"{head}\n{first}" if head else first
+
+        if self.message is not None:
+            await self._edit(content, 'reply')
+        else:
+            self.message = await self._send(content, 'reply')
+        self.last_message = self.message
+        for i in range(0, len(rest), self.LIMIT):
+            self.last_message = await self._send(rest[i:i + self.LIMIT], 'reply')
+        self.close()
+
+    async def fail(self, text: str):
+        """Affiche une erreur à la place du message d'attente (ou dans un nouveau message)"""
+        self._stop_typing()
+        if self.message is not None:
+            await self._edit(text, 'error')
+        else:
+            await self._send(text, 'error')
+        self.close()
+
+    def _stop_typing(self):
+        if self._typing_task is not None:
+            self._typing_task.cancel()
+            self._typing_task = None
+
+    def close(self):
+        """Arrête l'indicateur de saisie et enregistre le nombre d'appels REST de la réponse"""
+        self._stop_typing()
+        if self.rest_calls:
+            metrics.observe('reply.rest_calls', self.rest_calls)
+            metrics.incr('discord.rest_calls', self.rest_calls)
+            recorder.add('rest_calls', self.rest_calls)
+            self.rest_calls = 0
+
+
+class InteractionReply(DiscordReply):
+    """Réponse à une commande slash : la réponse différée (« réfléchit… ») tient lieu de message d'attente,
+    puis est modifiée pour contenir le début de la réponse ; les morceaux suivants sont des messages de suivi"""
+
+    def __init__(self, interaction):
+        super().__init__(interaction.channel)
+        self.interaction = interaction
+
+    async def _send(self, content, purpose):
+        with tracer.span('discord.send', purpose=purpose):
+            self.rest_calls += 1
+            return await self.interaction.followup.send(content, wait=True)
+
+    async def _edit(self, content, purpose):
+        with tracer.span('discord.edit', purpose=purpose):
+            self.rest_calls += 1
+            await self.interaction.edit_original_response(content=content)
+
+    async def start(self, text: str, force_message: bool = False):
+        """Diffère la réponse (à faire dans les 3 s) ; la file d'attente s'affiche dans la réponse différée"""
+        if not self.interaction.response.is_done():
+            with tracer.span('discord.defer'):
+                self.rest_calls += 1
+                await self.interaction.response.defer(thinking=True)
+        self.message = self.interaction
+        if force_message:
+            await self._edit(text, 'wait_message')
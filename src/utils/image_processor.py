@@ -0,0 +1,237 @@
+import io
+import os
+import math
+import time
+import base64
+import struct
+import asyncio
+import hashlib
+import logging
+import importlib.util
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from .metrics import metrics
+
+SUPPORTED_TYPES = {
+    'image/jpeg': ('.jpg', '.jpeg'),
+    'image/png': ('.png',),
+    'image/gif': ('.gif',),
+    'image/webp': ('.webp',)
+}
+
+# Redimensionnement appliqué par l'API avant facturation
+API_MAX_EDGE = 1568
+API_MAX_PIXELS = 1_150_000
+API_MAX_BYTES = 5 * 1024 * 1024 * 3 // 4  # 5 Mo une fois encodée en base64
+
+def estimate_tokens(width, height):
+    """Tokens facturés pour une image (≈ largeur × hauteur / 750, après le redimensionnement de l'API)"""
+    if not width or not height:
+        return 0
+    scale = min(1.0, API_MAX_EDGE / max(width, height), math.sqrt(API_MAX_PIXELS / (width * height)))
+    return math.ceil((width * scale) * (height * scale) / 750)
+
+def image_size(data):
+    """Dimensions lues dans l'en-tête PNG, GIF ou JPEG (None si inconnues)"""
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        return struct.unpack('>II', data[16:24])
+    if data[:6] in (b'GIF87a', b'GIF89a') and len(data) >= 10:
+        return struct.unpack('<HH', data[6:10])
+    if data[:2] == b'\xff\xd8':
+        offset = 2
+        while offset + 9 < len(data):
+            if data[offset] != 0xFF:
+                offset += 1
+                continue
+            marker = data[offset + 1]
+            length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+            if marker in (0xC0, 0xC1, 0xC2):
+                height, width = struct.unpack('>HH', data[offset + 5:offset + 9])
+                return width, height
+            offset += 2 + length
+    return None
+
+def downscale(data, max_edge, quality):
+    """Réduit une image à `max_edge` pixels sur son plus grand côté et la recompresse au format le plus léger.
+
+    Exécuté dans un processus séparé : retourne (octets, type MIME, (largeur, hauteur), (largeur, hauteur) d'origine).
+    """
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(data))
+    original_size = image.size
+    media_type = Image.MIME.get(image.format)
+    if getattr(image, 'is_animated', False):
+        image.seek(0)  # Seule la première image d'un GIF animé est envoyée
+
+    scale = min(1.0, max_edge / max(image.size))
+    if scale < 1.0:
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.LANCZOS)
+    elif media_type in SUPPORTED_TYPES and len(data) <= API_MAX_BYTES and not getattr(image, 'is_animated', False):
+        # Déjà assez petite : l'original est conservé
+        return data, media_type, original_size, original_size
+
+    if image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P', '1'):
+        # CMYK, YCbCr (photos imprimées ou scannées)... : modes que le PNG ne sait pas enregistrer
+        image = image.convert('RGBA' if image.mode in ('PA', 'RGBa', 'La') else 'RGB')
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    while True:
+        candidates = []
+        png = io.BytesIO()
+        image.save(png, format='PNG', optimize=True)
+        candidates.append((png.getvalue(), 'image/png'))
+        if not has_alpha:
+            # Les captures d'écran restent souvent plus légères en PNG, les photos en JPEG
+            jpeg = io.BytesIO()
+            image.convert('RGB').save(jpeg, format='JPEG', quality=quality, optimize=True)
+            candidates.append((jpeg.getvalue(), 'image/jpeg'))
+        output, output_type = min(candidates, key=lambda candidate: len(candidate[0]))
+        if len(output) <= API_MAX_BYTES or max(image.size) <= 256:
+            return output, output_type, image.size, original_size
+        image = image.resize((max(1, round(image.width * 0.8)), max(1, round(image.height * 0.8))), Image.LANCZOS)
+
+
+class ImageProcessor:
+    """Prépare les images jointes pour l'API : téléchargement asynchrone, réduction dans un pool de processus,
+    cache par empreinte du contenu (une image déjà vue dans une chaîne n'est ni retéléchargée ni retraitée)"""
+
+    def __init__(self):
+        self.logger = logging.getLogger('discord_claude_bot')
+        self.max_edge = int(os.getenv('IMAGE_MAX_EDGE', '1024'))
+        self.quality = int(os.getenv('IMAGE_JPEG_QUALITY', '85'))
+        self.max_download_bytes = int(os.getenv('IMAGE_MAX_DOWNLOAD_BYTES', str(20 * 1024 * 1024)))
+        self.max_per_message = int(os.getenv('IMAGE_MAX_PER_MESSAGE', '5'))
+        self.cache_size = int(os.getenv('IMAGE_CACHE_SIZE', '64'))
+        self.workers = int(os.getenv('IMAGE_WORKERS', '2'))
+        self.executor = None
+
+        # Pillow est optionnel : sans lui, les images sont envoyées telles quelles (importé dans les processus de réduction)
+        self.pillow = importlib.util.find_spec('PIL') is not None
+
+        # Empreinte du contenu -> image préparée ; identifiant de pièce jointe -> empreinte
+        self.cache = OrderedDict()
+        self.attachment_hashes = OrderedDict()
+
+        if not self.pillow:
+            self.logger.warning("Pillow absent : les images seront envoyées sans réduction")
+
+    def _executor(self):
+        if self.executor is None:
+            # 'spawn' : le bot a déjà des threads (persistance), un fork serait risqué
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self.executor
+
+    @staticmethod
+    def media_type(attachment):
+        """Type MIME d'une pièce jointe si c'est une image prise en charge, sinon None"""
+        content_type = (attachment.content_type or '').split(';')[0].strip()
+        if content_type in SUPPORTED_TYPES:
+            return content_type
+        filename = attachment.filename.lower()
+        for media_type, extensions in SUPPORTED_TYPES.items():
+            if filename.endswith(extensions):
+                return media_type
+        return None
+
+    def image_attachments(self, message):
+        """Pièces jointes image d'un message Discord"""
+        return [attachment for attachment in message.attachments if self.media_type(attachment)][:self.max_per_message]
+
+    def _remember(self, mapping, key, value):
+        mapping[key] = value
+        mapping.move_to_end(key)
+        while len(mapping) > self.cache_size:
+            mapping.popitem(last=False)
+
+    async def process_attachments(self, attachments):
+        """Télécharge et prépare des pièces jointes en parallèle ; retourne la liste des images préparées"""
+        results = await asyncio.gather(*(self._process_attachment(attachment) for attachment in attachments))
+        return [result for result in results if result]
+
+    async def _process_attachment(self, attachment):
+        try:
+            digest = self.attachment_hashes.get(attachment.id)
+            if digest in self.cache:
+                self.cache.move_to_end(digest)
+                metrics.incr('images.cache_hits')
+                return dict(self.cache[digest], cached=True)
+
+            if attachment.size > self.max_download_bytes:
+                self.logger.warning(f"Image ignorée (trop lourde) : {attachment.filename} ({attachment.size:,} octets)")
+                return None
+            data = await attachment.read()
+            digest = hashlib.sha256(data).hexdigest()
+            self._remember(self.attachment_hashes, attachment.id, digest)
+            return await self.prepare(data, self.media_type(attachment), digest)
+        except Exception as e:
+            self.logger.error(f"Erreur lors du traitement de l'image {attachment.filename} : {str(e)}")
+            return None
+
+    async def prepare(self, data, media_type, digest=None):
+        """Réduit une image (ou la reprend du cache) et construit son bloc de contenu pour l'API"""
+        digest = digest or hashlib.sha256(data).hexdigest()
+        if digest in self.cache:
+            self.cache.move_to_end(digest)
+            metrics.incr('images.cache_hits')
+            return dict(self.cache[digest], cached=True)
+
+        start = time.perf_counter()
+        original_size = image_size(data)
+        if self.pillow:
+            try:
+                output, media_type, size, original_size = await asyncio.get_running_loop().run_in_executor(
+                    self._executor(), downscale, data, self.max_edge, self.quality
+                )
+            except BrokenProcessPool:
+                # Un processus a été tué : le pool sera recréé à la prochaine image
+                self.executor = None
+                raise
+        else:
+            if len(data) > API_MAX_BYTES:
+                self.logger.warning("Image ignorée : trop lourde pour l'API et Pillow n'est pas installé")
+                return None
+            output, size = data, original_size
+        metrics.observe('images.process_seconds', time.perf_counter() - start)
+
+        original_tokens = estimate_tokens(*original_size) if original_size else 0
+        tokens = estimate_tokens(*size) if size else original_tokens
+        prepared = {
+            'block': {
+                'type': 'image',
+                'source': {'type': 'base64', 'media_type': media_type, 'data': base64.b64encode(output).decode('ascii')}
+            },
+            'original_tokens': original_tokens,
+            'tokens': tokens,
+            'bytes_in': len(data),
+            'bytes_out': len(output),
+            'cached': False
+        }
+        self._remember(self.cache, digest, prepared)
+        metrics.incr('images.processed')
+        metrics.incr('images.tokens_saved', original_tokens - tokens)
+        metrics.incr('images.bytes_saved', len(data) - len(output))
+        self.logger.info(
+            f"Image préparée : {original_size} → {size}, {len(data):,} → {len(output):,} octets, "
+            f"~{original_tokens} → ~{tokens} tokens"
+        )
+        return prepared
+
+    @staticmethod
+    def summarize(images):
+        """Ligne de résumé des économies réalisées pour une requête"""
+        original = sum(image['original_tokens'] for image in images)
+        sent = sum(image['tokens'] for image in images)
+        cached = sum(1 for image in images if image['cached'])
+        line = f"🖼️ {len(images)} image(s) : ~{original:,} → ~{sent:,} tokens"
+        if original:
+            line += f" (-{(original - sent) / original:.0%})"
+        if cached:
+            line += f", {cached} en cache"
+        return line
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
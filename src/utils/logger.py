@@ -1,11 +1,9 @@
 import logging
 import os
 from logging.handlers import RotatingFileHandler
-from dotenv import load_dotenv
 
 def setup_logger():
-    load_dotenv()
-    
+    # Les variables d'environnement sont chargées une seule fois, par run.py
     # Création du dossier de logs s'il n'existe pas
     log_file_path = os.getenv('LOG_FILE_PATH', 'data/logs/bot.log')
     os.makedirs(os.path.dirname(log_file_path), exist_ok=True)
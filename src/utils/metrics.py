@@ -0,0 +1,68 @@
+import time
+from collections import defaultdict, deque
+
+class Metrics:
+    """Registre en mémoire des métriques de performance du bot (compteurs, jauges, distributions)"""
+
+    def __init__(self, window: int = 500):
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.histograms = defaultdict(lambda: deque(maxlen=window))
+        self.started_at = time.time()
+
+    def incr(self, name: str, value: int = 1):
+        """Incrémente un compteur"""
+        self.counters[name] += value
+
+    def set_gauge(self, name: str, value):
+        """Fixe la valeur courante d'une jauge"""
+        self.gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        """Ajoute une mesure à une distribution (fenêtre glissante)"""
+        self.histograms[name].append(value)
+
+    def percentiles(self, name: str, pcts=(50, 90, 99)) -> dict:
+        """Calcule les percentiles d'une distribution"""
+        ordered = sorted(self.histograms.get(name, ()))
+        if not ordered:
+            return {}
+        return {pct: ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] for pct in pcts}
+
+    def snapshot(self) -> dict:
+        """Retourne l'état complet des métriques"""
+        return {
+            'uptime': time.time() - self.started_at,
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+            'histograms': {
+                name: {'count': len(values), **{f"p{pct}": value for pct, value in self.percentiles(name).items()}}
+                for name, values in self.histograms.items()
+            }
+        }
+
+    def format_report(self) -> str:
+        """Génère un rapport lisible des métriques"""
+        snapshot = self.snapshot()
+        report = f"## Métriques (depuis {snapshot['uptime'] / 60:.0f} min)"
+
+        if snapshot['histograms']:
+            report += "\n\n### Distributions"
+            for name, stats in sorted(snapshot['histograms'].items()):
+                values = ' / '.join(f"{stats[key]:.2f}" for key in ('p50', 'p90', 'p99') if key in stats)
+                report += f"\n- {name} : p50/p90/p99 {values} ({stats['count']} mesures)"
+
+        if snapshot['counters']:
+            report += "\n\n### Compteurs"
+            for name, value in sorted(snapshot['counters'].items()):
+                report += f"\n- {name} : {value:,}"
+
+        if snapshot['gauges']:
+            report += "\n\n### Jauges"
+            for name, value in sorted(snapshot['gauges'].items()):
+                report += f"\n- {name} : {value}"
+
+        return report
+
+# Registre partagé par tous les modules
+metrics = Metrics()
@@ -0,0 +1,220 @@
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from .metrics import metrics
+
+class Persistence:
+    """Écritures disque hors de la boucle d'événements : pool de threads borné, écritures atomiques et regroupées.
+
+    `write(path, content)` remplace le fichier (fichier temporaire puis renommage) ; les écritures répétées
+    sur un même fichier pendant PERSIST_COALESCE_DELAY n'en produisent qu'une, avec le dernier contenu.
+    `content` peut être une fonction, appelée sur la boucle au moment de l'écriture pour sérialiser l'état
+    le plus récent. `submit(key, fn, *args)` exécute une opération quelconque, dans l'ordre par clé
+    (ajouts à un journal, archive d'un canal). Sans boucle en cours (démarrage, scripts), tout est synchrone.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger('discord_claude_bot')
+        self.max_workers = int(os.getenv('PERSIST_WORKERS', '2'))
+        self.coalesce_delay = float(os.getenv('PERSIST_COALESCE_DELAY', '0.5'))
+        self.executor = None
+
+        self.pending = {}      # chemin -> dernier contenu en attente
+        self.callbacks = {}    # chemin -> fonctions appelées après l'écriture
+        self.writers = {}      # chemin -> tâche d'écriture
+        self.chains = {}       # clé -> dernière opération soumise
+        self.queued = {}       # tâche -> (fonction, arguments) des opérations pas encore commencées
+        self.tasks = set()
+        self.in_flight = 0
+        self.flush_event = None
+        self.flush_loop = None
+
+    def _executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='persist')
+        return self.executor
+
+    @staticmethod
+    def _loop():
+        try:
+            return asyncio.get_running_loop()
+        except RuntimeError:
+            return None
+
+    def _flush_event(self):
+        """Événement de vidage immédiat, propre à la boucle courante"""
+        loop = asyncio.get_running_loop()
+        if self.flush_loop is not loop:
+            self.flush_event = asyncio.Event()
+            self.flush_loop = loop
+        return self.flush_event
+
+    def _update_gauges(self):
+        metrics.set_gauge('io.queued', len(self.pending) + sum(1 for task in self.chains.values() if not task.done()))
+        metrics.set_gauge('io.in_flight', self.in_flight)
+
+    @staticmethod
+    def atomic_write(path, content):
+        """Écrit un fichier complet via un fichier temporaire renommé (jamais de fichier tronqué)"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        mode = 'wb' if isinstance(content, bytes) else 'w'
+        with open(tmp_path, mode, **({} if mode == 'wb' else {'encoding': 'utf-8'})) as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def append_text(path, text):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(text)
+
+    async def _run(self, fn, *args):
+        """Exécute une opération bloquante dans le pool en la mesurant"""
+        self.in_flight += 1
+        self._update_gauges()
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor(), fn, *args)
+        finally:
+            self.in_flight -= 1
+            metrics.observe('io.write_seconds', time.perf_counter() - start)
+            metrics.incr('io.writes')
+            self._update_gauges()
+
+    def busy(self, path) -> bool:
+        """Indique si une écriture de ce fichier est en attente ou en cours"""
+        return path in self.writers
+
+    def write(self, path, content, callback=None):
+        """Remplace le contenu d'un fichier (regroupé avec les écritures suivantes du même fichier)"""
+        loop = self._loop()
+        if loop is None:
+            try:
+                self.atomic_write(path, content() if callable(content) else content)
+            except Exception as e:
+                self.logger.error(f"Erreur lors de l'écriture de {path} : {str(e)}")
+                return
+            if callback:
+                callback()
+            return
+
+        if path in self.pending:
+            metrics.incr('io.coalesced')
+        self.pending[path] = content
+        if callback:
+            self.callbacks.setdefault(path, []).append(callback)
+        if path not in self.writers:
+            self.writers[path] = self._track(loop.create_task(self._writer(path)))
+        self._update_gauges()
+
+    async def _writer(self, path):
+        try:
+            try:
+                await asyncio.wait_for(self._flush_event().wait(), self.coalesce_delay)
+            except asyncio.TimeoutError:
+                pass
+            while path in self.pending:
+                content = self.pending.pop(path)
+                callbacks = self.callbacks.pop(path, [])
+                try:
+                    await self._run(self.atomic_write, path, content() if callable(content) else content)
+                except Exception as e:
+                    self.logger.error(f"Erreur lors de l'écriture de {path} : {str(e)}")
+                    continue
+                for callback in callbacks:
+                    callback()
+        finally:
+            del self.writers[path]
+            self._update_gauges()
+
+    def submit(self, key, fn, *args):
+        """Exécute une opération bloquante dans le pool, après les opérations précédentes de même clé"""
+        loop = self._loop()
+        if loop is None:
+            try:
+                fn(*args)
+            except Exception as e:
+                self.logger.error(f"Erreur lors d'une opération disque ({getattr(fn, '__name__', fn)}) : {str(e)}")
+            return
+
+        previous = self.chains.get(key)
+        task = self._track(loop.create_task(self._chained(previous, fn, args)))
+        self.queued[task] = (fn, args)
+        self.chains[key] = task
+        task.add_done_callback(lambda done: self._chain_done(key, done))
+        self._update_gauges()
+
+    def _chain_done(self, key, task):
+        if self.chains.get(key) is task:
+            del self.chains[key]
+        self._update_gauges()
+
+    async def _chained(self, previous, fn, args):
+        if previous is not None and not previous.done():
+            await asyncio.gather(previous, return_exceptions=True)
+        self.queued.pop(asyncio.current_task(), None)
+        try:
+            await self._run(fn, *args)
+        except Exception as e:
+            self.logger.error(f"Erreur lors d'une opération disque ({getattr(fn, '__name__', fn)}) : {str(e)}")
+
+    def append(self, path, text):
+        """Ajoute du texte à la fin d'un fichier (journal), dans l'ordre des appels"""
+        self.submit(path, self.append_text, path, text)
+
+    async def run(self, fn, *args):
+        """Exécute une opération bloquante dans le pool et retourne son résultat"""
+        return await self._run(fn, *args)
+
+    def _track(self, task):
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def flush(self):
+        """Écrit immédiatement tout ce qui est en attente et attend la fin des opérations en cours"""
+        loop = asyncio.get_running_loop()
+        event = self._flush_event()
+        event.set()
+        try:
+            while True:
+                # Les tâches d'une boucle précédente (déjà arrêtée) sont ignorées
+                tasks = [task for task in self.tasks if task.get_loop() is loop and not task.done()]
+                if not tasks:
+                    break
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            event.clear()
+
+    def close(self):
+        """Termine les écritures en cours, écrit de façon synchrone ce qui reste en attente puis arrête le pool
+        (après la fin de la boucle).
+
+        Les opérations soumises mais jamais commencées (tâches annulées avec leur boucle) sont exécutées
+        dans l'ordre de soumission, qui respecte l'ordre par clé.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        for path, content in list(self.pending.items()):
+            try:
+                self.atomic_write(path, content() if callable(content) else content)
+            except Exception as e:
+                self.logger.error(f"Erreur lors de l'écriture de {path} : {str(e)}")
+        self.pending.clear()
+        queued, self.queued = list(self.queued.values()), {}
+        for fn, args in queued:
+            try:
+                fn(*args)
+            except Exception as e:
+                self.logger.error(f"Erreur lors d'une opération disque ({getattr(fn, '__name__', fn)}) : {str(e)}")
+
+# Couche de persistance partagée par tous les modules
+persistence = Persistence()
@@ -0,0 +1,134 @@
+import os
+import io
+import time
+import asyncio
+import logging
+from datetime import datetime
+from .metrics import metrics
+
+class ProfileSession:
+    """Profilage en cours : cProfile sur la boucle d'événements et tracemalloc, jusqu'à N requêtes ou T secondes"""
+
+    def __init__(self, profiler, requests, seconds, on_done):
+        import cProfile
+        import tracemalloc
+
+        self.profiler = profiler
+        self.requests = requests
+        self.seconds = seconds
+        self.on_done = on_done
+        self.completed = 0
+        self.started_at = datetime.now()
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.stop_reason = None
+
+        # tracemalloc déjà actif (PYTHONTRACEMALLOC) : on ne l'arrête pas à la fin
+        self.owns_tracemalloc = not tracemalloc.is_tracing()
+        if self.owns_tracemalloc:
+            tracemalloc.start(profiler.frames)
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        self.timer = asyncio.get_running_loop().call_later(seconds, profiler.stop, 'durée écoulée')
+
+    def request_done(self):
+        """Appelé à la fin de chaque requête commencée pendant la session"""
+        self.completed += 1
+        if self.requests and self.completed >= self.requests and self.profiler.session is self:
+            self.profiler.stop(f"{self.completed} requête(s) traitée(s)")
+
+    def remaining(self) -> float:
+        return max(0.0, self.seconds - (time.perf_counter() - self.start))
+
+
+class Profiler:
+    """Profilage CPU et mémoire à la demande du bot en production (!kprofile).
+
+    Désactivé, il ne coûte rien : aucun hook n'est installé et seule une référence à None est testée par requête.
+    Activé, le surcoût est borné par PROFILE_MAX_SECONDS et par la profondeur de pile gardée par tracemalloc
+    (PROFILE_TRACEMALLOC_FRAMES). Le rapport (fonctions les plus coûteuses et sites d'allocation) est construit
+    dans un thread puis transmis à `on_done`.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger('discord_claude_bot')
+        self.max_seconds = float(os.getenv('PROFILE_MAX_SECONDS', '300'))
+        self.default_requests = int(os.getenv('PROFILE_DEFAULT_REQUESTS', '10'))
+        self.frames = int(os.getenv('PROFILE_TRACEMALLOC_FRAMES', '1'))
+        self.top = int(os.getenv('PROFILE_TOP', '30'))
+        self.session = None
+
+    def start(self, on_done, requests: int = None, seconds: float = None) -> ProfileSession:
+        """Démarre une session (N requêtes et/ou T secondes, toujours bornée par max_seconds)"""
+        if self.session is not None:
+            raise RuntimeError("Un profilage est déjà en cours")
+        if requests is None and seconds is None:
+            requests = self.default_requests
+        seconds = min(seconds or self.max_seconds, self.max_seconds)
+        self.session = ProfileSession(self, requests, seconds, on_done)
+        metrics.incr('profile.sessions')
+        self.logger.info(f"Profilage démarré : {requests or '∞'} requête(s), {seconds:.0f}s au plus")
+        return self.session
+
+    def stop(self, reason: str = 'arrêt manuel'):
+        """Arrête la session en cours ; le rapport est construit hors de la boucle d'événements"""
+        session = self.session
+        if session is None:
+            return None
+        self.session = None
+        session.profile.disable()
+        session.timer.cancel()
+        session.duration = time.perf_counter() - session.start
+        session.stop_reason = reason
+        self.logger.info(f"Profilage arrêté ({reason}) après {session.duration:.1f}s")
+        asyncio.get_running_loop().create_task(self._finish(session))
+        return session
+
+    async def _finish(self, session: ProfileSession):
+        try:
+            report = await asyncio.to_thread(self.build_report, session)
+            await session.on_done(session, report)
+        except Exception as e:
+            self.logger.error(f"Erreur lors de la génération du rapport de profilage : {str(e)}")
+
+    def build_report(self, session: ProfileSession) -> str:
+        """Rapport texte : temps cumulé et temps propre par fonction, puis allocations toujours en mémoire"""
+        import pstats
+        import tracemalloc
+
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if session.owns_tracemalloc:
+            tracemalloc.stop()
+
+        lines = [
+            "=== Profil à la demande ===",
+            f"Début : {session.started_at.isoformat(timespec='seconds')} — durée {session.duration:.1f}s — "
+            f"{session.completed} requête(s) — arrêt : {session.stop_reason}",
+            ""
+        ]
+        for sort, title in (('cumulative', 'temps cumulé'), ('tottime', 'temps propre')):
+            buffer = io.StringIO()
+            pstats.Stats(session.profile, stream=buffer).sort_stats(sort).print_stats(self.top)
+            lines.append(f"=== CPU, boucle d'événements : {self.top} fonctions par {title} ===")
+            lines.append(buffer.getvalue().strip())
+            lines.append("")
+
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+            tracemalloc.Filter(False, '<unknown>')
+        ))
+        statistics = snapshot.statistics('lineno')
+        lines.append(
+            f"=== Mémoire (tracemalloc) : {self.top} sites d'allocation encore en mémoire — "
+            f"actuel {current / 1024 / 1024:.1f} Mo, pic {peak / 1024 / 1024:.1f} Mo ==="
+        )
+        for stat in statistics[:self.top]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size / 1024:>10.1f} Ko {stat.count:>8} blocs  {frame.filename}:{frame.lineno}")
+        return '\n'.join(lines) + '\n'
+
+# Profileur partagé (une seule session à la fois)
+profiler = Profiler()
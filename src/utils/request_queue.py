@@ -0,0 +1,104 @@
+import os
+import time
+import asyncio
+import logging
+from collections import defaultdict
+from .metrics import metrics
+
+class QueuedRequest:
+    """Requête en file d'attente d'un canal : `start()` attend son tour, `finish()` libère la place"""
+
+    def __init__(self, queue, channel_id, user_id):
+        self.queue = queue
+        self.channel_id = channel_id
+        self.user_id = user_id
+        self.task = asyncio.current_task()
+        self.created_at = time.monotonic()
+        self.running = False
+        self.cancel_reason = None  # 'superseded' ou 'stopped'
+
+    def position(self) -> int:
+        """Nombre de requêtes du canal à traiter avant celle-ci"""
+        jobs = self.queue.jobs[self.channel_id]
+        return jobs.index(self) if self in jobs else 0
+
+    def cancel(self, reason: str):
+        if self.cancel_reason is None and self.task and not self.task.done():
+            self.cancel_reason = reason
+            self.task.cancel()
+
+    async def start(self):
+        """Attend que la requête puisse s'exécuter dans son canal"""
+        try:
+            await self.queue.semaphores[self.channel_id].acquire()
+        except asyncio.CancelledError:
+            self.queue.remove(self)
+            raise
+        self.running = True
+        metrics.observe('queue.wait_seconds', time.monotonic() - self.created_at)
+
+    def finish(self):
+        """Libère la place de la requête (terminée, en échec ou annulée)"""
+        if self.running:
+            self.running = False
+            self.queue.semaphores[self.channel_id].release()
+        self.queue.remove(self)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.finish()
+        return False
+
+
+class RequestQueue:
+    """File de travail par canal : une requête à la fois (QUEUE_CONCURRENCY), les autres attendent leur tour.
+
+    Par défaut (QUEUE_POLICY=fifo), toutes les requêtes sont traitées dans l'ordre ; avec `supersede`, une
+    nouvelle commande d'un utilisateur annule sa requête encore en attente ou en cours dans le même canal.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger('discord_claude_bot')
+        self.policy = os.getenv('QUEUE_POLICY', 'fifo').lower()
+        self.concurrency = int(os.getenv('QUEUE_CONCURRENCY', '1'))
+        self.jobs = defaultdict(list)
+        self.semaphores = defaultdict(lambda: asyncio.Semaphore(self.concurrency))
+
+    def submit(self, channel_id, user_id) -> QueuedRequest:
+        """Inscrit la requête courante dans la file du canal (en appliquant la politique de remplacement)"""
+        if self.policy == 'supersede':
+            for job in list(self.jobs[channel_id]):
+                if job.user_id == user_id:
+                    self.logger.info(f"File du canal {channel_id} : requête remplacée par une nouvelle demande")
+                    metrics.incr('queue.superseded')
+                    job.cancel('superseded')
+                    self.remove(job)
+
+        job = QueuedRequest(self, channel_id, user_id)
+        self.jobs[channel_id].append(job)
+        self._update_gauge()
+        return job
+
+    def remove(self, job: QueuedRequest):
+        if job in self.jobs[job.channel_id]:
+            self.jobs[job.channel_id].remove(job)
+        self._update_gauge()
+
+    def depth(self, channel_id) -> int:
+        """Nombre de requêtes en cours ou en attente dans un canal"""
+        return len(self.jobs[channel_id])
+
+    def stop(self, channel_id) -> int:
+        """Annule toutes les requêtes d'un canal (en cours et en attente) ; retourne leur nombre"""
+        jobs = list(self.jobs[channel_id])
+        for job in jobs:
+            job.cancel('stopped')
+            self.remove(job)
+        metrics.incr('queue.stopped', len(jobs))
+        return len(jobs)
+
+    def _update_gauge(self):
+        metrics.set_gauge('queue.depth', sum(len(jobs) for jobs in self.jobs.values()))
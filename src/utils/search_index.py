@@ -0,0 +1,217 @@
+import os
+import re
+import json
+import glob
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+
+# Mots trop fréquents pour distinguer un message (ignorés par la recherche de contexte)
+STOPWORDS = frozenset("""
+    les des une est pas que qui pour dans par sur avec son ses aux mais comme tout tous plus moins bien
+    elle ils elles nous vous leur leurs cette ces cet mon mes ton tes notre votre sont ont été être avoir
+    fait faire peux peut veux dit quoi quel quelle quels quelles comment pourquoi aussi très encore alors
+    donc car ceci cela ça oui non merci bonjour salut
+    the and for are but not you your with this that what how why can was were have has had its from
+    they them then than there their will would could should about into just also
+""".split())
+
+class ConversationSearchIndex:
+    """Index plein texte (SQLite FTS5) des conversations archivées.
+
+    La connexion est partagée entre le pool de persistance (écritures), les threads de recherche et la
+    boucle : chaque utilisation passe par un verrou, sqlite3 ne sérialisant pas les accès concurrents.
+    """
+
+    def __init__(self, archive_dir='data/conversations'):
+        self.logger = logging.getLogger('discord_claude_bot')
+        self.archive_dir = archive_dir
+        self.db_file = f"{archive_dir}/search_index.db"
+        os.makedirs(archive_dir, exist_ok=True)
+
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(self.db_file, check_same_thread=False)
+        self.db.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5(
+                content,
+                role UNINDEXED,
+                channel_id UNINDEXED,
+                timestamp UNINDEXED,
+                tokenize = 'unicode61 remove_diacritics 2'
+            );
+            CREATE TABLE IF NOT EXISTS seen_messages (hash TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS indexed_files (path TEXT PRIMARY KEY, mtime REAL);
+        """)
+
+    @staticmethod
+    def _message_hash(channel_id, message):
+        """Empreinte d'un message : les archives successives d'un canal se recouvrent"""
+        key = f"{channel_id}|{message.get('role')}|{message.get('timestamp', '')}|{message.get('content')}"
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _insert(self, channel_id, messages, default_timestamp):
+        rows = []
+        for message in messages:
+            content = message.get('content')
+            if not isinstance(content, str) or not content.strip():
+                continue
+            message_hash = self._message_hash(channel_id, message)
+            if self.db.execute("INSERT OR IGNORE INTO seen_messages VALUES (?)", (message_hash,)).rowcount:
+                rows.append((content, message.get('role'), str(channel_id), message.get('timestamp', default_timestamp)))
+        self.db.executemany("INSERT INTO messages (content, role, channel_id, timestamp) VALUES (?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def index_messages(self, channel_id, messages, timestamp):
+        """Ajoute à l'index les messages nouveaux d'une conversation archivée"""
+        try:
+            with self.lock, self.db:
+                added = self._insert(channel_id, messages, timestamp)
+            self.logger.info(f"Index de recherche : {added} messages ajoutés pour le canal {channel_id}")
+        except Exception as e:
+            self.logger.error(f"Erreur lors de l'indexation de la conversation : {str(e)}")
+
+    def rebuild(self, archive=None, full=False):
+        """(Re)construit l'index à partir des archives ; seuls les fichiers nouveaux ou modifiés sont relus"""
+        added = 0
+        with self.lock, self.db:
+            if full:
+                self.db.executescript("DELETE FROM messages; DELETE FROM seen_messages; DELETE FROM indexed_files;")
+            known = dict(self.db.execute("SELECT path, mtime FROM indexed_files"))
+            
+            # Anciennes archives JSON (avant migration) puis segments de l'archive append-only
+            sources = [(None, path) for path in glob.glob(f"{self.archive_dir}/*.json")]
+            if archive:
+                sources += archive.files()
+            for channel_id, path in sources:
+                mtime = os.path.getmtime(path)
+                if known.get(path) == mtime:
+                    continue
+                try:
+                    if channel_id is None:
+                        with open(path, 'r', encoding='utf-8') as f:
+                            data = json.load(f)
+                        timestamp = self._archive_timestamp(data.get('timestamp', ''))
+                        added += self._insert(data.get('channel_id'), data.get('messages', []), timestamp)
+                    else:
+                        added += self._insert(channel_id, archive.read_file(path), '')
+                    self.db.execute("INSERT OR REPLACE INTO indexed_files VALUES (?, ?)", (path, mtime))
+                except Exception as e:
+                    self.logger.error(f"Erreur lors de l'indexation de {path} : {str(e)}")
+        self.logger.info(f"Index de recherche reconstruit : {added} messages ajoutés")
+        return added
+
+    @staticmethod
+    def _archive_timestamp(value):
+        """Convertit l'horodatage d'une archive (AAAAMMJJ_HHMMSS) au format ISO"""
+        match = re.fullmatch(r"(\d{4})(\d{2})(\d{2})_(\d{2})(\d{2})(\d{2})", value)
+        if not match:
+            return value
+        y, mo, d, h, mi, s = match.groups()
+        return f"{y}-{mo}-{d}T{h}:{mi}:{s}"
+
+    @staticmethod
+    def _fts_query(query):
+        """Transforme une saisie libre en requête FTS5 (tous les mots, échappés)"""
+        terms = re.findall(r"\w+", query, flags=re.UNICODE)
+        return ' '.join(f'"{term}"' for term in terms)
+
+    def search(self, query, channel_id=None, start=None, end=None, limit=5):
+        """Recherche les messages les plus pertinents (BM25) avec un extrait"""
+        fts_query = self._fts_query(query)
+        if not fts_query:
+            return []
+
+        sql = """
+            SELECT channel_id, timestamp, role,
+                   snippet(messages, 0, '**', '**', '…', 16) AS excerpt,
+                   rank AS score
+            FROM messages
+            WHERE messages MATCH ?
+        """
+        params = [fts_query]
+        if channel_id is not None:
+            sql += " AND channel_id = ?"
+            params.append(str(channel_id))
+        if start:
+            sql += " AND timestamp >= ?"
+            params.append(start)
+        if end:
+            sql += " AND timestamp <= ?"
+            params.append(f"{end}T23:59:59")
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(limit)
+
+        with self.lock:
+            rows = self.db.execute(sql, params).fetchall()
+        return [
+            {'channel_id': row[0], 'timestamp': row[1], 'role': row[2], 'excerpt': row[3], 'score': row[4]}
+            for row in rows
+        ]
+
+    @staticmethod
+    def _fold(term):
+        """Mot sans accents, comme dans l'index (remove_diacritics)"""
+        return ''.join(char for char in unicodedata.normalize('NFKD', term) if not unicodedata.combining(char))
+
+    def _relevance_terms(self, text, max_terms, max_docs):
+        """Mots significatifs d'un texte libre présents dans l'index, les plus rares d'abord.
+
+        Les mots de plus de `max_docs` messages sont ignorés : ils départagent mal les messages et leur
+        liste de documents grandit avec l'archive, ce qui rendrait la recherche de plus en plus lente.
+        """
+        candidates = []
+        for term in re.findall(r"\w+", text.lower(), flags=re.UNICODE):
+            if len(term) > 2 and term not in STOPWORDS:
+                term = self._fold(term)
+                if term not in candidates:
+                    candidates.append(term)
+        found = []
+        for term in sorted(candidates, key=len, reverse=True)[:max_terms * 3]:
+            # Comptage borné : le coût ne dépend pas de la fréquence réelle du mot
+            with self.lock:
+                docs = self.db.execute(
+                    "SELECT count(*) FROM (SELECT rowid FROM messages WHERE messages MATCH ? LIMIT ?)", (f'"{term}"', max_docs + 1)
+                ).fetchone()[0]
+            if 0 < docs <= max_docs:
+                found.append((docs, term))
+        return [term for _, term in sorted(found)[:max_terms]]
+
+    def related(self, text, channel_id=None, exclude=None, limit=5, min_score=0.0, max_terms=12, max_docs=2000):
+        """Messages archivés les plus proches d'un texte (BM25), avec un extrait autour des mots trouvés.
+
+        `exclude` (canal, horodatage ISO) écarte les messages de ce canal depuis cet instant, déjà présents
+        dans l'historique envoyé avec la requête.
+        """
+        terms = self._relevance_terms(text, max_terms, max_docs)
+        if not terms:
+            return []
+        fts_query = ' OR '.join(f'"{term}"' for term in terms)
+
+        sql = """
+            SELECT channel_id, timestamp, role,
+                   snippet(messages, 0, '', '', '…', 48) AS excerpt,
+                   -rank AS score
+            FROM messages
+            WHERE messages MATCH ?
+        """
+        params = [fts_query]
+        if channel_id is not None:
+            sql += " AND channel_id = ?"
+            params.append(str(channel_id))
+        if exclude:
+            sql += " AND NOT (channel_id = ? AND timestamp >= ?)"
+            params.extend((str(exclude[0]), exclude[1]))
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(limit)
+
+        with self.lock:
+            rows = self.db.execute(sql, params).fetchall()
+        return [
+            {'channel_id': row[0], 'timestamp': row[1], 'role': row[2], 'excerpt': row[3], 'score': row[4]}
+            for row in rows
+            if row[4] >= min_score
+        ]
@@ -0,0 +1,60 @@
+import sys
+import time
+import subprocess
+from collections import defaultdict
+
+# Modules importés avant la connexion à la passerelle (le cog est chargé par setup_hook)
+STARTUP_MODULES = ('src.bot.client', 'src.cogs.claude_commands')
+
+class StartupProfile:
+    """Jalons du démarrage (secondes depuis le lancement de run.py) et répartition du temps d'import"""
+
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self.marks = {}
+
+    def mark(self, name: str):
+        """Enregistre un jalon (seul le premier passage compte : on_ready est rappelé à chaque reconnexion)"""
+        self.marks.setdefault(name, time.perf_counter() - self.started_at)
+
+    def since_start(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def summary(self) -> str:
+        """Jalons du démarrage sur une ligne"""
+        labels = {
+            'imports': 'imports',
+            'setup_hook': 'cog chargé',
+            'ready': 'on_ready',
+            'warm_up': 'initialisation différée'
+        }
+        return ' | '.join(f"{labels.get(name, name)} {value:.2f}s" for name, value in self.marks.items())
+
+    @staticmethod
+    def import_breakdown(modules=STARTUP_MODULES, limit=12):
+        """Temps d'import par paquet de premier niveau, mesuré dans un processus neuf (python -X importtime)"""
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f"import {', '.join(modules)}"],
+            capture_output=True, text=True
+        )
+        totals = defaultdict(int)
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:'):
+                continue
+            fields = line[len('import time:'):].split('|')
+            try:
+                self_us = int(fields[0])
+            except ValueError:
+                continue  # ligne d'en-tête
+            totals[fields[2].strip().split('.')[0]] += self_us
+
+        total = sum(totals.values())
+        ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)
+        lines = [f"Imports au démarrage : {total / 1e6:.2f}s (processus neuf, {len(totals)} paquets)"]
+        for package, micros in ranked[:limit]:
+            lines.append(f"  {package:<24} {micros / 1e3:>8.1f} ms  {micros / total:>5.1%}")
+        return '\n'.join(lines)
+
+    def report(self) -> str:
+        """Rapport complet de --profile-startup"""
+        return f"=== Profil de démarrage ===\n{self.summary()}\n{self.import_breakdown()}"
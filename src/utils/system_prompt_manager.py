@@ -1,15 +1,17 @@
 import os
 import json
+import time
 from datetime import datetime
 import logging
+from .metrics import metrics
+from .persistence import persistence
 
 class SystemPromptManager:
     def __init__(self):
         self.logger = logging.getLogger('discord_claude_bot')
         
-        # Création du dossier de données si nécessaire
+        # Dossier de données (créé à la première écriture)
         self.data_dir = 'data/system_prompts'
-        os.makedirs(self.data_dir, exist_ok=True)
         
         # Fichier pour stocker les prompts
         self.prompts_file = f"{self.data_dir}/prompts.json"
@@ -17,6 +19,16 @@ class SystemPromptManager:
         # Structure des données
         self.prompts = {}
         self.active_prompt = None
+        self.bindings = {'guilds': {}, 'channels': {}}  # Prompts liés à un serveur ou un salon
+        
+        # Préfixes de requête précompilés par (prompt, version, modèle)
+        self.compiled = {}
+        self.cache_min_tokens = int(os.getenv('PROMPT_CACHE_MIN_TOKENS', '1024'))
+        
+        # Rechargement à chaud si prompts.json est modifié hors du bot
+        self.reload_interval = float(os.getenv('PROMPT_RELOAD_INTERVAL', '2'))
+        self._mtime = None
+        self._last_check = 0.0
         
         # Chargement des données existantes
         self._load_prompts()
@@ -29,21 +41,48 @@ class SystemPromptManager:
                     data = json.load(f)
                     self.prompts = data.get('prompts', {})
                     self.active_prompt = data.get('active_prompt')
+                    bindings = data.get('bindings', {})
+                    self.bindings = {
+                        'guilds': bindings.get('guilds', {}),
+                        'channels': bindings.get('channels', {})
+                    }
+                self._mtime = os.path.getmtime(self.prompts_file)
+                self.compiled.clear()
                 self.logger.info("Prompts système chargés avec succès")
         except Exception as e:
             self.logger.error(f"Erreur lors du chargement des prompts système: {str(e)}")
 
+    def _check_reload(self):
+        """Recharge prompts.json si sa date de modification a changé (vérifié au plus toutes les quelques secondes)"""
+        now = time.monotonic()
+        if now - self._last_check < self.reload_interval or persistence.busy(self.prompts_file):
+            return
+        self._last_check = now
+        try:
+            mtime = os.path.getmtime(self.prompts_file)
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.logger.info("prompts.json modifié hors du bot, rechargement")
+            self._load_prompts()
+
     def _save_prompts(self):
-        """Sauvegarde les prompts dans le fichier"""
+        """Planifie la sauvegarde des prompts (écriture atomique hors de la boucle d'événements)"""
+        persistence.write(
+            self.prompts_file,
+            lambda: json.dumps({
+                'prompts': self.prompts,
+                'active_prompt': self.active_prompt,
+                'bindings': self.bindings
+            }, indent=2, ensure_ascii=False),
+            callback=self._on_saved
+        )
+
+    def _on_saved(self):
         try:
-            with open(self.prompts_file, 'w', encoding='utf-8') as f:
-                json.dump({
-                    'prompts': self.prompts,
-                    'active_prompt': self.active_prompt
-                }, f, indent=2, ensure_ascii=False)
-            self.logger.info("Prompts système sauvegardés avec succès")
-        except Exception as e:
-            self.logger.error(f"Erreur lors de la sauvegarde des prompts système: {str(e)}")
+            self._mtime = os.path.getmtime(self.prompts_file)
+        except OSError:
+            pass
 
     def create_prompt(self, name: str, content: str) -> bool:
         """Crée ou met à jour un prompt système"""
@@ -75,6 +114,9 @@ class SystemPromptManager:
                 del self.prompts[name]
                 if self.active_prompt == name:
                     self.active_prompt = None
+                for scope in self.bindings.values():
+                    for target_id in [target_id for target_id, bound in scope.items() if bound == name]:
+                        del scope[target_id]
                 self._save_prompts()
                 return True
             return False
@@ -98,8 +140,64 @@ class SystemPromptManager:
             return True
         return False
 
-    def get_active_prompt(self) -> tuple:
-        """Récupère le prompt système actif"""
-        if self.active_prompt and self.active_prompt in self.prompts:
-            return self.active_prompt, self.prompts[self.active_prompt]['content']
-        return None, None
\ No newline at end of file
+    def bind_prompt(self, scope: str, target_id: int, name: str) -> bool:
+        """Lie un prompt à un salon ou un serveur ('channels' / 'guilds') ; name=None supprime le lien"""
+        if scope not in self.bindings or (name is not None and name not in self.prompts):
+            return False
+        if name is None:
+            self.bindings[scope].pop(str(target_id), None)
+        else:
+            self.bindings[scope][str(target_id)] = name
+        self._save_prompts()
+        return True
+
+    def resolve_prompt_name(self, channel_id=None, guild_id=None, parent_id=None):
+        """Prompt applicable : salon, puis salon parent (fil), puis serveur, puis prompt global"""
+        self._check_reload()
+        for scope, target_id in (('channels', channel_id), ('channels', parent_id), ('guilds', guild_id)):
+            if target_id is not None:
+                name = self.bindings[scope].get(str(target_id))
+                if name in self.prompts:
+                    return name
+        if self.active_prompt in self.prompts:
+            return self.active_prompt
+        return None
+
+    def get_active_prompt(self, channel_id=None, guild_id=None, parent_id=None) -> tuple:
+        """Récupère le prompt système actif (pour un salon/serveur si précisé)"""
+        name = self.resolve_prompt_name(channel_id, guild_id, parent_id)
+        if name:
+            return name, self.prompts[name]['content']
+        return None, None
+
+    def get_compiled_prefix(self, model: str, channel_id=None, guild_id=None, parent_id=None):
+        """Préfixe de requête précompilé (payload system, tokens estimés) pour le prompt applicable, ou None"""
+        name = self.resolve_prompt_name(channel_id, guild_id, parent_id)
+        if not name:
+            return None
+        
+        prompt = self.prompts[name]
+        key = (name, prompt['updated_at'], model)
+        compiled = self.compiled.get(key)
+        if compiled is None:
+            compiled = self._compile(name, prompt, model)
+            self.compiled[key] = compiled
+            metrics.incr('prompt.prefix_compiled')
+        return compiled
+
+    def _compile(self, name: str, prompt: dict, model: str) -> dict:
+        """Construit le bloc system d'un prompt ; marqué pour le cache de prompt s'il est assez long"""
+        tokens = len(prompt['content']) // 4  # Estimation : ~4 caractères par token
+        block = {"type": "text", "text": prompt['content']}
+        # Les modèles Haiku n'acceptent le cache de prompt qu'à partir de 2048 tokens
+        min_tokens = max(self.cache_min_tokens, 2048) if 'haiku' in model else self.cache_min_tokens
+        if tokens >= min_tokens:
+            block['cache_control'] = {"type": "ephemeral"}
+        return {
+            'name': name,
+            'version': prompt['updated_at'],
+            'model': model,
+            'system': [block],
+            'tokens': tokens,
+            'cached': 'cache_control' in block
+        }
@@ -0,0 +1,228 @@
+import os
+import json
+import time
+import uuid
+import random
+import functools
+import itertools
+from datetime import datetime
+from collections import deque
+from contextvars import ContextVar
+from .metrics import metrics
+from .persistence import persistence
+
+# Trace et span courants : propagés aux coroutines et tâches lancées pendant la requête
+_current_trace = ContextVar('current_trace', default=None)
+_current_span = ContextVar('current_span', default=0)
+
+
+class Span:
+    """Intervalle mesuré d'une trace ; sans trace en cours, ne fait rien (coût négligeable)"""
+
+    __slots__ = ('name', 'attrs', 'trace', 'span_id', 'parent_id', 'start', 'duration', '_token')
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+        self.trace = None
+        self.duration = 0.0
+
+    def set(self, **attrs):
+        """Ajoute des attributs au span (modèle, tokens, nombre de messages...)"""
+        if self.trace is not None:
+            self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.trace = _current_trace.get()
+        if self.trace is not None:
+            self.parent_id = _current_span.get()
+            self.span_id = next(self.trace.ids)
+            self._token = _current_span.set(self.span_id)
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.trace is not None:
+            self.duration = time.perf_counter() - self.start
+            _current_span.reset(self._token)
+            if exc_type is not None:
+                self.attrs['error'] = exc_type.__name__
+            self.trace.spans.append(self)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+class Trace:
+    """Ensemble des spans d'une requête, identifiée par un identifiant court"""
+
+    def __init__(self, name: str, attrs: dict, sampled: bool):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.attrs = attrs
+        self.sampled = sampled
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.spans = []
+        self.ids = itertools.count(1)  # 0 : racine de la trace
+
+
+class _TraceScope:
+    """Contexte d'une trace (async with tracer.start_trace(...)) ; imbriqué dans une trace, se comporte comme un span"""
+
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.span = None
+        self.trace = None
+
+    def set(self, **attrs):
+        if self.span is not None:
+            self.span.set(**attrs)
+        elif self.trace is not None:
+            self.trace.attrs.update(attrs)
+
+    def __enter__(self):
+        if _current_trace.get() is not None:
+            self.span = Span(self.name, self.attrs).__enter__()
+            return self
+        self.trace = Trace(self.name, self.attrs, random.random() < self.tracer.sample_rate)
+        self._tokens = (_current_trace.set(self.trace), _current_span.set(0))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.span is not None:
+            return self.span.__exit__(exc_type, exc, tb)
+        self.trace.duration = time.perf_counter() - self.trace.start
+        _current_trace.reset(self._tokens[0])
+        _current_span.reset(self._tokens[1])
+        if exc_type is not None:
+            self.trace.attrs['error'] = exc_type.__name__
+        self.tracer.finish(self.trace)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+class Tracer:
+    """Traçage léger des requêtes : spans imbriqués, exportés au format Chrome trace (chrome://tracing, Perfetto).
+
+    Chaque requête est gardée en mémoire (TRACE_KEEP dernières) ; seule une fraction (TRACE_SAMPLE_RATE)
+    est écrite dans data/traces, plus toutes celles qui dépassent TRACE_SLOW_SECONDS.
+    """
+
+    def __init__(self):
+        self.sample_rate = float(os.getenv('TRACE_SAMPLE_RATE', '0.1'))
+        self.slow_seconds = float(os.getenv('TRACE_SLOW_SECONDS', '10'))
+        self.trace_dir = os.getenv('TRACE_DIR', 'data/traces')
+        self.recent = deque(maxlen=int(os.getenv('TRACE_KEEP', '50')))
+        self.pid = os.getpid()
+
+    def start_trace(self, name: str, **attrs) -> _TraceScope:
+        """Ouvre la trace d'une requête (ou un span si une trace est déjà en cours)"""
+        return _TraceScope(self, name, attrs)
+
+    def span(self, name: str, **attrs) -> Span:
+        """Mesure une étape de la requête en cours"""
+        return Span(name, attrs)
+
+    @staticmethod
+    def current_id():
+        """Identifiant de la requête en cours (None hors trace)"""
+        trace = _current_trace.get()
+        return trace.id if trace else None
+
+    def finish(self, trace: Trace):
+        self.recent.append(trace)
+        metrics.observe('trace.seconds', trace.duration)
+        if trace.sampled or trace.duration >= self.slow_seconds:
+            metrics.incr('trace.exported')
+            path = f"{self.trace_dir}/trace_{datetime.now().date().isoformat()}.json"
+            text = ''.join(json.dumps(event, ensure_ascii=False) + ',\n' for event in self.chrome_events(trace))
+            persistence.submit(path, self._append_events, path, text)
+
+    @staticmethod
+    def _append_events(path, text):
+        """Ajoute des événements au fichier du jour (format tableau JSON, dont le ']' final est facultatif)"""
+        if not os.path.exists(path):
+            text = '[\n' + text
+        persistence.append_text(path, text)
+
+    def chrome_events(self, trace: Trace) -> list:
+        """Événements « complets » (ph X) de la trace, une piste par requête"""
+        tid = int(trace.id[:6], 16)
+        base = trace.wall_start * 1e6
+
+        def event(name, start, duration, args):
+            return {
+                'name': name, 'cat': 'bot', 'ph': 'X', 'pid': self.pid, 'tid': tid,
+                'ts': round(base + (start - trace.start) * 1e6), 'dur': round(duration * 1e6), 'args': args
+            }
+
+        events = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': f"{trace.name} {trace.id}"}},
+            event(trace.name, trace.start, trace.duration, dict(trace.attrs, request_id=trace.id))
+        ]
+        for span in trace.spans:
+            events.append(event(span.name, span.start, span.duration, dict(span.attrs, span_id=span.span_id, parent_id=span.parent_id)))
+        return events
+
+    def last_slow(self):
+        """Dernière requête lente (ou, à défaut, la plus lente des requêtes récentes)"""
+        for trace in reversed(self.recent):
+            if trace.duration >= self.slow_seconds:
+                return trace
+        return max(self.recent, key=lambda trace: trace.duration, default=None)
+
+    def format_summary(self, trace: Trace) -> str:
+        """Résumé d'une trace : spans dans l'ordre, indentés par niveau, avec leur part de la durée totale"""
+        started = datetime.fromtimestamp(trace.wall_start).strftime('%Y-%m-%d %H:%M:%S')
+        attrs = ', '.join(f"{key}={value}" for key, value in trace.attrs.items())
+        lines = [f"Trace {trace.id} — {trace.name} ({attrs}) — {trace.duration:.2f}s — {started}"]
+
+        depth = {0: 0}
+        for span in sorted(trace.spans, key=lambda span: span.start):
+            depth[span.span_id] = depth.get(span.parent_id, 0) + 1
+        shown = sorted(trace.spans, key=lambda span: span.start)
+        if len(shown) > 25:
+            # Requêtes à nombreux spans (documents) : les plus longs seulement
+            kept = set(id(span) for span in sorted(shown, key=lambda span: span.duration, reverse=True)[:25])
+            shown = [span for span in shown if id(span) in kept]
+        for span in shown:
+            share = span.duration / trace.duration if trace.duration else 0.0
+            offset = span.start - trace.start
+            details = ', '.join(f"{key}={value}" for key, value in span.attrs.items())
+            indent = '  ' * (depth[span.span_id] - 1)
+            lines.append(
+                f"{offset:>6.2f}s {indent}{span.name:<{max(1, 26 - len(indent))}} {span.duration:>7.3f}s {share:>4.0%}"
+                + (f"  {details}" if details else "")
+            )
+
+        covered = sum(span.duration for span in trace.spans if span.parent_id == 0)
+        lines.append(f"Non instrumenté : {max(0.0, trace.duration - covered):.2f}s")
+        return '\n'.join(lines)
+
+# Traceur partagé par tous les modules
+tracer = Tracer()
+
+def traced(name: str = None):
+    """Décorateur : mesure chaque appel d'une coroutine comme un span de la requête en cours"""
+    def decorator(function):
+        span_name = name or function.__name__
+
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            with Span(span_name, {}):
+                return await function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,96 @@
+import os
+import json
+import time
+import hashlib
+from datetime import datetime
+from contextvars import ContextVar
+from .persistence import persistence
+
+# Enveloppe de la requête en cours : complétée par les étapes (API, réponse Discord) sans être transmise
+_current_envelope = ContextVar('current_envelope', default=None)
+
+
+class TrafficEnvelope:
+    """Forme d'une requête enregistrée : tailles, profondeurs et durées, jamais le contenu des messages"""
+
+    __slots__ = ('fields', 'start', '_token')
+
+    def __init__(self, fields: dict):
+        self.fields = fields
+        self.start = time.perf_counter()
+
+
+class TrafficRecorder:
+    """Enregistrement du trafic réel (TRAFFIC_RECORD=true), rejoué ensuite par benchmarks.replay_traffic.
+
+    Une ligne JSON par requête dans data/traffic : type de commande, salon et utilisateur pseudonymisés
+    (empreinte salée), profondeur de chaîne, taille du prompt et de l'historique, durées de l'API et de la
+    requête, tailles de la réponse et appels REST Discord. Aucun texte n'est gardé.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv('TRAFFIC_RECORD', 'false').lower() == 'true'
+        self.traffic_dir = os.getenv('TRAFFIC_DIR', 'data/traffic')
+        # Sel des empreintes : fixé, les salons se retrouvent d'un redémarrage à l'autre
+        self.salt = os.getenv('TRAFFIC_SALT') or os.urandom(16).hex()
+
+    def pseudonym(self, value) -> str:
+        return hashlib.sha1(f"{self.salt}|{value}".encode()).hexdigest()[:12]
+
+    def begin(self, kind: str, channel_id, user_id, **fields):
+        """Ouvre l'enveloppe d'une requête (None si l'enregistrement est désactivé)"""
+        if not self.enabled:
+            return None
+        envelope = TrafficEnvelope(dict(
+            ts=round(time.time(), 3), kind=kind,
+            channel=self.pseudonym(channel_id), user=self.pseudonym(user_id), **fields
+        ))
+        envelope._token = _current_envelope.set(envelope)
+        return envelope
+
+    @staticmethod
+    def note(**fields):
+        """Complète l'enveloppe de la requête en cours (sans effet hors enregistrement)"""
+        envelope = _current_envelope.get()
+        if envelope is not None:
+            envelope.fields.update(fields)
+
+    @staticmethod
+    def add(field: str, value):
+        """Ajoute `value` à un compteur de l'enveloppe en cours (appels REST, tentatives...)"""
+        envelope = _current_envelope.get()
+        if envelope is not None:
+            envelope.fields[field] = envelope.fields.get(field, 0) + value
+
+    @staticmethod
+    def mark(field: str):
+        """Enregistre le temps écoulé depuis le début de la requête en cours (attente dans la file...)"""
+        envelope = _current_envelope.get()
+        if envelope is not None:
+            envelope.fields[field] = round(time.perf_counter() - envelope.start, 4)
+
+    @staticmethod
+    def prompt_shape(messages: list) -> dict:
+        """Taille du prompt envoyé : messages, caractères de texte et images"""
+        chars = images = 0
+        for message in messages:
+            for block in message['content']:
+                if block['type'] == 'text':
+                    chars += len(block['text'])
+                else:
+                    images += 1
+        return {'prompt_messages': len(messages), 'prompt_chars': chars, 'prompt_images': images}
+
+    def end(self, envelope, status: str = 'ok'):
+        """Ferme l'enveloppe et l'ajoute au fichier du jour (dans le pool de persistance)"""
+        if envelope is None:
+            return
+        _current_envelope.reset(envelope._token)
+        fields = envelope.fields
+        fields.setdefault('status', status)
+        fields['total_seconds'] = round(time.perf_counter() - envelope.start, 4)
+        path = f"{self.traffic_dir}/traffic_{datetime.now().date().isoformat()}.jsonl"
+        persistence.submit(path, persistence.append_text, path, json.dumps(fields) + '\n')
+
+# Enregistreur partagé par tous les modules
+recorder = TrafficRecorder()